@@ -0,0 +1,9 @@
+# ai_providers/errors.py
+
+
+class ProviderUnavailableError(Exception):
+    """
+    Провайдер нейросети временно недоступен (таймаут, ошибка сети, 5xx или 429)
+
+    Такой запрос можно повторить у другого провайдера.
+    """
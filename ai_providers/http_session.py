@@ -0,0 +1,54 @@
+# ai_providers/http_session.py
+import aiohttp
+from typing import Optional
+from config.env import conf
+from config.logging_config import logger
+
+# Общая HTTP-сессия процесса: keep-alive, DNS-кэш и лимит соединений
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    """Создание сессии с пулом соединений по настройкам из конфига"""
+    connector = aiohttp.TCPConnector(
+        limit=conf.http.pool_limit,
+        limit_per_host=conf.http.pool_limit_per_host,
+        ttl_dns_cache=conf.http.dns_cache_ttl,
+        keepalive_timeout=conf.http.keepalive_timeout
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=conf.http.request_timeout)
+    )
+
+
+async def init_http_session() -> aiohttp.ClientSession:
+    """Открытие общей HTTP-сессии (вызывается при старте бота)"""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+        logger.debug(f"🌐 HTTP-сессия открыта (лимит соединений: {conf.http.pool_limit})")
+    return _session
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую HTTP-сессию процесса
+
+    Если сессия ещё не открыта (например, в скриптах без main()), она создаётся лениво.
+    Вызывать только внутри работающего event loop.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+        logger.debug("🌐 HTTP-сессия открыта лениво")
+    return _session
+
+
+async def close_http_session():
+    """Закрытие общей HTTP-сессии (вызывается при остановке бота)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.debug("🌐 HTTP-сессия закрыта")
+    _session = None
@@ -0,0 +1,144 @@
+# ai_providers/llm_cache.py
+import aiosqlite
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from config.env import conf
+from config.logging_config import logger
+
+
+class LLMCache:
+    """
+    Двухуровневый кэш ответов нейросетей
+
+    Первый уровень — LRU-словарь в памяти процесса, второй — таблица SQLite на диске,
+    которая переживает перезапуск бота. Записи старше TTL считаются устаревшими
+    на обоих уровнях, при превышении лимита размера вытесняются давно не использованные.
+    """
+
+    def __init__(self, path: str, ttl: int, memory_size: int, disk_size: int):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, style: str, temperature: float, prompt: str) -> str:
+        """Ключ кэша: хэш от провайдера, модели, стиля, температуры и промпта"""
+        raw = json.dumps([provider, model, style, temperature, prompt], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def stats(self) -> dict:
+        """Счётчики попаданий и промахов"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        async with self._db_lock:
+            if self._db is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._db = await aiosqlite.connect(self.path)
+                await self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                await self._db.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+                await self._db.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_created_at ON llm_cache (created_at)")
+                await self._db.commit()
+            return self._db
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        created_at, value = item
+        if now - created_at > self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str, created_at: float):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        """Поиск ответа в кэше: сначала в памяти, затем на диске"""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        try:
+            db = await self._get_db()
+            async with db.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                await db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                await db.commit()
+                self._memory_set(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[0]
+        except Exception as e:
+            logger.warning(f"[LLMCache] Ошибка чтения дискового кэша: {e}")
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        """Сохранение ответа в оба уровня кэша"""
+        now = time.time()
+        self._memory_set(key, value, now)
+        try:
+            db = await self._get_db()
+            await db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            # Удаляем устаревшие записи и вытесняем давно не использованные сверх лимита
+            await db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            await db.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_size,)
+            )
+            await db.commit()
+        except Exception as e:
+            logger.warning(f"[LLMCache] Ошибка записи в дисковый кэш: {e}")
+
+    async def close(self):
+        """Закрытие соединения с дисковым кэшем (вызывается при остановке бота)"""
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+        logger.info(f"[LLMCache] Статистика кэша: {self.stats()}")
+
+
+# Глобальный экземпляр кэша
+llm_cache = LLMCache(
+    path=conf.llm_cache.path,
+    ttl=conf.llm_cache.ttl,
+    memory_size=conf.llm_cache.memory_size,
+    disk_size=conf.llm_cache.disk_size
+)
@@ -0,0 +1,177 @@
+# ai_providers/rate_limiter.py
+import asyncio
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncContextManager, Dict, Optional
+from config.env import conf, RateLimit
+from config.logging_config import logger
+
+# Пауза после ответа 429 без заголовка Retry-After (секунды)
+DEFAULT_RETRY_AFTER = 1.0
+# Ожидание в очереди дольше этого времени попадает в лог (секунды)
+SLOW_WAIT_THRESHOLD = 5.0
+
+
+class TokenBucket:
+    """Корзина токенов: не более rate запросов в секунду в среднем и не более burst подряд"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated: Optional[float] = None
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self):
+        """Ожидание и получение одного токена"""
+        if self.rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self._refill(now)
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Приостановка выдачи токенов (например, после ответа 429)"""
+        loop = asyncio.get_running_loop()
+        self.paused_until = max(self.paused_until, loop.time() + seconds)
+        self.tokens = 0.0
+
+
+class Limiter:
+    """
+    Ограничитель одного провайдера или эндпоинта
+
+    Сочетает корзину токенов (запросы в секунду) и семафор (одновременные операции).
+    Ожидающие запросы обслуживаются строго в порядке поступления.
+    """
+
+    def __init__(self, name: str, rps: float, burst: int, concurrency: int):
+        self.name = name
+        self._bucket = TokenBucket(rps, burst)
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        # asyncio.Lock пропускает ожидающих в порядке очереди (FIFO)
+        self._queue = asyncio.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занятие слота на время запроса (для потоковых ответов — на всё время чтения потока)"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.waiting += 1
+        try:
+            async with self._queue:
+                if self._semaphore is not None:
+                    await self._semaphore.acquire()
+                try:
+                    await self._bucket.take()
+                except BaseException:
+                    if self._semaphore is not None:
+                        self._semaphore.release()
+                    raise
+        finally:
+            self.waiting -= 1
+        wait = loop.time() - started
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > SLOW_WAIT_THRESHOLD:
+            logger.debug(f"[RateLimiter] {self.name}: ожидание в очереди {wait:.1f} с (в очереди ещё {self.waiting})")
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def pause(self, seconds: float):
+        self._bucket.pause(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "acquired": self.acquired,
+            "avg_wait": round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+
+class RateLimiter:
+    """
+    Общий на процесс ограничитель частоты запросов к API нейросетей
+
+    Лимиты задаются для провайдера ("yandex_gpt") и при необходимости отдельно
+    для эндпоинта ("yandex_art:operations"). Лимит эндпоинта, если он задан,
+    заменяет лимит провайдера.
+    """
+
+    def __init__(self, enabled: bool, limits: Dict[str, RateLimit]):
+        self.enabled = enabled
+        self._limiters = {
+            name: Limiter(name, limit.rps, limit.burst, limit.concurrency)
+            for name, limit in limits.items()
+        }
+
+    def _limiter(self, provider: str, endpoint: str) -> Optional[Limiter]:
+        return self._limiters.get(f"{provider}:{endpoint}") or self._limiters.get(provider)
+
+    def slot(self, provider: str, endpoint: str) -> AsyncContextManager:
+        """
+        Контекст запроса к API: ожидание очереди, лимита частоты и свободного слота
+
+        Пример:
+            async with rate_limiter.slot("yandex_gpt", "completion"):
+                ...
+        """
+        limiter = self._limiter(provider, endpoint) if self.enabled else None
+        return limiter.slot() if limiter is not None else nullcontext()
+
+    def pause(self, provider: str, endpoint: str, seconds: Optional[float] = None):
+        """Провайдер ответил 429: новые запросы к нему не отправляются seconds секунд"""
+        limiter = self._limiter(provider, endpoint) if self.enabled else None
+        if limiter is not None:
+            seconds = seconds if seconds is not None else DEFAULT_RETRY_AFTER
+            limiter.pause(seconds)
+            logger.warning(f"[RateLimiter] {limiter.name}: лимит запросов превышен, пауза {seconds:.1f} с")
+
+    def stats(self) -> dict:
+        """Глубина очереди, число выполняющихся запросов и время ожидания по каждому лимиту"""
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+
+def retry_after(headers) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах (если он есть и задан числом)"""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# Глобальный экземпляр ограничителя
+rate_limiter = RateLimiter(
+    enabled=conf.rate_limit.enabled,
+    limits={
+        "yandex_gpt": conf.rate_limit.yandex_gpt,
+        "yandex_art": conf.rate_limit.yandex_art,
+        "yandex_art:operations": conf.rate_limit.yandex_art_operations,
+        "openai_api": conf.rate_limit.openai,
+    }
+)
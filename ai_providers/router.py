@@ -0,0 +1,365 @@
+# ai_providers/router.py
+import asyncio
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from importlib import import_module
+from statistics import median
+from types import ModuleType
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from ai_providers.errors import ProviderUnavailableError
+from config.env import conf
+from config.logging_config import logger
+
+T = TypeVar("T")
+
+# Задержка, которая приписывается провайдеру без истории вызовов (секунды)
+DEFAULT_LATENCY = 5.0
+# Вес доли ошибок при ранжировании: задержка умножается на (1 + вес * доля ошибок)
+ERROR_RATE_WEIGHT = 4.0
+# Ошибки, после которых запрос передаётся следующему провайдеру
+FAILOVER_ERRORS = (ProviderUnavailableError, asyncio.TimeoutError)
+
+# Провайдер и модель, обслужившие последний вызов в текущем контексте (задаче)
+_served: ContextVar[Optional[Tuple[str, str]]] = ContextVar("ai_provider_served", default=None)
+
+
+class ProviderHealth:
+    """Скользящая статистика одного провайдера: задержки, исходы вызовов и время исключения"""
+
+    def __init__(self, name: str, module: ModuleType, window: int):
+        self.name = name
+        self.module = module
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def latency(self) -> float:
+        """Медианная задержка успешных вызовов в окне"""
+        return median(self.latencies) if self.latencies else DEFAULT_LATENCY
+
+    @property
+    def error_rate(self) -> float:
+        """Доля неудачных вызовов в окне"""
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self) -> float:
+        """Чем меньше, тем здоровее провайдер"""
+        return self.latency * (1 + ERROR_RATE_WEIGHT * self.error_rate)
+
+    def latency_percentile(self, percentile: float) -> float:
+        """Перцентиль задержки успешных вызовов в окне (percentile от 0 до 1)"""
+        ordered = sorted(self.latencies)
+        index = min(max(math.ceil(percentile * len(ordered)) - 1, 0), len(ordered) - 1)
+        return ordered[index]
+
+
+class ProviderRouter:
+    """
+    Маршрутизатор запросов к текстовым нейросетям
+
+    Каждый вызов отправляется самому здоровому провайдеру (по медианной задержке и доле
+    ошибок за последние вызовы). При таймауте, сетевой ошибке, 5xx или 429 запрос
+    автоматически повторяется у следующего провайдера. Провайдер, несколько раз подряд
+    не ответивший, исключается на время cooldown.
+
+    Для вызовов с hedge=True (если дублирование включено) запрос, не вернувшийся за
+    перцентиль недавних задержек, дублируется резервному провайдеру (или тому же, если
+    других нет): побеждает первый ответ, проигравший запрос отменяется. Лишние токены
+    дублей (hedges.extra_tokens) — промпт проигравшего запроса и его ответ; ответ отменённого
+    запроса провайдер не сообщает, поэтому он оценивается сверху ответом победителя.
+    """
+
+    def __init__(self, providers: Dict[str, ModuleType], call_timeout: float, window: int,
+                 failure_threshold: int, cooldown: float, hedge_enabled: bool = False,
+                 hedge_percentile: float = 0.95, hedge_min_delay: float = 2.0, hedge_min_samples: int = 5):
+        self.call_timeout = call_timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self._providers = [ProviderHealth(name, module, window) for name, module in providers.items()]
+        # Счётчики дублирующих запросов
+        self.hedges_launched = 0
+        self.hedges_won = 0
+        self.hedge_extra_tokens = 0
+
+    def ranked(self) -> List[ProviderHealth]:
+        """Провайдеры от самого здорового к наименее здоровому (исключённые — в конце)"""
+        now = time.monotonic()
+        # Сортировка устойчивая: при равных показателях сохраняется порядок из конфига
+        return sorted(self._providers, key=lambda p: (not p.available(now), p.score()))
+
+    def preferred(self) -> ProviderHealth:
+        """Провайдер, которому будет отправлен следующий вызов"""
+        return self.ranked()[0]
+
+    @staticmethod
+    def served() -> Optional[Tuple[str, str]]:
+        """Провайдер и модель, обслужившие последний вызов в текущей задаче"""
+        return _served.get()
+
+    def provider(self, name: str) -> ProviderHealth:
+        """Провайдер по имени"""
+        return next(p for p in self._providers if p.name == name)
+
+    @staticmethod
+    def mark_cached(provider: ProviderHealth, model: str):
+        """Ответ взят из кэша: запоминаем провайдера и модель, которые его когда-то сгенерировали"""
+        _served.set((provider.name, model))
+
+    async def _mark_served(self, provider: ProviderHealth):
+        _served.set((provider.name, await provider.module.get_current_model()))
+
+    def _record_success(self, provider: ProviderHealth, latency: float):
+        provider.latencies.append(latency)
+        provider.outcomes.append(True)
+        provider.consecutive_failures = 0
+
+    def _record_failure(self, provider: ProviderHealth):
+        provider.outcomes.append(False)
+        provider.consecutive_failures += 1
+        if provider.consecutive_failures >= self.failure_threshold:
+            provider.cooldown_until = time.monotonic() + self.cooldown
+            provider.consecutive_failures = 0
+            logger.warning(f"[AIRouter] Провайдер {provider.name} исключён на {self.cooldown:.0f} с после серии ошибок")
+
+    def hedge_delay(self, provider: ProviderHealth) -> Optional[float]:
+        """Время ожидания ответа, после которого отправляется дубль (None — замеров пока мало)"""
+        if len(provider.latencies) < self.hedge_min_samples:
+            return None
+        return max(provider.latency_percentile(self.hedge_percentile), self.hedge_min_delay)
+
+    def _hedge_target(self, provider: ProviderHealth) -> ProviderHealth:
+        """Провайдер для дубля: следующий доступный по здоровью или тот же самый"""
+        now = time.monotonic()
+        for candidate in self.ranked():
+            if candidate is not provider and candidate.available(now):
+                return candidate
+        return provider
+
+    def _count_hedge_tokens(self, loser: asyncio.Task, winner_result, prompt_tokens: int,
+                            completion_tokens: Optional[Callable[[T], int]]):
+        """Учёт токенов проигравшего запроса: промпт известен до отправки, ответ — из его результата"""
+        if completion_tokens is None:
+            return
+        if not loser.done():
+            # Запрос будет отменён: сколько он успел сгенерировать, неизвестно — не больше ответа победителя
+            completion = completion_tokens(winner_result)
+        elif loser.cancelled() or loser.exception() is not None:
+            completion = 0
+        else:
+            completion = completion_tokens(loser.result())
+        self.hedge_extra_tokens += prompt_tokens + completion
+
+    async def _run_hedged(self, provider: ProviderHealth, operation: Callable[[ModuleType], Awaitable[T]],
+                          prompt_tokens: int = 0,
+                          completion_tokens: Optional[Callable[[T], int]] = None) -> Tuple[ProviderHealth, T, float]:
+        """
+        Вызов с дублированием медленного запроса
+
+        Returns:
+            Провайдер, давший ответ первым, сам ответ и задержка этого запроса
+
+        Raises:
+            Ошибку основного запроса, если не удался ни один из запросов
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        delay = self.hedge_delay(provider)
+        if delay is None:
+            return provider, await operation(provider.module), loop.time() - started
+        primary = asyncio.create_task(operation(provider.module))
+        tasks = {primary: provider}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return provider, primary.result(), loop.time() - started
+            backup = self._hedge_target(provider)
+            self.hedges_launched += 1
+            logger.info(f"[AIRouter] {provider.name} не ответил за {delay:.1f} с, дублируем запрос в {backup.name}")
+            hedge_started = loop.time()
+            secondary = asyncio.create_task(operation(backup.module))
+            tasks[secondary] = backup
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    result = task.result()
+                    self._count_hedge_tokens(secondary if task is primary else primary, result,
+                                             prompt_tokens, completion_tokens)
+                    if task is primary:
+                        if secondary.done() and secondary.exception() is not None:
+                            self._record_failure(backup)
+                        return provider, result, loop.time() - started
+                    self.hedges_won += 1
+                    # Основной запрос медленнее дубля — его задержка не меньше уже прошедшего времени
+                    provider.latencies.append(loop.time() - started)
+                    if primary.done() and primary.exception() is not None:
+                        self._record_failure(provider)
+                    return backup, result, loop.time() - hedge_started
+            # Не удались оба запроса: ошибку основного учтёт вызывающий код
+            if completion_tokens is not None:
+                self.hedge_extra_tokens += prompt_tokens
+            if backup is not provider:
+                self._record_failure(backup)
+            raise primary.exception()
+        finally:
+            # Проигравший (или прерванный таймаутом) запрос отменяется
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, operation: Callable[[ModuleType], Awaitable[T]],
+                   is_failure: Optional[Callable[[T], bool]] = None, hedge: bool = False, hedge_prompt_tokens: int = 0,
+                   hedge_completion_tokens: Optional[Callable[[T], int]] = None) -> T:
+        """
+        Выполнение вызова у самого здорового провайдера с переключением при недоступности
+
+        Args:
+            operation (Callable): Функция, принимающая модуль провайдера и возвращающая корутину
+            is_failure (Callable): Проверка результата; True — результат неполноценный
+                                   (например, запасные темы), стоит попробовать другого провайдера
+            hedge (bool): Разрешить дублирование медленного запроса (если оно включено в конфиге)
+            hedge_prompt_tokens (int): Токены промпта — для учёта стоимости дублей
+            hedge_completion_tokens (Callable): Оценка токенов ответа по результату — для учёта стоимости дублей
+
+        Returns:
+            Результат первого успешного вызова; если успешных нет, но был неполноценный результат, — он
+
+        Raises:
+            ProviderUnavailableError: Ни один провайдер не ответил
+        """
+        last_error: Optional[BaseException] = None
+        degraded: Optional[Tuple[ProviderHealth, T]] = None
+        for provider in self.ranked():
+            started = time.monotonic()
+            served_by = provider
+            try:
+                async with asyncio.timeout(self.call_timeout):
+                    if hedge and self.hedge_enabled:
+                        served_by, result, latency = await self._run_hedged(provider, operation, hedge_prompt_tokens,
+                                                                              hedge_completion_tokens)
+                    else:
+                        result = await operation(provider.module)
+                        latency = time.monotonic() - started
+            except FAILOVER_ERRORS as e:
+                self._record_failure(provider)
+                logger.warning(f"[AIRouter] {provider.name} недоступен ({e!r}), переключаемся на следующего провайдера")
+                last_error = e
+                continue
+            except Exception:
+                self._record_failure(provider)
+                raise
+            if is_failure is not None and is_failure(result):
+                self._record_failure(provider)
+                logger.warning(f"[AIRouter] {provider.name} вернул неполноценный ответ, пробуем следующего провайдера")
+                if degraded is None:
+                    degraded = (provider, result)
+                continue
+            self._record_success(served_by, latency)
+            await self._mark_served(served_by)
+            return result
+        if degraded is not None:
+            await self._mark_served(degraded[0])
+            return degraded[1]
+        raise ProviderUnavailableError("Все провайдеры нейросетей недоступны") from last_error
+
+    async def stream(self, operation: Callable[[ModuleType], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Потоковый вызов с переключением провайдера
+
+        Переключение возможно только до получения первого фрагмента: после этого
+        пользователь уже видит текст, и ошибка передаётся вызывающему коду.
+        """
+        last_error: Optional[BaseException] = None
+        for provider in self.ranked():
+            started = time.monotonic()
+            chunks = operation(provider.module)
+            try:
+                try:
+                    async with asyncio.timeout(self.call_timeout):
+                        first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    self._record_success(provider, time.monotonic() - started)
+                    await self._mark_served(provider)
+                    return
+                except FAILOVER_ERRORS as e:
+                    self._record_failure(provider)
+                    logger.warning(f"[AIRouter] {provider.name} недоступен ({e!r}), переключаемся на следующего провайдера")
+                    last_error = e
+                    continue
+                except Exception:
+                    self._record_failure(provider)
+                    raise
+                await self._mark_served(provider)
+                yield first
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                except Exception:
+                    self._record_failure(provider)
+                    raise
+                self._record_success(provider, time.monotonic() - started)
+                return
+            finally:
+                await chunks.aclose()
+        raise ProviderUnavailableError("Все провайдеры нейросетей недоступны") from last_error
+
+    def stats(self) -> dict:
+        """Текущие показатели провайдеров"""
+        now = time.monotonic()
+        return {
+            p.name: {
+                "latency": round(p.latency, 2),
+                "error_rate": round(p.error_rate, 3),
+                "calls": len(p.outcomes),
+                "cooldown": round(max(p.cooldown_until - now, 0), 1),
+            }
+            for p in self._providers
+        } | {
+            "hedges": {
+                "launched": self.hedges_launched,
+                "won": self.hedges_won,
+                "extra_tokens": self.hedge_extra_tokens,
+            }
+        }
+
+
+def _provider_configured(name: str) -> bool:
+    """Провайдер без API-ключа в маршрутизацию не включается"""
+    if name == "yandex_gpt":
+        return bool(conf.yandex.gpt_api_key)
+    if name == "openai_api":
+        return bool(conf.openai.api_key)
+    return True
+
+
+def _load_providers(names: List[str]) -> Dict[str, ModuleType]:
+    """Импорт клиентов провайдеров (пакет <name> с модулем client) из списка в конфиге"""
+    configured = [name for name in names if _provider_configured(name)] or names[:1]
+    return {name: import_module(f"{name}.client") for name in configured}
+
+
+# Глобальный экземпляр маршрутизатора
+router = ProviderRouter(
+    providers=_load_providers(conf.ai_router.providers),
+    call_timeout=conf.ai_router.call_timeout,
+    window=conf.ai_router.window,
+    failure_threshold=conf.ai_router.failure_threshold,
+    cooldown=conf.ai_router.cooldown,
+    hedge_enabled=conf.ai_router.hedge_enabled,
+    hedge_percentile=conf.ai_router.hedge_percentile,
+    hedge_min_delay=conf.ai_router.hedge_min_delay,
+    hedge_min_samples=conf.ai_router.hedge_min_samples
+)
@@ -0,0 +1,66 @@
+# benchmarks/bench_media_writer.py
+"""
+Микро-бенчмарк: пиковая память и время сохранения изображения из base64
+при полном декодировании с синхронной записью (старое поведение) и при
+потоковой записи через media_store.writer (текущее поведение).
+
+Пик измеряется tracemalloc сверх уже загруженной base64-строки (она в любом
+случае приходит целиком в JSON-ответе Yandex.Art).
+
+Запуск:
+    python -m benchmarks.bench_media_writer --size-mb 4 --runs 5
+"""
+import argparse
+import asyncio
+import base64
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from media_store.writer import B64_CHUNK_SIZE, write_base64_file
+
+
+def write_full_decode(data_b64: str, path: str):
+    """Старое поведение: всё изображение декодируется в память и пишется блокирующим вызовом"""
+    image_data = base64.b64decode(data_b64)
+    with open(path, "wb") as f:
+        f.write(image_data)
+
+
+async def measure(label: str, write, data_b64: str, directory: str, runs: int):
+    peaks = []
+    timings = []
+    for run in range(runs):
+        path = os.path.join(directory, f"{label}_{run}.jpg")
+        tracemalloc.start()
+        started = time.perf_counter()
+        await write(data_b64, path)
+        timings.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        os.remove(path)
+    print(f"{label:<22} peak={max(peaks) / 1024:9.1f} KiB  mean={statistics.mean(timings):7.2f} ms")
+    return max(peaks)
+
+
+async def main(size_mb: float, runs: int):
+    data_b64 = base64.b64encode(os.urandom(int(size_mb * 1024 * 1024))).decode()
+
+    async def before(data, path):
+        write_full_decode(data, path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        before_peak = await measure("before (full decode)", before, data_b64, directory, runs)
+        after_peak = await measure("after (chunked)", write_base64_file, data_b64, directory, runs)
+    print(f"image: {size_mb} MiB, chunk: {B64_CHUNK_SIZE // 1024} KiB base64, "
+          f"peak reduction: x{before_peak / after_peak:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=4, help="Размер декодированного изображения (МиБ)")
+    parser.add_argument("--runs", type=int, default=5, help="Количество повторов")
+    args = parser.parse_args()
+    asyncio.run(main(args.size_mb, args.runs))
@@ -0,0 +1,98 @@
+# benchmarks/bench_yandex_gpt_session.py
+"""
+Микро-бенчмарк: задержка одного запроса к YandexGPT с новой сессией на каждый вызов
+(старое поведение) и с общей долгоживущей сессией (текущее поведение).
+
+Запросы идут в локальный stub-сервер, повторяющий формат ответа YandexGPT,
+поэтому ключи API и сеть не нужны.
+
+Запуск:
+    python -m benchmarks.bench_yandex_gpt_session --calls 300
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+# Бот создаётся при импорте config.env, поэтому подставляем формально валидный токен
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+
+import aiohttp
+from aiohttp import web
+from ai_providers.http_session import close_http_session, init_http_session
+from yandex_gpt.client import YandexGPTClient
+
+STUB_RESPONSE = {
+    "result": {
+        "alternatives": [{"message": {"role": "assistant", "text": "ok"}, "status": "ALTERNATIVE_STATUS_FINAL"}],
+        "usage": {"inputTextTokens": "1", "completionTokens": "1", "totalTokens": "2"},
+        "modelVersion": "stub"
+    }
+}
+
+
+async def stub_completion(request: web.Request) -> web.Response:
+    await request.read()
+    return web.json_response(STUB_RESPONSE)
+
+
+async def start_stub_server() -> tuple:
+    app = web.Application()
+    app.router.add_post("/foundationModels/v1/completion", stub_completion)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/foundationModels/v1/completion"
+
+
+async def request_with_new_session(client: YandexGPTClient, payload: dict):
+    """Старое поведение: новая ClientSession (и новое TCP-соединение) на каждый вызов"""
+    headers = {"Authorization": f"Bearer {client.api_key}", "Content-Type": "application/json"}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(client.api_url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            return await response.json()
+
+
+async def measure(label: str, call, calls: int) -> list:
+    # Прогрев
+    for _ in range(5):
+        await call()
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28} mean={statistics.mean(timings):7.3f} ms  "
+          f"p50={statistics.median(timings):7.3f} ms  p95={p95:7.3f} ms")
+    return timings
+
+
+async def main(calls: int):
+    runner, url = await start_stub_server()
+    client = YandexGPTClient()
+    client.api_url = url
+    payload = {
+        "modelUri": client.model_uri,
+        "completionOptions": {"stream": False, "temperature": 0.5, "maxTokens": 10},
+        "messages": [{"role": "user", "text": "ping"}]
+    }
+    try:
+        before = await measure("before (session per call)", lambda: request_with_new_session(client, payload), calls)
+        await init_http_session()
+        after = await measure("after (shared session)", lambda: client._make_request(payload), calls)
+        print(f"speedup (mean): x{statistics.mean(before) / statistics.mean(after):.2f}")
+    finally:
+        await close_http_session()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300, help="Количество измеряемых вызовов")
+    args = parser.parse_args()
+    asyncio.run(main(args.calls))
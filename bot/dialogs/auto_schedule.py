@@ -1,4 +1,5 @@
 # bot/dialogs/auto_schedule.py
+import asyncio
 import math
 import re
 from aiogram.types import CallbackQuery, Message
@@ -6,17 +7,19 @@ from aiogram_dialog import Dialog, Window, DialogManager, StartMode
 from aiogram_dialog.widgets.input import TextInput
 from aiogram_dialog.widgets.kbd import Button, Row, Calendar, Column, Multiselect, Next, Back, Select, SwitchTo
 from aiogram_dialog.widgets.text import Const, Format, List as DList
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, time as dt_time
 from typing import Any, Dict
+from sqlalchemy import update
 
 from bot.dialogs import states
-from bot.themes import get_global_themes, set_global_themes
+from bot.themes import deduplicate_themes, get_global_themes, set_global_themes
 from config.config import generate_travel_themes, generate_text, generate_image_prompt, get_current_model
 from config.env import bot_global, conf, datetime_local
 from config.logging_config import logger, async_log_exception
 from database.models import GenerationType, Post, AsyncSessionLocal
 from yandex_art.client import generate_image
+from scheduler.content import save_schedule_plan
 from scheduler.jobs import schedule_post_job
 from .common import MAIN_MENU_MAIN_BUTTON
 
@@ -37,6 +40,11 @@ DEFAULT_TIME = "09:30"
 TRAVEL_THEMES_KEY = 'key_themes'
 TRAVEL_THEMES_ID = 'themes_select'
 MAX_UPDATE_INTERVAL = 5  # секунды между обновлениями сообщения
+TEXT_STAGE_CONCURRENCY = 4  # одновременных генераций текста и промпта при автопланировании
+IMAGE_STAGE_CONCURRENCY = 3  # одновременных генераций изображений при автопланировании
+THEMES_CHUNK_SIZE = 15  # тем в одном запросе к нейросети
+THEMES_CONCURRENCY = 3  # одновременных запросов на генерацию тем
+THEMES_TOP_UP_ROUNDS = 2  # дополнительных запросов, если после удаления повторов тем не хватает
 
 
 @dataclass
@@ -45,6 +53,26 @@ class TravelThemesGroup:
     name: str
 
 
+@dataclass
+class PipelineProgress:
+    """Счётчики стадий конвейера генерации постов"""
+    total: int
+    texts_done: int = 0
+    images_done: int = 0
+    scheduled: int = 0
+    failed: int = 0
+    last_update_time: datetime = field(default_factory=datetime.now)
+
+    def render(self) -> str:
+        text = (f"⏳ Генерация постов...\n"
+                f"✍️ Тексты: {self.texts_done} из {self.total}\n"
+                f"🖼️ Изображения: {self.images_done} из {self.total}\n"
+                f"📅 Запланировано: {self.scheduled} из {self.total}")
+        if self.failed:
+            text += f"\n❌ Ошибок: {self.failed}"
+        return text
+
+
 @async_log_exception
 async def start_auto_schedule(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
     """Инициализация начальных данных"""
@@ -270,6 +298,47 @@ async def on_remove_custom_theme(callback: CallbackQuery, button: Button, dialog
         await callback.message.answer(f"🗑️ Тема удалена: {removed_theme}")
 
 
+@async_log_exception
+async def generate_unique_themes(count: int) -> list:
+    """
+    Генерация заданного количества уникальных тем
+
+    Порции по THEMES_CHUNK_SIZE запрашиваются параллельно (не более THEMES_CONCURRENCY
+    одновременно), результаты объединяются без повторов. Недостающие после удаления
+    повторов темы добираются небольшими дополнительными запросами.
+    Запасной список тем используется, только если не удалось получить ни одной темы.
+    """
+    semaphore = asyncio.Semaphore(THEMES_CONCURRENCY)
+
+    async def request_chunk(chunk_size: int, exclude: list) -> dict:
+        async with semaphore:
+            return await generate_travel_themes(count=chunk_size, exclude=exclude or None)
+
+    chunk_sizes = [min(THEMES_CHUNK_SIZE, count - offset) for offset in range(0, count, THEMES_CHUNK_SIZE)]
+    responses = await asyncio.gather(*(request_chunk(size, []) for size in chunk_sizes), return_exceptions=True)
+    themes = []
+    fallback_themes = []
+    for top_up_round in range(THEMES_TOP_UP_ROUNDS + 1):
+        for response in responses:
+            if isinstance(response, Exception):
+                logger.error(f"Ошибка генерации порции тем: {response}")
+                continue
+            if not response or "themes" not in response:
+                continue
+            if response.get("fallback"):
+                fallback_themes.extend(response["themes"])
+                continue
+            themes.extend(deduplicate_themes(response["themes"], existing=themes))
+        missing = count - len(themes)
+        if missing <= 0 or top_up_round == THEMES_TOP_UP_ROUNDS:
+            break
+        logger.info(f"🔁 Не хватает {missing} уникальных тем, запрашиваю дополнительно")
+        responses = await asyncio.gather(request_chunk(min(missing, THEMES_CHUNK_SIZE), themes), return_exceptions=True)
+    if not themes:
+        themes = deduplicate_themes(fallback_themes)
+    return themes[:count]
+
+
 @async_log_exception
 async def on_generate_themes(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
     """Обработчик генерации новых тем"""
@@ -281,20 +350,7 @@ async def on_generate_themes(callback: CallbackQuery, button: Button, dialog_man
             return
         # Вычисляем количество тем с запасом (на 47% больше), но не менее 5
         new_theme_count = max(math.ceil(total_posts * 1.47), 5)
-        # Подготавливаем списки для хранения результатов
-        all_themes = []
-        remaining_posts = new_theme_count  # Теперь генерируем с запасом
-        # Генерируем темы порциями по 15
-        while remaining_posts > 0:
-            # Определяем количество тем для текущей генерации
-            current_count = min(remaining_posts, 15)
-            # Генерируем темы
-            new_themes = await generate_travel_themes(count=current_count)
-            # Добавляем новые темы в общий список
-            if new_themes and "themes" in new_themes:
-                all_themes.extend(new_themes["themes"])
-            # Уменьшаем счетчик оставшихся постов
-            remaining_posts -= current_count
+        all_themes = await generate_unique_themes(new_theme_count)
         # Обновляем глобальные темы
         set_global_themes({"themes": all_themes})
         # Обновление тем в диалоге
@@ -323,7 +379,10 @@ async def on_confirm_schedule(callback: CallbackQuery, button: Button, dialog_ma
     if not all(data.get(field) for field in required_fields):
         await callback.message.answer("❌ Не все параметры заданы. Пожалуйста, заполните все поля.")
         return
-    status_msg = await callback.message.answer("<b>⏳ Начинаю генерацию и планирование постов...</b>")
+    if conf.auto_schedule.deferred:
+        status_msg = await callback.message.answer("<b>⏳ Сохраняю план публикаций...</b>")
+    else:
+        status_msg = await callback.message.answer("<b>⏳ Начинаю генерацию и планирование постов...</b>")
     status_message_id = status_msg.message_id
     dialog_manager.dialog_data['status_message_id'] = status_message_id
     try:
@@ -352,18 +411,23 @@ async def on_confirm_schedule(callback: CallbackQuery, button: Button, dialog_ma
 
 @async_log_exception
 async def generate_and_schedule_posts(data: Dict[str, Any], status_message_id: int, chat_id: int):
-    """Генерация постов и планирование их публикации"""
+    """
+    Генерация постов и планирование их публикации
+
+    Посты проходят через конвейер из двух стадий (текст + промпт, изображение), у каждой
+    стадии свой лимит одновременных запросов, поэтому в работе одновременно находятся
+    несколько постов. Сохранение в БД и планирование выполняются строго в порядке расписания.
+    При AUTO_SCHEDULE_DEFERRED сохраняется только план, посты генерируются перед публикацией.
+    """
     selected_theme_names = data['selected_theme_names']
-    model_text = await get_current_model()
     daily_posts = data['daily_posts']
     publish_time = data['publish_time']
     start_date = data.get('start_date') or datetime_local().date()
     period_days = data['period_days']
     hour, minute = map(int, publish_time.split(":"))
     base_time = dt_time(hour=hour, minute=minute)
-    total_posts = period_days * daily_posts
-    posts_scheduled = 0
-    last_update_time = datetime.now()
+    # Формируем слоты расписания: (дата и время публикации, тема)
+    slots = []
     for day in range(period_days):
         current_date = start_date + timedelta(days=day)
         for post_num in range(daily_posts):
@@ -371,40 +435,90 @@ async def generate_and_schedule_posts(data: Dict[str, Any], status_message_id: i
             scheduled_datetime = datetime.combine(current_date, base_time) + timedelta(minutes=post_num)  # Смещение на минуты для уникальности
             # Выбираем тему
             theme = selected_theme_names[(day * daily_posts + post_num) % len(selected_theme_names)]
+            slots.append((scheduled_datetime, theme))
+    if conf.auto_schedule.deferred:
+        # Отложенная генерация: сохраняем план, текст и изображения сгенерирует фоновая задача
+        post_ids = await save_schedule_plan(slots, conf.auto_schedule.image_style)
+        for (scheduled_datetime, theme), post_id in zip(slots, post_ids):
+            await schedule_post_job(scheduled_datetime, post_id)
+        logger.info(f"Сохранён план из {len(post_ids)} постов, генерация за "
+                    f"{conf.auto_schedule.lead_time / 3600:g} ч до публикации")
+        return
+    progress = PipelineProgress(total=len(slots))
+    text_semaphore = asyncio.Semaphore(TEXT_STAGE_CONCURRENCY)
+    image_semaphore = asyncio.Semaphore(IMAGE_STAGE_CONCURRENCY)
+
+    async def report_progress():
+        """Обновление статусного сообщения не чаще одного раза в MAX_UPDATE_INTERVAL секунд"""
+        now = datetime.now()
+        if (now - progress.last_update_time).total_seconds() <= MAX_UPDATE_INTERVAL:
+            return
+        progress.last_update_time = now
+        try:
+            await bot_global.edit_message_text(chat_id=chat_id, message_id=status_message_id, text=progress.render())
+        except Exception as e:
+            logger.debug(f"Не удалось обновить статус генерации: {e}")
+
+    async def generate_post_content(scheduled_datetime: datetime, theme: str):
+        """Генерация текста, промпта и изображения для одного поста"""
+        async with text_semaphore:
+            # Генерируем текст поста и промпт для изображения
+            post_text = await generate_text(theme, use_cache=False)
+            # Модель фиксируем сразу: текст мог сгенерировать резервный провайдер
+            model_text = await get_current_model()
+            image_prompt = await generate_image_prompt(post_text, use_cache=False)
+        # Сохраняем пост сразу после генерации текста: если бот перезапустится во время
+        # генерации изображения, незавершённое задание Yandex.Art прикрепит изображение к этому посту.
+        # В расписание пост попадает только в цикле планирования ниже, когда изображение готово
+        # и все предыдущие слоты уже запланированы
+        async with AsyncSessionLocal() as session:
+            post = Post(
+                text=post_text,
+                text_prompt=theme,
+                model_text=model_text,
+                image_prompt=image_prompt,
+                model_image=conf.yandex.art_model,
+                scheduled_at=scheduled_datetime,
+                is_scheduled=False,
+                status_text=GenerationType.SUCCESS,
+                status_image=GenerationType.PENDING
+            )
+            session.add(post)
+            await session.commit()
+            await session.refresh(post)
+        progress.texts_done += 1
+        await report_progress()
+        async with image_semaphore:
+            # Генерируем изображение (результат записывается в пост)
+            image_path = await generate_image(image_prompt, post_id=post.id)
+        progress.images_done += 1
+        await report_progress()
+        return post.id, image_path
+
+    tasks = [asyncio.create_task(generate_post_content(scheduled_datetime, theme)) for scheduled_datetime, theme in slots]
+    try:
+        # Планируем публикации в порядке расписания, не дожидаясь окончания всех генераций
+        for (scheduled_datetime, theme), task in zip(slots, tasks):
             try:
-                # Генерируем текст поста
-                post_text = await generate_text(theme)
-                # Генерируем изображение
-                image_prompt = await generate_image_prompt(post_text)
-                image_path = await generate_image(image_prompt)
-                # Сохраняем пост в БД
+                post_id, image_path = await task
+                if not image_path:
+                    logger.warning(f"Пост {post_id} запланирован без изображения")
+                # Планируем публикацию
                 async with AsyncSessionLocal() as session:
-                    post = Post(
-                        text=post_text,
-                        text_prompt=theme,
-                        model_text=model_text,
-                        image_path=image_path,
-                        image_prompt=image_prompt,
-                        model_image=conf.yandex.art_model,
-                        scheduled_at=scheduled_datetime,
-                        is_scheduled=True,
-                        status_text=GenerationType.SUCCESS,
-                        status_image=GenerationType.SUCCESS
-                    )
-                    session.add(post)
+                    await session.execute(update(Post).where(Post.id == post_id).values(is_scheduled=True))
                     await session.commit()
-                    await session.refresh(post)
-                    # Планируем публикацию
-                    await schedule_post_job(scheduled_datetime, post.id)
-                posts_scheduled += 1
-                now = datetime.now()
-                if (now - last_update_time).total_seconds() > MAX_UPDATE_INTERVAL:
-                    await bot_global.edit_message_text(chat_id=chat_id, message_id=status_message_id, text=f"⏳ Пост {posts_scheduled} из {total_posts} запланирован...")
-                    last_update_time = now
-                logger.info(f"Запланирован пост {post.id} на {scheduled_datetime}")
+                await schedule_post_job(scheduled_datetime, post_id)
+                progress.scheduled += 1
+                logger.info(f"Запланирован пост {post_id} на {scheduled_datetime}")
             except Exception as e:
+                progress.failed += 1
                 logger.error(f"Ошибка генерации поста для темы {theme}: {e}")
-                continue
+            await report_progress()
+    finally:
+        # При ошибке или отмене не оставляем висящих генераций
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
 
 # --- Окна диалога --- #
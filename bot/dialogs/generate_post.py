@@ -1,31 +1,39 @@
 # bot/dialogs/generate_post.py
 import re
+import time
 from aiogram import F
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import CallbackQuery, ContentType, Message
 from aiogram_dialog import Dialog, Window, DialogManager
 from aiogram_dialog.api.entities import MediaAttachment
 from aiogram_dialog.widgets.input import TextInput
-from aiogram_dialog.widgets.kbd import Back, Button, Calendar, Column, Next, Radio, Row, SwitchTo, Start
+from aiogram_dialog.widgets.kbd import Back, Button, Calendar, Column, Next, Radio, Row, Select, SwitchTo, Start
 from aiogram_dialog.widgets.text import Const, Format
 from aiogram_dialog.widgets.media import DynamicMedia
 from dataclasses import dataclass
 from datetime import datetime, time as dt_time
+from typing import Optional
 from sqlalchemy.future import select
 from bot.dialogs import states
 from bot.dialogs.common import MAIN_MENU_MAIN_BUTTON
+from bot.speculative import speculative_images
 from bot.themes import set_global_themes, get_global_themes
-from config.config import generate_travel_themes, generate_text, generate_image_prompt, get_current_model
+from config.config import generate_travel_themes, generate_text_stream, generate_image_prompt, get_current_model
 from config.env import conf, datetime_local
 from config.logging_config import logger, async_log_exception
 from database.db import save_post_to_db
 from database.models import GenerationType, Post, AsyncSessionLocal
-from yandex_art.client import generate_image
-from scheduler.jobs import schedule_post_job
-from telegram_api.client import publish_post_to_group
+from media_store.gc import discard_image
+from media_store.previews import get_preview
+from yandex_art.client import generate_image, generate_image_variants
+from scheduler.jobs import schedule_post_job, unschedule_post_job
+from scheduler.publisher import PostClaimed, PublishFailed, publish_post
+from telegram_api.file_ids import send_photo_album
 
 
 TRAVEL_THEMES_KEY = 'key_themes'
 TRAVEL_THEMES_ID = 'themes_select'
+STREAM_EDIT_INTERVAL = 1.0  # секунды между обновлениями сообщения при потоковой генерации текста
 
 
 @dataclass
@@ -41,17 +49,38 @@ async def on_text_prompt(message: Message, widget, dialog_manager: DialogManager
     """
     # Показываем статус генерации
     status_msg = await message.answer("<b>⏳ Генерация текста...</b>")
+    # Повторная генерация по тому же запросу — нужен новый вариант, а не ответ из кэша
+    fresh = dialog_manager.dialog_data.get('generated_text_prompt') == text
     try:
-        post_text = await generate_text(text)
+        post_text = ''
+        shown_text = ''
+        next_edit_at = 0.0
+        # Показываем текст по мере генерации, объединяя правки не чаще STREAM_EDIT_INTERVAL
+        async for post_text in generate_text_stream(text, use_cache=not fresh):
+            now = time.monotonic()
+            if now < next_edit_at or post_text == shown_text:
+                continue
+            next_edit_at = now + STREAM_EDIT_INTERVAL
+            shown_text = post_text
+            try:
+                await status_msg.edit_text(f"{post_text} ▌", parse_mode=None)
+            except TelegramRetryAfter as e:
+                next_edit_at = time.monotonic() + e.retry_after
+            except TelegramBadRequest as e:
+                logger.debug(f"Не удалось обновить сообщение с текстом: {e}")
+        post_text = post_text.strip()
         # Сохраняем в диалог
         dialog_manager.dialog_data['post_text'] = post_text  # Сгенерированный текст
         dialog_manager.dialog_data['text_prompt'] = text
+        dialog_manager.dialog_data['generated_text_prompt'] = text
         dialog_manager.dialog_data['model_text'] = await get_current_model()
         dialog_manager.dialog_data['generated_at_text'] = datetime_local()
         dialog_manager.dialog_data['status_text'] = GenerationType.SUCCESS
         # Сохраняем пост и сохраняем его ID
         post = await save_post_to_db(dialog_manager.dialog_data)
         dialog_manager.dialog_data['post_id'] = post.id  # Сохраняем ID поста
+        # Пока администратор читает текст, в фоне готовим промпт и изображение (если включено)
+        speculative_images.start(post.id, post_text)
         await status_msg.delete()
         # Переход к следующему шагу
         await dialog_manager.switch_to(states.PostStates.waiting_for_text_prompt)
@@ -106,10 +135,16 @@ async def on_generate_image_prompt(callback: CallbackQuery, button: Button, dial
     status_msg = await callback.message.answer("<b>⏳ Генерация промпта для изображения...</b>")
     dialog_manager.dialog_data["skip_image"] = False
     try:
-        # Генерация промпта для изображения
-        image_prompt = await generate_image_prompt(post_text)
+        if data.get("auto_image_prompt_text") == post_text:
+            # Промпт для этого текста уже генерировался — нужен новый вариант, а не ответ из кэша
+            image_prompt = await generate_image_prompt(post_text, use_cache=False)
+        else:
+            # Генерация промпта для изображения (или промпт, уже готовый в фоне)
+            image_prompt = (await speculative_images.prompt(data.get("post_id"), post_text)
+                            or await generate_image_prompt(post_text))
         data["image_prompt"] = image_prompt  # Сохраняем в диалог
         data["auto_image_prompt"] = True     # Флаг автогенерации
+        data["auto_image_prompt_text"] = post_text
         await status_msg.delete()
         # Переход к следующему шагу
         await dialog_manager.switch_to(states.PostStates.preview_auto_prompt)
@@ -121,6 +156,8 @@ async def on_generate_image_prompt(callback: CallbackQuery, button: Button, dial
 async def on_skip_image(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
     data = dialog_manager.dialog_data
     dialog_manager.dialog_data["skip_image"] = True
+    speculative_images.discard(data.get("post_id"))
+    await discard_image_variants(callback.message, dialog_manager)
 
 
 @async_log_exception
@@ -148,12 +185,34 @@ async def on_use_auto_prompt(callback: CallbackQuery, button: Button, dialog_man
 @async_log_exception
 async def on_image_prompt(message: Message, widget, dialog_manager: DialogManager, text: str):
     """Получение промпта для изображения и генерация изображения"""
+    variants_count = conf.yandex.art_variants
     # Показываем статус генерации
-    status_msg = await message.answer("<b>⏳ Генерация изображения...</b>")
+    if variants_count > 1:
+        status_msg = await message.answer(f"<b>⏳ Генерация вариантов изображения ({variants_count})...</b>")
+    else:
+        status_msg = await message.answer("<b>⏳ Генерация изображения...</b>")
     try:
         # Генерация изображения через Yandex.Art
         model_image = conf.yandex.art_model
-        image_url = await generate_image(text)
+        post_id = dialog_manager.dialog_data.get('post_id')
+        # Варианты, оставшиеся от прошлой генерации, больше не нужны
+        await discard_image_variants(message, dialog_manager)
+        # Изображение по этому промпту могло быть уже сгенерировано в фоне; для другого промпта фоновая генерация отменяется
+        image_url = await speculative_images.take(post_id, text)
+        if variants_count > 1:
+            # Готовое фоновое изображение становится одним из вариантов, остальные генерируются одновременно
+            variants = [image_url] if image_url else []
+            variants += await generate_image_variants(text, variants_count - len(variants))
+            if len(variants) > 1:
+                dialog_manager.dialog_data["image_prompt"] = text
+                await show_image_variants(message, dialog_manager, variants)
+                await status_msg.delete()
+                await dialog_manager.switch_to(states.PostStates.choose_image_variant)
+                return
+            image_url = variants[0] if variants else None
+        if not image_url:
+            # Пост уже сохранён после генерации текста: изображение прикрепится к нему даже после перезапуска бота
+            image_url = await generate_image(text, post_id=post_id)
         # Обновляем данные в диалоге
         dialog_manager.dialog_data["image_url"] = image_url
         dialog_manager.dialog_data["image_prompt"] = text
@@ -173,6 +232,56 @@ async def on_image_prompt(message: Message, widget, dialog_manager: DialogManage
         await status_msg.edit_text(f"<b>❌ Ошибка при генерации изображения:</b> {e}")
 
 
+async def show_image_variants(message: Message, dialog_manager: DialogManager, variants: list):
+    """Отправка вариантов изображения альбомом (превью) и сохранение их в диалоге"""
+    previews = [await get_preview(path) or path for path in variants]
+    captions = [f"Вариант {index}" for index in range(1, len(variants) + 1)]
+    album = await send_photo_album(message.bot, message.chat.id, previews, captions)
+    dialog_manager.dialog_data["image_variants"] = variants
+    dialog_manager.dialog_data["image_variants_message_ids"] = [album_message.message_id for album_message in album]
+
+
+async def discard_image_variants(message: Message, dialog_manager: DialogManager, keep: Optional[str] = None):
+    """Удаление альбома с вариантами и файлов невыбранных вариантов"""
+    variants = dialog_manager.dialog_data.pop("image_variants", [])
+    message_ids = dialog_manager.dialog_data.pop("image_variants_message_ids", [])
+    if message_ids:
+        try:
+            await message.bot.delete_messages(chat_id=message.chat.id, message_ids=message_ids)
+        except TelegramBadRequest as e:
+            logger.debug(f"Не удалось удалить альбом с вариантами изображения: {e}")
+    for path in variants:
+        if path != keep:
+            await discard_image(path)
+
+
+@async_log_exception
+async def on_image_variant_selected(callback: CallbackQuery, widget, dialog_manager: DialogManager, item_id: str):
+    """Выбор варианта изображения: вариант прикрепляется к посту, остальные удаляются"""
+    data = dialog_manager.dialog_data
+    variants = data.get("image_variants", [])
+    index = int(item_id)
+    if not 0 <= index < len(variants):
+        await callback.message.answer("<b>❌ Вариант не найден, сгенерируйте изображение заново</b>")
+        return
+    image_url = variants[index]
+    await discard_image_variants(callback.message, dialog_manager, keep=image_url)
+    data["image_url"] = image_url
+    data["model_image"] = conf.yandex.art_model
+    data["generated_at_image"] = datetime_local()
+    data["status_image"] = GenerationType.SUCCESS
+    await save_post_to_db(data)
+    await dialog_manager.switch_to(states.PostStates.preview)
+
+
+@async_log_exception
+async def image_variants_getter(dialog_manager: DialogManager, **kwargs):
+    variants = dialog_manager.dialog_data.get("image_variants", [])
+    return {
+        'image_variants': [(f"Вариант {index + 1}", index) for index in range(len(variants))],
+    }
+
+
 @async_log_exception
 async def on_publish(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
     """Публикация поста в группу"""
@@ -183,14 +292,29 @@ async def on_publish(callback: CallbackQuery, button: Button, dialog_manager: Di
         await callback.message.answer("<b>❌ Сначала сгенерируйте текст</b>")
         return
     try:
-        # Публикация поста
+        # Сохраняем пост в БД: публикация идёт через захват его строки, чтобы пост не вышел дважды
+        # (повторное нажатие кнопки или задача планировщика для того же поста)
+        post = await save_post_to_db(data)
+        data['post_id'] = post.id
         channel_id = conf.tg_bot.channel_id
-        message_id = await publish_post_to_group(channel_id, post_text, image_url)
+        try:
+            message_id = await publish_post(post.id, channel_id, retry=False, confirmed=data.get('confirm_resend', False))
+        except PostClaimed:
+            await callback.message.answer("<b>⚠️ Пост уже опубликован или публикуется прямо сейчас</b>")
+            return
+        except PublishFailed as e:
+            if not e.unknown:
+                raise
+            # Telegram мог принять пост: повторная отправка — только после проверки канала
+            data['confirm_resend'] = True
+            await callback.message.answer(f"<b>⚠️ Исход публикации неизвестен:</b> {e.error}\n"
+                                          f"Проверьте канал. Если поста там нет, нажмите «Опубликовать» ещё раз")
+            return
         # Добавляем статус публикации и дату
         data['published'] = True
         data['published_at'] = datetime_local()
-        # Сохраняем в БД
-        post = await save_post_to_db(data)
+        # Если пост был запланирован, задача публикации больше не нужна
+        await unschedule_post_job(post.id)
         # Формирование ссылки
         if channel_id.startswith("-100"):
             clean_chat_id = channel_id[4:]  # Убираем "-100"
@@ -241,7 +365,6 @@ async def on_schedule_time_selected(message: Message, widget, dialog_manager: Di
         scheduled_datetime = datetime.combine(selected_date, selected_time)
         # Обновляем данные
         dialog_manager.dialog_data["scheduled_at"] = scheduled_datetime
-        dialog_manager.dialog_data["is_scheduled"] = True
         # Сохраняем пост и переходим к подтверждению
         post = await save_post_to_db(dialog_manager.dialog_data)
         await dialog_manager.switch_to(states.PostStates.waiting_for_schedule_confirmation)
@@ -277,6 +400,8 @@ async def on_publish_scheduled(callback: CallbackQuery, button: Button, dialog_m
         await callback.message.answer("<b>❌ Сначала задайте дату и время</b>")
         return
     try:
+        # Флаг ставится только после подтверждения: по нему задачи восстанавливаются после перезапуска
+        data['is_scheduled'] = True
         post = await save_post_to_db(data)
         await schedule_post_job(scheduled_at, post.id)
         await dialog_manager.next()
@@ -353,7 +478,8 @@ async def main_getter(dialog_manager: DialogManager, **kwargs):
         ]
         dialog_manager.dialog_data['travel_themes_objects'] = travel_themes_objects
     if image_url:
-        image_url_media = MediaAttachment(ContentType.PHOTO, path=image_url)
+        # В диалоге показываем превью, оригинал нужен только для публикации
+        image_url_media = MediaAttachment(ContentType.PHOTO, path=await get_preview(image_url) or image_url)
         image_visible = True
     else:
         image_url_media = ''
@@ -536,6 +662,28 @@ confirmation_window = Window(
     parse_mode='HTML',
 )
 
+choose_image_variant_window = Window(
+    Const("<b>🖼 Выберите вариант изображения из альбома выше</b>\n"
+          "<em>Или введите другой промпт, чтобы сгенерировать новые варианты</em>"),
+    Column(
+        Select(
+            Format("{item[0]}"),
+            id="image_variant",
+            items="image_variants",
+            item_id_getter=lambda item: item[1],
+            on_click=on_image_variant_selected
+        ),
+    ),
+    TextInput(id="image_prompt", on_success=on_image_prompt),
+    Row(
+        SwitchTo(text=Const("⬅️ Назад"), id="btn_back_variants", state=states.PostStates.waiting_for_image_prompt),
+        MAIN_MENU_MAIN_BUTTON
+    ),
+    state=states.PostStates.choose_image_variant,
+    getter=image_variants_getter,
+    parse_mode='HTML'
+)
+
 main_dialog = Dialog(
     Window(
         Format("👋 Привет, {username}!\n\n"
@@ -573,5 +721,6 @@ main_dialog = Dialog(
     schedule_date_window,
     schedule_time_window,
     schedule_window,
-    confirmation_window
+    confirmation_window,
+    choose_image_variant_window
 )
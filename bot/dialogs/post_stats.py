@@ -8,6 +8,7 @@ from aiogram_dialog.widgets.media import DynamicMedia
 from bot.dialogs import states
 from sqlalchemy.future import select
 from database.models import Post, AsyncSessionLocal
+from media_store.previews import get_preview
 from config.logging_config import logger
 from .common import MAIN_MENU_MAIN_BUTTON
 
@@ -62,7 +63,7 @@ async def stats_getter(dialog_manager, **kwargs):
             image_url_media = ''
             image_visible = False
             if post.image_path:
-                image_url_media = MediaAttachment(ContentType.PHOTO, path=post.image_path)
+                image_url_media = MediaAttachment(ContentType.PHOTO, path=await get_preview(post.image_path) or post.image_path)
                 image_visible = True
             button_visible = len(posts) > 0
             return {
@@ -7,7 +7,9 @@ from aiogram_dialog.widgets.kbd import Button, Row, FirstPage, PrevPage, Current
 from aiogram_dialog.widgets.media import DynamicMedia
 from bot.dialogs import states
 from sqlalchemy.future import select
-from database.models import Post, AsyncSessionLocal
+from database.models import GenerationType, Post, AsyncSessionLocal
+from media_store.previews import get_preview
+from scheduler.jobs import requeue_post, unschedule_post_job
 from config.logging_config import logger
 from .common import MAIN_MENU_MAIN_BUTTON
 
@@ -36,6 +38,8 @@ async def scheduled_posts_getter(dialog_manager, **kwargs):
                     'image_url_media': '',
                     'image_visible': False,
                     'button_visible': False,
+                    'requeue_visible': False,
+                    'requeue_confirm_visible': False,
                 }
             page_size = 1  # 1 пост на страницу
             pages = (len(posts) + page_size - 1) // page_size
@@ -46,23 +50,39 @@ async def scheduled_posts_getter(dialog_manager, **kwargs):
             #     return {'pages': 0}
             scheduled_at = post.scheduled_at.strftime("%Y-%m-%d %H:%M") if post.scheduled_at else ''
             if post.image_path is not None:
-                image_url_media = MediaAttachment(ContentType.PHOTO, path=post.image_path)
+                image_url_media = MediaAttachment(ContentType.PHOTO, path=await get_preview(post.image_path) or post.image_path)
                 image_visible = True
             else:
                 image_url_media = ''
                 image_visible = False
+            if post.status_text == GenerationType.PENDING:
+                # Пост из плана отложенной генерации: текста ещё нет
+                post_text = f"<b>📝 Тема:</b> {post.text_prompt}\n<em>⏳ Пост будет сгенерирован перед публикацией</em>"
+            else:
+                post_text = post.text
             button_visible = False
             if len(posts) > 0:
                 button_visible = True
+            if post.dead_letter:
+                # Публикация не удалась после всех попыток: пост ждёт повторной отправки
+                status = (f"<b>❌ Публикация не удалась</b> (попыток: {post.publish_attempts or 0}), время публикации: {scheduled_at}\n"
+                          f"<b>📝 Ошибка:</b> {post.error_message or ''}")
+                if post.send_started_at is not None:
+                    status += ("\n<b>⚠️ Пост мог уже выйти в канал:</b> исход отправки неизвестен. "
+                               "Проверьте канал перед повторной отправкой")
+            else:
+                status = f"<b>📅 Публикация запланирована ✅ на:</b> {scheduled_at}"
             return {
                 'pages': pages,
                 'current_page': current_page,
-                'user_group_have_access': f"{post.text}\n\n<b>📅 Публикация запланирована ✅ на:</b> {scheduled_at}",
-                'post_text': post.text,
+                'user_group_have_access': f"{post_text}\n\n{status}",
+                'post_text': post_text,
                 'image_url': post.image_path or '',
                 'image_url_media': image_url_media,
                 'image_visible': image_visible,
                 'button_visible': button_visible,
+                'requeue_visible': bool(post.dead_letter) and post.send_started_at is None,
+                'requeue_confirm_visible': bool(post.dead_letter) and post.send_started_at is not None,
             }
     except Exception as e:
         logger.error(f"Ошибка при получении запланированных постов: {e}")
@@ -75,6 +95,8 @@ async def scheduled_posts_getter(dialog_manager, **kwargs):
             'image_url_media': '',
             'image_visible': False,
             'button_visible': False,
+            'requeue_visible': False,
+            'requeue_confirm_visible': False,
         }
 
 
@@ -101,6 +123,7 @@ async def on_delete_post(callback: CallbackQuery, button: Button, dialog_manager
         # Удаляем пост из БД
         await session.delete(post)
         await session.commit()
+        await unschedule_post_job(post.id)
     # После удаления перезагружаем тот же список
     scroll = dialog_manager.find(ID_SCROLL_WITH_PAGER)
     await scroll.set_page(current_page)
@@ -110,12 +133,35 @@ async def on_delete_post(callback: CallbackQuery, button: Button, dialog_manager
     await callback.answer("✅ Пост удален", show_alert=False, cache_time=1)
 
 
+async def on_requeue_post(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    """Обработчик нажатия на кнопки 'Повторить публикацию' и 'Отправить повторно' (с подтверждением)"""
+    current_page = await dialog_manager.find(ID_SCROLL_WITH_PAGER).get_page()
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Post.id)
+            .where(Post.scheduled_at.isnot(None), Post.published == False)
+            .order_by(Post.scheduled_at.asc())
+        )
+        post_ids = result.scalars().all()
+    if current_page >= len(post_ids):
+        await callback.answer("Пост не найден")
+        return
+    scheduled_time = await requeue_post(post_ids[current_page], confirmed=button.widget_id == 'btn_requeue_confirm')
+    if scheduled_time is None:
+        await callback.answer("Пост уже в очереди публикации")
+        return
+    await callback.answer(f"🔁 Пост будет опубликован {scheduled_time.strftime('%Y-%m-%d %H:%M')}", show_alert=False, cache_time=1)
+
+
 # --- Диалог ---
 scheduled_posts_dialog = Dialog(
     Window(
         Format("{user_group_have_access}"),
         # DynamicMedia('image_url_media', when='button_visible'),
         DynamicMedia('image_url_media', when='image_visible'),
+        Button(Const("🔁 Повторить публикацию"), id="btn_requeue_post", on_click=on_requeue_post, when='requeue_visible'),
+        Button(Const("⚠️ Поста нет в канале — отправить повторно"), id="btn_requeue_confirm", on_click=on_requeue_post,
+               when='requeue_confirm_visible'),
         Button(Const("🗑 Удалить пост"), id="btn_delete_post", on_click=on_delete_post, when='button_visible'),
         StubScroll(id=ID_SCROLL_WITH_PAGER, pages='pages'),
         Row(
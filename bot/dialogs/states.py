@@ -11,6 +11,7 @@ class PostStates(StatesGroup):
     waiting_for_schedule_time = State()  # Ввод времени публикации
     waiting_for_schedule_confirmation = State()
     post_confirmation = State()
+    choose_image_variant = State()  # Выбор одного из вариантов изображения
 
 
 class AutoScheduleStates(StatesGroup):
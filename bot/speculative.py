@@ -0,0 +1,140 @@
+# bot/speculative.py
+"""
+Фоновая генерация изображения, пока администратор читает текст поста
+
+Сразу после генерации текста запускается задача: промпт для изображения, затем
+рендер в Yandex.Art. Если администратор принимает автоматический промпт, изображение
+обычно уже готово. Если он меняет текст, вводит свой промпт или пропускает изображение,
+задача отменяется, а уже сохранённое изображение удаляется.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+from config.config import generate_image_prompt
+from config.env import conf
+from config.logging_config import logger
+from media_store.gc import discard_image
+from yandex_art.client import generate_image
+
+
+@dataclass
+class SpeculativeImage:
+    post_text: str
+    started_at: float
+    prompt: Optional[str] = None
+    prompt_ready: asyncio.Event = field(default_factory=asyncio.Event)
+    image_path: Optional[str] = None
+    task: Optional[asyncio.Task] = None
+    # Таймер отбрасывания невостребованного результата через ttl
+    expiry: Optional[asyncio.TimerHandle] = None
+
+
+class SpeculativeImages:
+    """Фоновые генерации изображений по ID поста"""
+
+    def __init__(self, enabled: bool, ttl: float):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._entries: Dict[int, SpeculativeImage] = {}
+        # Ссылки на задачи очистки, чтобы их не собрал сборщик мусора до завершения
+        self._cleanups: Set[asyncio.Task] = set()
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+    async def _run(self, post_id: int, entry: SpeculativeImage):
+        try:
+            entry.prompt = await generate_image_prompt(entry.post_text)
+        except Exception as e:
+            logger.warning(f"[Speculative] Пост {post_id}: не удалось сгенерировать промпт: {e}")
+            return
+        finally:
+            entry.prompt_ready.set()
+        # Задание не возобновляется после перезапуска: без администратора результат никому не нужен
+        entry.image_path = await generate_image(entry.prompt, resumable=False)
+        logger.debug(f"[Speculative] Пост {post_id}: изображение готово заранее: {entry.image_path}")
+
+    def start(self, post_id: Optional[int], post_text: str):
+        """Запуск фоновой генерации для поста (предыдущая генерация для него отменяется)"""
+        if not self.enabled or post_id is None or not post_text:
+            return
+        self.discard(post_id)
+        entry = SpeculativeImage(post_text=post_text, started_at=time.monotonic())
+        entry.task = asyncio.create_task(self._run(post_id, entry))
+        # Брошенный диалог не держит задачу и изображение дольше ttl
+        entry.expiry = asyncio.get_running_loop().call_later(self.ttl, self._expire, post_id, entry)
+        self._entries[post_id] = entry
+        self.started += 1
+        logger.debug(f"[Speculative] Пост {post_id}: фоновая генерация изображения запущена")
+
+    async def prompt(self, post_id: Optional[int], post_text: str) -> Optional[str]:
+        """Промпт фоновой генерации (None, если её нет, она для другого текста или не удалась)"""
+        entry = self._entries.get(post_id)
+        if entry is None or entry.post_text != post_text:
+            return None
+        await entry.prompt_ready.wait()
+        return entry.prompt
+
+    async def take(self, post_id: Optional[int], prompt: str) -> Optional[str]:
+        """
+        Получение готового (или дожидание текущего) изображения для выбранного промпта
+
+        Если промпт отличается от фонового, фоновая генерация отменяется.
+
+        Returns:
+            Optional[str]: Путь к изображению или None — тогда изображение нужно генерировать обычным путём
+        """
+        entry = self._entries.get(post_id)
+        if entry is None:
+            return None
+        if not entry.prompt_ready.is_set() or entry.prompt != prompt:
+            self.discard(post_id)
+            return None
+        del self._entries[post_id]
+        entry.expiry.cancel()
+        try:
+            await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # Отменён сам вызывающий, а не фоновая генерация
+                raise
+            logger.debug(f"[Speculative] Пост {post_id}: фоновая генерация отменена")
+            return None
+        except Exception as e:
+            logger.warning(f"[Speculative] Пост {post_id}: ошибка фоновой генерации: {e}")
+            return None
+        if entry.image_path:
+            self.used += 1
+        return entry.image_path
+
+    def discard(self, post_id: Optional[int]):
+        """Отмена фоновой генерации и удаление её результата"""
+        entry = self._entries.pop(post_id, None)
+        if entry is None:
+            return
+        self.discarded += 1
+        entry.expiry.cancel()
+        entry.task.cancel()
+        cleanup = asyncio.create_task(self._cleanup(post_id, entry))
+        self._cleanups.add(cleanup)
+        cleanup.add_done_callback(self._cleanups.discard)
+
+    async def _cleanup(self, post_id: int, entry: SpeculativeImage):
+        await asyncio.gather(entry.task, return_exceptions=True)
+        if entry.image_path and await discard_image(entry.image_path):
+            logger.debug(f"[Speculative] Пост {post_id}: невостребованное изображение удалено: {entry.image_path}")
+
+    def _expire(self, post_id: int, entry: SpeculativeImage):
+        """Отбрасывание результата, который не востребован дольше ttl"""
+        if self._entries.get(post_id) is entry:
+            logger.debug(f"[Speculative] Пост {post_id}: результат не востребован за {self.ttl} с")
+            self.discard(post_id)
+
+    def stats(self) -> dict:
+        return {"started": self.started, "used": self.used, "discarded": self.discarded,
+                "in_progress": len(self._entries)}
+
+
+# Глобальный экземпляр
+speculative_images = SpeculativeImages(enabled=conf.speculative.enabled, ttl=conf.speculative.ttl)
@@ -1,8 +1,13 @@
 # bot/themes.py
-from typing import Dict
+import re
+from typing import Dict, Iterable, List
 
 # Глобальная переменная для хранения тем
 global_travel_themes = {}
+# Доля общих основ слов, начиная с которой темы считаются дубликатами
+THEME_SIMILARITY_THRESHOLD = 0.75
+# Длина основы слова при сравнении тем (грубый учёт падежных окончаний)
+THEME_STEM_LENGTH = 5
 
 
 def set_global_themes(themes: Dict[str, str]):
@@ -27,4 +32,52 @@ def add_theme(theme: str):
 def remove_theme(index: int):
     """Удаление темы по индексу"""
     if 'themes' in global_travel_themes and 0 <= index < len(global_travel_themes['themes']):
-        global_travel_themes['themes'].pop(index)
\ No newline at end of file
+        global_travel_themes['themes'].pop(index)
+
+
+def normalize_theme(theme: str) -> str:
+    """
+    Нормализация темы для сравнения: без эмодзи и знаков препинания,
+    в нижнем регистре, «ё» заменена на «е», пробелы схлопнуты
+    """
+    text = theme.casefold().replace("ё", "е")
+    text = re.sub(r"[^\w\s]|_", " ", text)
+    return " ".join(text.split())
+
+
+def _theme_stems(normalized: str) -> frozenset:
+    return frozenset(word[:THEME_STEM_LENGTH] for word in normalized.split())
+
+
+def is_similar_theme(first: str, second: str) -> bool:
+    """Проверка нормализованных тем на совпадение или почти-совпадение (по доле общих основ слов)"""
+    if first == second:
+        return True
+    first_stems, second_stems = _theme_stems(first), _theme_stems(second)
+    if not first_stems or not second_stems:
+        return False
+    return len(first_stems & second_stems) / len(first_stems | second_stems) >= THEME_SIMILARITY_THRESHOLD
+
+
+def deduplicate_themes(themes: Iterable[str], existing: Iterable[str] = ()) -> List[str]:
+    """
+    Удаление повторов из списка тем с сохранением порядка
+
+    Args:
+        themes: Темы для проверки
+        existing: Уже принятые темы, повторы которых тоже отбрасываются
+
+    Returns:
+        list: Новые уникальные темы (без тем из existing)
+    """
+    seen = [normalize_theme(theme) for theme in existing]
+    unique = []
+    for theme in themes:
+        if not isinstance(theme, str) or not theme.strip():
+            continue
+        normalized = normalize_theme(theme)
+        if not normalized or any(is_similar_theme(normalized, other) for other in seen):
+            continue
+        seen.append(normalized)
+        unique.append(theme.strip())
+    return unique
@@ -1,3 +1,135 @@
 # config/config.py
-# from openai_api.client import generate_travel_themes, generate_text, generate_image_prompt, get_current_model
-from yandex_gpt.client import generate_travel_themes, generate_text, generate_image_prompt, get_current_model
+from typing import AsyncIterator, Optional
+from ai_providers.llm_cache import llm_cache
+from ai_providers.router import ProviderHealth, router
+from config.env import conf
+
+# Грубая оценка количества символов на токен (для учёта стоимости дублирующих запросов)
+CHARS_PER_TOKEN = 3
+
+
+def _estimate_tokens(text: str) -> int:
+    """Приблизительное количество токенов в тексте"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _cache_key(provider: ProviderHealth, model: str, kind: str, temperature_attr: str, prompt: str) -> str:
+    """Ключ кэша ответа конкретного провайдера и модели"""
+    return llm_cache.make_key(provider.name, model, kind, getattr(provider.module, temperature_attr), prompt)
+
+
+async def _cached_call(kind: str, temperature_attr: str, prompt: str, call, use_cache: bool,
+                       model: Optional[str] = None, **call_options) -> str:
+    """
+    Вызов через маршрутизатор с кэшированием ответа
+
+    Кэш проверяется для провайдера, которому будет отправлен запрос; ответ сохраняется
+    под ключом провайдера и модели, которые его фактически сгенерировали. Без use_cache
+    кэш не читается (нужен новый вариант), но новый ответ в него сохраняется.
+    """
+    if not conf.llm_cache.enabled:
+        return await router.call(call, **call_options)
+    preferred = router.preferred()
+    if use_cache:
+        preferred_model = model or await preferred.module.get_current_model()
+        cached = await llm_cache.get(_cache_key(preferred, preferred_model, kind, temperature_attr, prompt))
+        if cached is not None:
+            router.mark_cached(preferred, preferred_model)
+            return cached
+    else:
+        llm_cache.bypasses += 1
+    value = await router.call(call, **call_options)
+    if value:
+        name, served_model = router.served()
+        served = router.provider(name)
+        await llm_cache.set(_cache_key(served, model or served_model, kind, temperature_attr, prompt), value)
+    return value
+
+
+async def generate_travel_themes(count: int = 4, exclude: Optional[list] = None) -> dict:
+    """
+    Генерация тем для постов через маршрутизатор провайдеров
+
+    Запасные темы (флаг 'fallback') считаются неудачей: запрос повторяется у другого провайдера.
+    """
+    return await router.call(
+        lambda provider: provider.generate_travel_themes(count=count, exclude=exclude),
+        is_failure=lambda result: bool(result.get("fallback"))
+    )
+
+
+async def get_current_model() -> str:
+    """
+    Модель, сгенерировавшая последний ответ в текущей задаче
+
+    Если в задаче ещё не было вызовов — модель провайдера, которому уйдёт следующий запрос.
+    """
+    served = router.served()
+    if served is not None:
+        return served[1]
+    return await router.preferred().module.get_current_model()
+
+
+async def generate_text(prompt: str, model: Optional[str] = None, max_tokens: int = 500, style: str = "casual",
+                        use_cache: bool = True) -> str:
+    """
+    Генерация текста поста через маршрутизатор провайдеров с кэшированием ответа
+
+    Args:
+        prompt (str): Текстовый запрос
+        model (str): Модель (по умолчанию — модель выбранного провайдера)
+        max_tokens (int): Максимальное количество токенов в ответе
+        style (str): Стиль текста (casual, professional, humorous, poetic)
+        use_cache (bool): False — не брать ответ из кэша, а сгенерировать новый вариант
+    """
+    model_kwargs = {"model": model} if model else {}
+    return await _cached_call(
+        f"text:{style}:{max_tokens}", "TEXT_TEMPERATURE", prompt,
+        lambda provider: provider.generate_text(prompt, max_tokens=max_tokens, style=style, **model_kwargs),
+        use_cache=use_cache, model=model,
+        # Медленный ответ может быть продублирован (AI_HEDGE_ENABLED); стоимость дубля — его промпт и ответ
+        hedge=True, hedge_prompt_tokens=_estimate_tokens(prompt), hedge_completion_tokens=_estimate_tokens
+    )
+
+
+async def generate_text_stream(prompt: str, model: Optional[str] = None, max_tokens: int = 500, style: str = "casual",
+                               use_cache: bool = True) -> AsyncIterator[str]:
+    """
+    Потоковая генерация текста поста через маршрутизатор провайдеров
+
+    Выдаёт накопленный к текущему моменту текст. Если ответ уже есть в кэше (и use_cache), он выдаётся
+    одним фрагментом; итоговый текст потока сохраняется в кэш под тем же ключом, что и у generate_text.
+    """
+    model_kwargs = {"model": model} if model else {}
+    kind = f"text:{style}:{max_tokens}"
+    if use_cache and conf.llm_cache.enabled:
+        preferred = router.preferred()
+        preferred_model = model or await preferred.module.get_current_model()
+        cached = await llm_cache.get(_cache_key(preferred, preferred_model, kind, "TEXT_TEMPERATURE", prompt))
+        if cached is not None:
+            router.mark_cached(preferred, preferred_model)
+            yield cached
+            return
+    text = ""
+    async for text in router.stream(
+            lambda provider: provider.generate_text_stream(prompt, max_tokens=max_tokens, style=style, **model_kwargs)):
+        yield text
+    if text.strip() and conf.llm_cache.enabled:
+        name, served_model = router.served()
+        key = _cache_key(router.provider(name), model or served_model, kind, "TEXT_TEMPERATURE", prompt)
+        await llm_cache.set(key, text.strip())
+
+
+async def generate_image_prompt(post_text: str, use_cache: bool = True) -> str:
+    """
+    Генерация промпта для изображения через маршрутизатор провайдеров с кэшированием ответа
+
+    Args:
+        post_text (str): Текст поста
+        use_cache (bool): False — не брать ответ из кэша, а сгенерировать новый вариант
+    """
+    return await _cached_call(
+        "image_prompt", "IMAGE_PROMPT_TEMPERATURE", post_text,
+        lambda provider: provider.generate_image_prompt(post_text),
+        use_cache=use_cache
+    )
@@ -33,6 +33,9 @@ class OpenAI:
     api_url: str
     gpt_model: str
     max_token_count: int
+    timeout: float
+    connect_timeout: float
+    max_retries: int
 
 @dataclass
 class YandexArt:
@@ -43,6 +46,111 @@ class YandexArt:
     art_model: str
     art_api_url: str
     art_api_key: str
+    art_operations_url: str
+    art_poll_timeout: float
+    art_poll_max_interval: float
+    art_expected_render_time: float
+    art_job_max_age: float
+    art_variants: int
+
+@dataclass
+class HttpConfig:
+    pool_limit: int
+    pool_limit_per_host: int
+    dns_cache_ttl: int
+    keepalive_timeout: int
+    request_timeout: int
+
+@dataclass
+class LLMCacheConfig:
+    enabled: bool
+    path: str
+    ttl: int
+    memory_size: int
+    disk_size: int
+
+@dataclass
+class AIRouterConfig:
+    providers: list[str]
+    call_timeout: float
+    window: int
+    failure_threshold: int
+    cooldown: float
+    hedge_enabled: bool
+    hedge_percentile: float
+    hedge_min_delay: float
+    hedge_min_samples: int
+
+@dataclass
+class RateLimit:
+    rps: float
+    burst: int
+    concurrency: int
+
+@dataclass
+class RateLimitConfig:
+    enabled: bool
+    yandex_gpt: RateLimit
+    yandex_art: RateLimit
+    yandex_art_operations: RateLimit
+    openai: RateLimit
+
+@dataclass
+class MediaConfig:
+    gc_enabled: bool
+    gc_dry_run: bool
+    gc_interval_hours: float
+    gc_min_age_hours: float
+    preview_enabled: bool
+    preview_max_size: int
+    preview_quality: int
+    recompress_enabled: bool
+    recompress_quality: int
+    recompress_min_quality: int
+    recompress_max_side: int
+    recompress_max_bytes: int
+
+@dataclass
+class SpeculativeConfig:
+    enabled: bool
+    ttl: int
+
+@dataclass
+class SchedulerConfig:
+    jobstore_url: str
+    missed_policy: str
+    missed_max_age: float
+    catchup_interval: float
+    engine: str
+    sweep_interval: float
+    sweep_batch: int
+    publish_concurrency: int
+    claim_timeout: float
+    max_attempts: int
+    backoff_base: float
+    backoff_max: float
+    max_flood_wait: float
+
+@dataclass
+class AutoScheduleConfig:
+    deferred: bool
+    lead_time: float
+    interval: float
+    concurrency: int
+    image_style: str
+
+@dataclass
+class LeaderConfig:
+    enabled: bool
+    backend: str
+    name: str
+    ttl: float
+    renew_interval: float
+
+@dataclass
+class NotificationsConfig:
+    digest_window: float
+    limit: RateLimit
 
 @dataclass
 class Config:
@@ -50,12 +158,23 @@ class Config:
     db: DbConfig
     openai: OpenAI
     yandex: YandexArt
+    http: HttpConfig
+    llm_cache: LLMCacheConfig
+    ai_router: AIRouterConfig
+    rate_limit: RateLimitConfig
+    media: MediaConfig
+    speculative: SpeculativeConfig
+    scheduler: SchedulerConfig
+    auto_schedule: AutoScheduleConfig
+    leader: LeaderConfig
+    notifications: NotificationsConfig
     bot_admins: List
     dp: Optional[Dispatcher] = None
 
 def load_config(path: Optional[str] = None) -> Config:
     env: Env = Env()
     env.read_env(path)
+    leader_enabled = env.bool('LEADER_ELECTION_ENABLED', False)
     return Config(
         tg_bot=TgBot(
             LOG_LEVEL=str(env('LOG_LEVEL', 'WARNING')),
@@ -77,7 +196,10 @@ def load_config(path: Optional[str] = None) -> Config:
             api_key=str(env('OPENAI_API_KEY', '')),
             api_url=str(env('OPENAI_API_URL', '')),
             gpt_model=str(env('OPENAI_GPT_MODEL', 'gpt-4o-mini')),
-            max_token_count=int(env('OPENAI_MAX_TOKEN_COUNT', 4096))
+            max_token_count=int(env('OPENAI_MAX_TOKEN_COUNT', 4096)),
+            timeout=float(env('OPENAI_TIMEOUT', 60)),
+            connect_timeout=float(env('OPENAI_CONNECT_TIMEOUT', 10)),
+            max_retries=int(env('OPENAI_MAX_RETRIES', 2))
         ),
         yandex=YandexArt(
             folder_id=str(env('YANDEX_FOLDER_ID', '')),
@@ -86,7 +208,118 @@ def load_config(path: Optional[str] = None) -> Config:
             gpt_api_key=str(env('YANDEX_GPT_API_KEY', '')),
             art_model=str(env('YANDEX_ART_MODEL', 'yandex-art/latest')),
             art_api_url=str(env('YANDEX_ART_API_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/imageGenerationAsync')),
-            art_api_key=str(env('YANDEX_ART_API_KEY', ''))
+            art_api_key=str(env('YANDEX_ART_API_KEY', '')),
+            art_operations_url=str(env('YANDEX_ART_OPERATIONS_URL', 'https://llm.api.cloud.yandex.net/operations')),
+            art_poll_timeout=float(env('YANDEX_ART_POLL_TIMEOUT', 300)),
+            art_poll_max_interval=float(env('YANDEX_ART_POLL_MAX_INTERVAL', 10)),
+            art_expected_render_time=float(env('YANDEX_ART_EXPECTED_RENDER_TIME', 10)),
+            art_job_max_age=float(env('YANDEX_ART_JOB_MAX_AGE', 24 * 3600)),
+            art_variants=int(env('YANDEX_ART_VARIANTS', 1))
+        ),
+        http=HttpConfig(
+            pool_limit=int(env('HTTP_POOL_LIMIT', 100)),
+            pool_limit_per_host=int(env('HTTP_POOL_LIMIT_PER_HOST', 20)),
+            dns_cache_ttl=int(env('HTTP_DNS_CACHE_TTL', 300)),
+            keepalive_timeout=int(env('HTTP_KEEPALIVE_TIMEOUT', 60)),
+            request_timeout=int(env('HTTP_REQUEST_TIMEOUT', 60))
+        ),
+        llm_cache=LLMCacheConfig(
+            enabled=env.bool('LLM_CACHE_ENABLED', True),
+            path=str(env('LLM_CACHE_PATH', './db/llm_cache.db')),
+            ttl=int(env('LLM_CACHE_TTL', 7 * 24 * 3600)),
+            memory_size=int(env('LLM_CACHE_MEMORY_SIZE', 256)),
+            disk_size=int(env('LLM_CACHE_DISK_SIZE', 5000))
+        ),
+        ai_router=AIRouterConfig(
+            providers=list(env.list('AI_PROVIDERS', default=['yandex_gpt', 'openai_api'])),
+            call_timeout=float(env('AI_PROVIDER_CALL_TIMEOUT', 90)),
+            window=int(env('AI_PROVIDER_WINDOW', 20)),
+            failure_threshold=int(env('AI_PROVIDER_FAILURE_THRESHOLD', 3)),
+            cooldown=float(env('AI_PROVIDER_COOLDOWN', 60)),
+            hedge_enabled=env.bool('AI_HEDGE_ENABLED', False),
+            hedge_percentile=float(env('AI_HEDGE_PERCENTILE', 0.95)),
+            hedge_min_delay=float(env('AI_HEDGE_MIN_DELAY', 2)),
+            hedge_min_samples=int(env('AI_HEDGE_MIN_SAMPLES', 5))
+        ),
+        rate_limit=RateLimitConfig(
+            enabled=env.bool('RATE_LIMIT_ENABLED', True),
+            yandex_gpt=RateLimit(
+                rps=float(env('RATE_LIMIT_YANDEX_GPT_RPS', 10)),
+                burst=int(env('RATE_LIMIT_YANDEX_GPT_BURST', 10)),
+                concurrency=int(env('RATE_LIMIT_YANDEX_GPT_CONCURRENCY', 10))
+            ),
+            yandex_art=RateLimit(
+                rps=float(env('RATE_LIMIT_YANDEX_ART_RPS', 1)),
+                burst=int(env('RATE_LIMIT_YANDEX_ART_BURST', 2)),
+                concurrency=int(env('RATE_LIMIT_YANDEX_ART_CONCURRENCY', 5))
+            ),
+            yandex_art_operations=RateLimit(
+                rps=float(env('RATE_LIMIT_YANDEX_ART_OPERATIONS_RPS', 10)),
+                burst=int(env('RATE_LIMIT_YANDEX_ART_OPERATIONS_BURST', 10)),
+                concurrency=int(env('RATE_LIMIT_YANDEX_ART_OPERATIONS_CONCURRENCY', 10))
+            ),
+            openai=RateLimit(
+                rps=float(env('RATE_LIMIT_OPENAI_RPS', 5)),
+                burst=int(env('RATE_LIMIT_OPENAI_BURST', 10)),
+                concurrency=int(env('RATE_LIMIT_OPENAI_CONCURRENCY', 10))
+            )
+        ),
+        media=MediaConfig(
+            gc_enabled=env.bool('MEDIA_GC_ENABLED', True),
+            gc_dry_run=env.bool('MEDIA_GC_DRY_RUN', False),
+            gc_interval_hours=float(env('MEDIA_GC_INTERVAL_HOURS', 24)),
+            gc_min_age_hours=float(env('MEDIA_GC_MIN_AGE_HOURS', 24)),
+            preview_enabled=env.bool('MEDIA_PREVIEW_ENABLED', True),
+            preview_max_size=int(env('MEDIA_PREVIEW_MAX_SIZE', 512)),
+            preview_quality=int(env('MEDIA_PREVIEW_QUALITY', 80)),
+            recompress_enabled=env.bool('MEDIA_RECOMPRESS_ENABLED', True),
+            recompress_quality=int(env('MEDIA_RECOMPRESS_QUALITY', 87)),
+            recompress_min_quality=int(env('MEDIA_RECOMPRESS_MIN_QUALITY', 70)),
+            recompress_max_side=int(env('MEDIA_RECOMPRESS_MAX_SIDE', 1280)),
+            recompress_max_bytes=int(env('MEDIA_RECOMPRESS_MAX_BYTES', 400 * 1024))
+        ),
+        speculative=SpeculativeConfig(
+            enabled=env.bool('SPECULATIVE_IMAGES_ENABLED', False),
+            ttl=int(env('SPECULATIVE_IMAGES_TTL', 30 * 60))
+        ),
+        scheduler=SchedulerConfig(
+            jobstore_url=str(env('SCHEDULER_JOBSTORE_URL', '')),
+            missed_policy=str(env('SCHEDULER_MISSED_POLICY', 'publish')).lower(),
+            missed_max_age=float(env('SCHEDULER_MISSED_MAX_AGE', 6 * 3600)),
+            catchup_interval=float(env('SCHEDULER_CATCHUP_INTERVAL', 60)),
+            # Хранилище задач APScheduler нельзя делить между планировщиками нескольких реплик:
+            # с выбором лидера расписание — только строки постов, их публикует sweeper лидера
+            engine='sweeper' if leader_enabled else str(env('PUBLISH_ENGINE', 'jobs')).lower(),
+            sweep_interval=float(env('PUBLISH_SWEEP_INTERVAL', 30)),
+            sweep_batch=int(env('PUBLISH_SWEEP_BATCH', 20)),
+            publish_concurrency=int(env('PUBLISH_CONCURRENCY', 3)),
+            claim_timeout=float(env('PUBLISH_CLAIM_TIMEOUT', 600)),
+            max_attempts=int(env('PUBLISH_MAX_ATTEMPTS', 5)),
+            backoff_base=float(env('PUBLISH_BACKOFF_BASE', 5)),
+            backoff_max=float(env('PUBLISH_BACKOFF_MAX', 300)),
+            max_flood_wait=float(env('PUBLISH_MAX_FLOOD_WAIT', 3600))
+        ),
+        auto_schedule=AutoScheduleConfig(
+            deferred=env.bool('AUTO_SCHEDULE_DEFERRED', False),
+            lead_time=float(env('AUTO_SCHEDULE_LEAD_TIME', 3 * 3600)),
+            interval=float(env('AUTO_SCHEDULE_INTERVAL', 300)),
+            concurrency=int(env('AUTO_SCHEDULE_CONCURRENCY', 2)),
+            image_style=str(env('AUTO_SCHEDULE_IMAGE_STYLE', 'photorealistic'))
+        ),
+        leader=LeaderConfig(
+            enabled=leader_enabled,
+            backend=str(env('LEADER_BACKEND', 'lease')).lower(),
+            name=str(env('LEADER_LEASE_NAME', 'travel_bot')),
+            ttl=float(env('LEADER_LEASE_TTL', 15)),
+            renew_interval=float(env('LEADER_RENEW_INTERVAL', 5))
+        ),
+        notifications=NotificationsConfig(
+            digest_window=float(env('NOTIFY_DIGEST_WINDOW', 0)),
+            limit=RateLimit(
+                rps=float(env('NOTIFY_RPS', 20)),
+                burst=int(env('NOTIFY_BURST', 5)),
+                concurrency=int(env('NOTIFY_CONCURRENCY', 5))
+            )
         ),
         bot_admins=[],
         dp=None
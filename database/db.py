@@ -1,6 +1,9 @@
 # database/db.py
+from sqlalchemy import delete, update
 from sqlalchemy.future import select
-from database.models import AsyncSessionLocal, GenerationType, Post
+from typing import Optional
+from database.models import AsyncSessionLocal, GenerationType, ImageJob, ImageJobState, Post, TelegramFile
+from config.env import datetime_local
 from config.logging_config import async_log_exception
 
 
@@ -30,8 +33,10 @@ async def save_post_to_db(dialog_data: dict):
         post.generated_at_image = dialog_data.get("generated_at_image")
         post.is_scheduled = dialog_data.get("is_scheduled", False)
         post.scheduled_at = dialog_data.get("scheduled_at")
-        post.published = dialog_data.get("published", False)
-        post.published_at = dialog_data.get("published_at")
+        if not post.published:
+            # Опубликованный пост (в том числе задачей планировщика, пока открыт диалог) не сбрасывается
+            post.published = dialog_data.get("published", False)
+            post.published_at = dialog_data.get("published_at")
         post.status_image = dialog_data.get("status_image", GenerationType.SUCCESS)
         post.error_message = dialog_data.get("error_message")
         session.add(post)
@@ -70,3 +75,85 @@ async def get_posts_by_status(status: GenerationType):
     async with AsyncSessionLocal() as session:
         result = await session.execute(select(Post).where(Post.status_text == status))
         return result.scalars().all()
+
+
+@async_log_exception
+async def attach_image_to_post(post_id: int, image_path: Optional[str], error_message: Optional[str] = None):
+    """
+    Прикрепление сгенерированного изображения к посту
+
+    Если image_path равен None, статус изображения поста становится ERROR.
+    """
+    values = {
+        "image_path": image_path,
+        "generated_at_image": datetime_local(),
+        "status_image": GenerationType.SUCCESS if image_path else GenerationType.ERROR,
+    }
+    if error_message:
+        values["error_message"] = error_message
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(Post).where(Post.id == post_id).values(**values))
+        await session.commit()
+
+
+@async_log_exception
+async def create_image_job(operation_id: str, prompt: str, seed: int, post_id: Optional[int] = None) -> ImageJob:
+    """Сохранение отправленной операции Yandex.Art, чтобы её можно было дождаться после перезапуска"""
+    async with AsyncSessionLocal() as session:
+        job = ImageJob(operation_id=operation_id, prompt=prompt, seed=seed, post_id=post_id)
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+
+@async_log_exception
+async def finish_image_job(operation_id: str, state: ImageJobState, image_path: Optional[str] = None,
+                           error_message: Optional[str] = None):
+    """Фиксация результата задания генерации изображения"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(ImageJob)
+            .where(ImageJob.operation_id == operation_id)
+            .values(state=state, image_path=image_path, error_message=error_message, finished_at=datetime_local())
+        )
+        await session.commit()
+
+
+@async_log_exception
+async def get_pending_image_jobs() -> list:
+    """Незавершённые задания генерации изображений (от старых к новым)"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(ImageJob).where(ImageJob.state == ImageJobState.PENDING).order_by(ImageJob.created_at)
+        )
+        return result.scalars().all()
+
+
+@async_log_exception
+async def get_telegram_file(media_key: str) -> Optional[TelegramFile]:
+    """Сохранённый file_id изображения, уже загруженного в Telegram"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(TelegramFile).where(TelegramFile.media_key == media_key))
+        return result.scalars().first()
+
+
+@async_log_exception
+async def save_telegram_file(media_key: str, file_id: str, file_unique_id: Optional[str] = None):
+    """Сохранение (или замена) file_id изображения после загрузки в Telegram"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(TelegramFile).where(TelegramFile.media_key == media_key))
+        record = result.scalars().first() or TelegramFile(media_key=media_key)
+        record.file_id = file_id
+        record.file_unique_id = file_unique_id
+        record.created_at = datetime_local()
+        session.add(record)
+        await session.commit()
+
+
+@async_log_exception
+async def delete_telegram_file(media_key: str):
+    """Удаление file_id, который Telegram больше не принимает"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(TelegramFile).where(TelegramFile.media_key == media_key))
+        await session.commit()
@@ -1,10 +1,11 @@
 # database/models.py
 from enum import Enum as PyEnum
-from sqlalchemy import Boolean, BigInteger, Column, DateTime, Enum, Integer, JSON, String
+from sqlalchemy import Boolean, BigInteger, Column, DateTime, Enum, Index, Integer, JSON, String, false, inspect
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 from config.env import conf, datetime_local
-from config.logging_config import async_log_exception
+from config.logging_config import logger, async_log_exception
 
 # Асинхронный движок
 engine = create_async_engine(conf.db.DB_URI, future=True)
@@ -16,6 +17,14 @@ Base = declarative_base()
 class GenerationType(PyEnum):
     SUCCESS = "success"
     ERROR = "error"
+    PENDING = "pending"
+
+
+# Состояние задания генерации изображения
+class ImageJobState(PyEnum):
+    PENDING = "pending"  # Операция Yandex.Art отправлена, результат ещё не получен
+    DONE = "done"
+    FAILED = "failed"
 
 
 class Post(Base):
@@ -26,19 +35,25 @@ class Post(Base):
     text = Column(String, doc="Сгенерированный текст поста")
     model_text = Column(String, doc="Модель ИИ, использованная для генерации текста")
     generated_at_text = Column(DateTime, default=datetime_local(), doc="Дата и время генерации текста")
-    status_text = Column(Enum(GenerationType), default=GenerationType.SUCCESS, doc="Статус генерации текста (success/error)")
+    status_text = Column(Enum(GenerationType), default=GenerationType.SUCCESS, doc="Статус генерации текста (success/error/pending — пост ещё не сгенерирован)")
     # Изображение
     image_path = Column(String, doc="Путь к сгенерированному изображению")
     image_prompt = Column(String, doc="Промпт, использованный для генерации изображения")
     model_image = Column(String, doc="Модель ИИ, использованная для генерации изображения")
     generated_at_image = Column(DateTime, default=datetime_local(), doc="Дата и время генерации изображения")
-    status_image = Column(Enum(GenerationType), default=GenerationType.SUCCESS, doc="Статус генерации изображения (success/error)")
+    status_image = Column(Enum(GenerationType), default=GenerationType.SUCCESS, doc="Статус генерации изображения (success/error/pending)")
+    image_style = Column(String, doc="Стиль изображения для отложенной генерации")
     # Планирование публикации
     is_scheduled = Column(Boolean, default=False, doc="Флаг: пост запланирован на публикацию")
     scheduled_at = Column(DateTime, doc="Дата и время запланированной публикации")
     # Публикация
     published = Column(Boolean, default=False, doc="Флаг: пост опубликован")
     published_at = Column(DateTime, doc="Дата и время публикации поста")
+    claimed_at = Column(DateTime, doc="Дата и время, когда публикацию взял в работу обработчик очереди")
+    publish_token = Column(String, doc="Ключ идемпотентности: токен обработчика, который сейчас публикует пост")
+    send_started_at = Column(DateTime, doc="Начало отправки в Telegram, исход которой ещё не известен (защита от повторной публикации)")
+    publish_attempts = Column(Integer, default=0, server_default="0", doc="Количество неудавшихся попыток публикации")
+    dead_letter = Column(Boolean, default=False, server_default=false(), doc="Флаг: публикация не удалась после всех попыток и ждёт повторной отправки администратором")
     # Статистика
     views = Column(BigInteger, default=0, doc="Количество просмотров поста")
     comments = Column(Integer, default=0, doc="Количество комментариев под постом")
@@ -48,6 +63,42 @@ class Post(Base):
     error_message = Column(String, doc="Сообщение об ошибке (если статус = ERROR)")
     message_id = Column(Integer, doc="ID сообщения в Telegram для прямой ссылки на пост")
 
+    __table_args__ = (
+        # Поиск постов, которым пора публиковаться
+        Index('ix_posts_published_scheduled_at', 'published', 'scheduled_at'),
+    )
+
+
+class ImageJob(Base):
+    __tablename__ = 'image_jobs'
+    id = Column(Integer, primary_key=True, doc="Уникальный идентификатор задания")
+    operation_id = Column(String, unique=True, nullable=False, doc="ID асинхронной операции Yandex.Art")
+    prompt = Column(String, doc="Промпт, отправленный в Yandex.Art")
+    seed = Column(Integer, doc="Зерно генерации")
+    post_id = Column(Integer, index=True, doc="ID поста, к которому нужно прикрепить изображение")
+    state = Column(Enum(ImageJobState), default=ImageJobState.PENDING, index=True, doc="Состояние задания")
+    image_path = Column(String, doc="Путь к сохранённому изображению")
+    error_message = Column(String, doc="Сообщение об ошибке (если состояние = FAILED)")
+    created_at = Column(DateTime, default=datetime_local, doc="Дата и время отправки операции")
+    finished_at = Column(DateTime, doc="Дата и время завершения задания")
+
+
+class TelegramFile(Base):
+    __tablename__ = 'telegram_files'
+    id = Column(Integer, primary_key=True, doc="Уникальный идентификатор записи")
+    media_key = Column(String, unique=True, nullable=False, doc="Ключ изображения (хэш содержимого, для превью — с префиксом preview:)")
+    file_id = Column(String, nullable=False, doc="file_id, который Telegram вернул после первой загрузки")
+    file_unique_id = Column(String, doc="file_unique_id загруженного файла")
+    created_at = Column(DateTime, default=datetime_local, doc="Дата и время загрузки файла в Telegram")
+
+
+class LeaderLease(Base):
+    __tablename__ = 'leader_lease'
+    name = Column(String, primary_key=True, doc="Имя аренды (одна аренда на группу реплик бота)")
+    holder = Column(String, nullable=False, doc="Идентификатор реплики, которая сейчас лидер")
+    expires_at = Column(DateTime, nullable=False, doc="Момент окончания аренды (UTC), если её не продлят")
+    acquired_at = Column(DateTime, doc="Момент, когда текущая реплика стала лидером (UTC)")
+
 
 class Admin(Base):
     __tablename__ = "admins"
@@ -71,3 +122,38 @@ async def init_db():
     """
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate_schema)
+
+
+def _migrate_schema(conn):
+    """
+    Добавление в существующие таблицы новых столбцов и индексов
+
+    create_all создаёт только отсутствующие таблицы; столбцы и индексы, появившиеся
+    в моделях позже, добавляются здесь (ALTER TABLE ... ADD COLUMN / CREATE INDEX).
+    Столбцы с server_default получают значение по умолчанию и в существующих строках:
+    DEFAULT входит в ALTER TABLE, а NULL, оставшиеся от добавления столбца без него,
+    заполняются отдельно — иначе фильтры вида dead_letter == False их не находят.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+                logger.info(f"[DB] В таблицу {table.name} добавлен столбец {column.name}")
+        for column in table.columns:
+            if column.server_default is None or column.default is None or not column.default.is_scalar:
+                continue
+            if column.name in existing_columns:
+                result = conn.execute(table.update().where(column.is_(None)).values({column.name: column.default.arg}))
+                if result.rowcount:
+                    logger.info(f"[DB] В таблице {table.name} заполнено значение по умолчанию {column.name}: {result.rowcount} строк")
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(conn)
+                logger.info(f"[DB] В таблице {table.name} создан индекс {index.name}")
@@ -1,20 +1,37 @@
 # main.py
+import asyncio
+import contextlib
+import signal
+from typing import Optional
 from aiogram import Dispatcher, F, Router
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, Message
 from aiogram_dialog import DialogManager, setup_dialogs, StartMode
 from datetime import datetime, timedelta
+from ai_providers.http_session import init_http_session, close_http_session
+from ai_providers.llm_cache import llm_cache
+from ai_providers.rate_limiter import rate_limiter
+from ai_providers.router import router as provider_router
 from config.config import generate_travel_themes
 from config.env import bot_global, conf
 from config.logging_config import logging, setup_logging, logger, async_log_exception
 from database.models import init_db
+from media_store.recompress import recompress_stats
+from scheduler.leader import leader
+from scheduler.publisher import publish_stats
+from openai_api.client import close_client as close_openai_client
+from yandex_art.client import resume_image_jobs
+from yandex_art.poller import poller as yandex_art_poller
 from bot.dialogs import states
 from bot.dialogs.generate_post import main_dialog
 from bot.dialogs.auto_schedule import auto_schedule_dialog
 from bot.dialogs.scheduled_posts import scheduled_posts_dialog
 from bot.dialogs.post_stats import post_stats_dialog
+from bot.speculative import speculative_images
 from bot.themes import set_global_themes
-from scheduler.jobs import scheduler, setup_stats_job
+from scheduler.jobs import cancel_running_jobs, reconcile_post_jobs, scheduler, setup_content_generation_job, setup_media_gc_job, setup_publish_sweeper_job, setup_stats_job
+from telegram_api.file_ids import FileIdMessageManager, PersistentMediaIdStorage, file_ids
+from telegram_api.notifications import notifier
 
 # Настройка логирования
 setup_logging(level=logging.DEBUG)  # Инициализация логирования
@@ -68,16 +85,84 @@ async def setup_handlers(dp: Dispatcher):
 
 @async_log_exception
 async def start_scheduler():
-    """Запуск планировщика задач"""
+    """Запуск планировщика задач (на паузе: задачи выполняет только лидер, см. become_leader)"""
     try:
-        scheduler.add_job(generate_travel_themes_job, 'date', run_date=datetime.now() + timedelta(seconds=5))
         await setup_stats_job()  # Добавляем задачу обновления статистики
-        scheduler.start()
-        logger.debug(f"⏰ Планировщик запущен. Текущие задачи: {scheduler.get_jobs()}")
+        await setup_media_gc_job()  # Добавляем задачу очистки хранилища изображений
+        await setup_publish_sweeper_job()  # Публикация по расписанию одной периодической задачей (если включено)
+        await setup_content_generation_job()  # Генерация постов из плана перед публикацией (если включено)
+        scheduler.start(paused=True)
+        logger.debug(f"⏰ Планировщик запущен на паузе. Текущие задачи: {scheduler.get_jobs()}")
     except Exception as e:
         logger.error(f"❌ Ошибка запуска планировщика: {e}")
 
 
+# Приём обновлений Telegram: работает только у лидера, иначе реплики конфликтуют за getUpdates
+# и делят между собой обновления одного диалога (состояние диалогов у каждой реплики своё)
+_polling: Optional[asyncio.Task] = None
+
+
+@async_log_exception
+async def become_leader(dp: Dispatcher):
+    """Запуск запланированной работы и приёма обновлений, когда реплика стала лидером"""
+    global _polling
+    scheduler.add_job(generate_travel_themes_job, 'date', run_date=datetime.now() + timedelta(seconds=5),
+                      id='generate_travel_themes', replace_existing=True)
+    # Задачи публикации хранятся в БД: до снятия с паузы сверяем их с запланированными постами
+    await reconcile_post_jobs()
+    scheduler.resume()
+    logger.debug(f"⏰ Планировщик снят с паузы. Текущие задачи: {scheduler.get_jobs()}")
+    # Сессия бота общая для всех периодов лидерства: закрывается при остановке бота, а не приёма обновлений
+    _polling = asyncio.create_task(dp.start_polling(bot_global, allowed_updates=dp.resolve_used_update_types(),
+                                                    handle_signals=False, close_bot_session=False))
+    logger.info("🟢 Бот готов к работе")
+
+
+async def stop_polling():
+    """Остановка приёма обновлений"""
+    global _polling
+    if _polling is not None and not _polling.done():
+        _polling.cancel()
+        await asyncio.gather(_polling, return_exceptions=True)
+    _polling = None
+
+
+async def step_down():
+    """Остановка запланированной работы и приёма обновлений, когда реплика перестала быть лидером"""
+    await stop_polling()
+    if scheduler.running:
+        scheduler.pause()
+        logger.debug("⏸️ Планировщик поставлен на паузу")
+    # Публикации и генерация, начатые до потери лидерства, не должны продолжаться параллельно с новым лидером
+    await cancel_running_jobs()
+
+
+async def run_leadership(dp: Dispatcher):
+    """Запуск и остановка работы лидера при смене лидера; завершается, если приём обновлений остановился сам"""
+    resume_task = None
+    try:
+        while True:
+            await leader.wait_elected()
+            await become_leader(dp)
+            if resume_task is None or resume_task.done():
+                # Дожидаемся операций Yandex.Art, прерванных прошлым перезапуском (в фоне, не задерживая старт)
+                resume_task = asyncio.create_task(resume_image_jobs())
+            lost = asyncio.create_task(leader.wait_lost())
+            await asyncio.wait({_polling, lost}, return_when=asyncio.FIRST_COMPLETED)
+            if not lost.done():
+                lost.cancel()
+                await _polling  # Ошибка приёма обновлений попадает в обработчик main
+                return
+            logger.warning("🟡 Реплика перешла в резерв")
+            if not resume_task.done():
+                resume_task.cancel()
+            await step_down()
+    finally:
+        await stop_polling()
+        if resume_task is not None and not resume_task.done():
+            resume_task.cancel()
+
+
 @async_log_exception
 async def generate_travel_themes_job():
     # Генерация тем при старте бота
@@ -98,32 +183,64 @@ async def stop_scheduler():
 @async_log_exception
 async def main():
     """Основная функция запуска бота"""
+    leadership = None
+    stopping = None
     try:
         # Инициализация БД
         await init_db()
         logger.debug("🗄️ База данных инициализирована")
+        # Общая HTTP-сессия для запросов к API нейросетей
+        await init_http_session()
         # Инициализация диспетчера
         storage = MemoryStorage()
         dp = Dispatcher(storage=storage)
         conf.dp = dp  # Сохраняем диспетчер в конфиге для дальнейшего использования
         # Подключение диалогов и обработчиков
         dp.include_router(router)
-        setup_dialogs(dp)
+        # file_id изображений диалогов сохраняются в БД, чтобы не загружать файлы повторно
+        setup_dialogs(dp, message_manager=FileIdMessageManager(), media_id_storage=PersistentMediaIdStorage())
         # Регистрация команд
         dp.startup.register(set_main_menu)
         await setup_handlers(dp)
         # Запуск планировщика
         await start_scheduler()
-        # Запуск бота
-        logger.info("🟢 Бот готов к работе")
-        await dp.start_polling(bot_global, allowed_updates=dp.resolve_used_update_types())
+        # Планировщик и приём обновлений работают только у лидера (одна реплика, если выбор лидера выключен)
+        await leader.start()
+        leadership = asyncio.create_task(run_leadership(dp))
+        # Остановка по сигналу на любой реплике, в том числе резервной
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError):  # Windows: остановка через KeyboardInterrupt
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        stopping = asyncio.create_task(stop.wait())
+        await asyncio.wait({leadership, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        if leadership.done():
+            await leadership  # Ошибка приёма обновлений или смены лидера попадает в обработчик ниже
     except Exception as e:
         logger.critical(f"💀 Критическая ошибка при запуске бота: {e}")
     finally:
+        for task in (leadership, stopping):
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
         await stop_scheduler()
+        await notifier.close()  # Отправка накопленной сводки уведомлений
+        await leader.stop()
+        await bot_global.session.close()
+        await yandex_art_poller.close()
+        await close_http_session()
+        await close_openai_client()
+        await llm_cache.close()
+        logger.info(f"[AIRouter] Статистика провайдеров: {provider_router.stats()}")
+        logger.info(f"[RateLimiter] Статистика очередей: {rate_limiter.stats()}")
+        logger.info(f"[FileIds] Статистика file_id: {file_ids.stats()}")
+        logger.info(f"[Speculative] Статистика фоновой генерации изображений: {speculative_images.stats()}")
+        logger.info(f"[Recompress] Статистика пережатия изображений: {recompress_stats.as_dict()}")
+        logger.info(f"[Publisher] Статистика публикаций: {publish_stats.as_dict()}")
+        logger.info(f"[Leader] Выбор лидера: {leader.stats()}")
+        logger.info(f"[Notify] Статистика уведомлений: {notifier.stats()}")
         logger.info("🛑 Работа бота завершена")
 
 
 if __name__ == '__main__':
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,151 @@
+# media_store/gc.py
+"""
+Сборка мусора в хранилище изображений
+
+Удаляет файлы хранилища (media/<xx>/<sha256>.jpg), на которые не ссылается ни один
+Post.image_path (вместе с их превью), и временные файлы, оставшиеся после сбоев. Файлы моложе min_age
+не трогаются: изображение могло быть только что сгенерировано и ещё не привязано к посту.
+Старые файлы вида media/generated_image_*.jpg не относятся к хранилищу и не удаляются.
+
+Ручной запуск (только отчёт):
+    python -m media_store.gc --dry-run
+"""
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import List, Set
+from sqlalchemy.future import select
+from config.env import conf
+from config.logging_config import logger
+from database.models import AsyncSessionLocal, Post
+from media_store.previews import remove_preview
+from media_store.writer import MEDIA_DIR, TMP_SUFFIX
+
+# Подпапка хранилища: первые 2 символа хэша
+SHARD_RE = re.compile(r"^[0-9a-f]{2}$")
+# Файл хранилища: SHA-256 в hex и расширение
+CONTENT_FILE_RE = re.compile(r"^[0-9a-f]{64}\.\w+$")
+# Сколько путей удаляемых файлов выводить в отчёт
+REPORT_SAMPLE_SIZE = 20
+
+
+@dataclass
+class GCReport:
+    dry_run: bool
+    scanned: int = 0
+    young: int = 0
+    orphans: List[str] = field(default_factory=list)
+    orphan_bytes: int = 0
+    deleted: int = 0
+
+    def summary(self) -> str:
+        action = "будет удалено" if self.dry_run else "удалено"
+        text = (f"проверено файлов: {self.scanned}, моложе порога: {self.young}, "
+                f"без ссылок: {len(self.orphans)} ({self.orphan_bytes / 1024 / 1024:.1f} МБ), "
+                f"{action}: {len(self.orphans) if self.dry_run else self.deleted}")
+        if self.orphans:
+            sample = ", ".join(self.orphans[:REPORT_SAMPLE_SIZE])
+            more = f" и ещё {len(self.orphans) - REPORT_SAMPLE_SIZE}" if len(self.orphans) > REPORT_SAMPLE_SIZE else ""
+            text += f"\n{sample}{more}"
+        return text
+
+
+def _normalize(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+async def referenced_paths() -> Set[str]:
+    """Нормализованные пути всех изображений, на которые ссылаются посты"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Post.image_path).where(Post.image_path.isnot(None)).distinct())
+        return {_normalize(path) for path in result.scalars().all() if path}
+
+
+def _scan(directory: str, referenced: Set[str], min_age: float, report: GCReport):
+    """Обход хранилища (выполняется в отдельном потоке)"""
+    now = time.time()
+
+    def check(entry: os.DirEntry):
+        report.scanned += 1
+        stat = entry.stat()
+        if now - stat.st_mtime < min_age:
+            report.young += 1
+            return
+        if entry.name.endswith(TMP_SUFFIX) or _normalize(entry.path) not in referenced:
+            report.orphans.append(entry.path)
+            report.orphan_bytes += stat.st_size
+
+    with os.scandir(directory) as root:
+        for entry in root:
+            if entry.is_file() and entry.name.endswith(TMP_SUFFIX):
+                check(entry)
+            elif entry.is_dir() and SHARD_RE.match(entry.name):
+                with os.scandir(entry.path) as shard:
+                    for file_entry in shard:
+                        if file_entry.is_file() and (CONTENT_FILE_RE.match(file_entry.name)
+                                                     or file_entry.name.endswith(TMP_SUFFIX)):
+                            check(file_entry)
+
+
+async def discard_image(image_path: str) -> bool:
+    """
+    Немедленное удаление изображения, которое оказалось не нужно (например, результат
+    фоновой генерации, от которого отказались). Файл не удаляется, если на него ссылается пост:
+    одинаковые изображения хранятся в одном файле.
+
+    Returns:
+        bool: True, если файл удалён
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Post.id).where(Post.image_path == image_path).limit(1))
+        if result.first() is not None:
+            return False
+    return await asyncio.to_thread(_delete, [image_path]) == 1
+
+
+def _delete(paths: List[str]) -> int:
+    deleted = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            deleted += 1
+            if CONTENT_FILE_RE.match(os.path.basename(path)):
+                remove_preview(path)
+        except OSError as e:
+            logger.warning(f"[MediaGC] Не удалось удалить {path}: {e}")
+    return deleted
+
+
+async def collect_garbage(dry_run: bool = False, min_age: float = 24 * 3600, directory: str = MEDIA_DIR) -> GCReport:
+    """
+    Удаление изображений, на которые не ссылается ни один пост
+
+    Args:
+        dry_run (bool): Только отчёт, без удаления
+        min_age (float): Файлы моложе этого возраста (секунды) не удаляются
+        directory (str): Корневая папка хранилища
+
+    Returns:
+        GCReport: Отчёт о проверенных и удалённых файлах
+    """
+    report = GCReport(dry_run=dry_run)
+    if not os.path.isdir(directory):
+        return report
+    referenced = await referenced_paths()
+    await asyncio.to_thread(_scan, directory, referenced, min_age, report)
+    if not dry_run and report.orphans:
+        report.deleted = await asyncio.to_thread(_delete, report.orphans)
+    logger.info(f"[MediaGC] {'Пробный запуск: ' if dry_run else ''}{report.summary()}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Только отчёт, без удаления файлов")
+    parser.add_argument("--min-age-hours", type=float, default=conf.media.gc_min_age_hours,
+                        help="Не удалять файлы моложе указанного возраста (часы)")
+    args = parser.parse_args()
+    print(asyncio.run(collect_garbage(dry_run=args.dry_run, min_age=args.min_age_hours * 3600)).summary())
@@ -0,0 +1,95 @@
+# media_store/previews.py
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import Dict, Optional
+from PIL import Image, ImageOps, UnidentifiedImageError
+from config.env import conf
+from config.logging_config import logger
+from media_store.writer import IMAGE_EXTENSION, MEDIA_DIR, TMP_SUFFIX
+
+# Папка кэша превью (сборщик мусора хранилища её не обходит)
+PREVIEW_DIR = os.path.join(MEDIA_DIR, "previews")
+
+# Блокировки на ключ превью, чтобы одно изображение не уменьшалось дважды одновременно
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+def preview_key(image_path: str) -> str:
+    """
+    Ключ превью
+
+    Для файлов хранилища (имя — SHA-256 содержимого) это само имя файла,
+    для остальных — хэш от пути, размера и времени изменения файла.
+    """
+    name, _ = os.path.splitext(os.path.basename(image_path))
+    if len(name) == 64 and all(c in "0123456789abcdef" for c in name):
+        return name
+    stat = os.stat(image_path)
+    raw = f"{os.path.abspath(image_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def preview_path(key: str) -> str:
+    """Путь к превью по ключу: media/previews/<первые 2 символа>/<ключ>.jpg"""
+    return os.path.join(PREVIEW_DIR, key[:2], f"{key}{IMAGE_EXTENSION}")
+
+
+def _render_preview(image_path: str, target: str, max_size: int, quality: int):
+    """Уменьшение изображения и атомарная запись превью (выполняется в отдельном потоке)"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+    try:
+        with Image.open(image_path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            image.convert("RGB").save(tmp_path, "JPEG", quality=quality, optimize=True)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def get_preview(image_path: Optional[str]) -> Optional[str]:
+    """
+    Путь к уменьшенной копии изображения для показа в диалогах
+
+    Превью создаётся один раз и хранится на диске; оригинал используется только для
+    публикации в канал. Если превью создать не удалось, возвращается оригинал.
+
+    Args:
+        image_path (str): Путь к оригинальному изображению
+
+    Returns:
+        Optional[str]: Путь к превью (или к оригиналу), None — если файла нет
+    """
+    if not image_path or not os.path.exists(image_path):
+        return None
+    if not conf.media.preview_enabled:
+        return image_path
+    try:
+        key = await asyncio.to_thread(preview_key, image_path)
+        target = preview_path(key)
+        if os.path.exists(target):
+            return target
+        lock = _locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if not os.path.exists(target):
+                await asyncio.to_thread(_render_preview, image_path, target,
+                                        conf.media.preview_max_size, conf.media.preview_quality)
+                logger.debug(f"[Previews] Создано превью {target} для {image_path}")
+        _locks.pop(key, None)
+        return target
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"[Previews] Не удалось создать превью для {image_path}: {e}")
+        return image_path
+
+
+def remove_preview(image_path: str):
+    """Удаление превью изображения хранилища (вызывается при удалении оригинала)"""
+    name, _ = os.path.splitext(os.path.basename(image_path))
+    target = preview_path(name)
+    if os.path.exists(target):
+        os.remove(target)
@@ -0,0 +1,110 @@
+# media_store/recompress.py
+"""
+Пережатие сгенерированных изображений перед загрузкой в Telegram
+
+Изображение уменьшается до максимальной стороны, перекодируется в прогрессивный JPEG
+без метаданных, а качество понижается шагами, пока файл не уложится в бюджет размера.
+Результат сохраняется в хранилище под новым хэшем; если он не меньше оригинала,
+остаётся оригинал.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Tuple
+from PIL import Image, ImageOps, UnidentifiedImageError
+from config.env import conf
+from config.logging_config import logger
+from media_store.gc import discard_image
+from media_store.writer import MEDIA_DIR, TMP_SUFFIX, content_path
+
+# Шаг понижения качества JPEG при подборе под бюджет размера
+QUALITY_STEP = 5
+
+
+@dataclass
+class RecompressStats:
+    images: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "images": self.images,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            "bytes_saved": self.bytes_before - self.bytes_after,
+        }
+
+
+# Статистика пережатия за время работы бота
+recompress_stats = RecompressStats()
+
+
+def _encode(image: Image.Image, quality: int, min_quality: int, max_bytes: int) -> Tuple[bytes, int]:
+    """Кодирование в прогрессивный JPEG с понижением качества до укладывания в max_bytes"""
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        if buffer.tell() <= max_bytes or quality <= min_quality:
+            return buffer.getvalue(), quality
+        quality = max(min_quality, quality - QUALITY_STEP)
+
+
+def _recompress(image_path: str, directory: str, quality: int, min_quality: int, max_side: int,
+                max_bytes: int) -> Tuple[str, int, int]:
+    """Пережатие изображения (выполняется в отдельном потоке); возвращает путь и размеры до и после"""
+    original_size = os.path.getsize(image_path)
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        # Метаданные (EXIF, XMP, комментарии) не передаются в save и поэтому не сохраняются
+        data, used_quality = _encode(image.convert("RGB"), quality, min_quality, max_bytes)
+    if len(data) >= original_size:
+        return image_path, original_size, original_size
+    target = content_path(hashlib.sha256(data).hexdigest(), directory)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.debug(f"[Recompress] {image_path}: {original_size} -> {len(data)} байт (качество {used_quality})")
+    return target, original_size, len(data)
+
+
+async def recompress_image(image_path: str, directory: str = MEDIA_DIR) -> str:
+    """
+    Пережатие изображения для загрузки в Telegram
+
+    Args:
+        image_path (str): Путь к изображению в хранилище
+        directory (str): Корневая папка хранилища
+
+    Returns:
+        str: Путь к пережатому изображению (или к оригиналу, если пережатие отключено,
+             не уменьшило файл или не удалось)
+    """
+    if not conf.media.recompress_enabled:
+        return image_path
+    try:
+        target, size_before, size_after = await asyncio.to_thread(
+            _recompress, image_path, directory, conf.media.recompress_quality, conf.media.recompress_min_quality,
+            conf.media.recompress_max_side, conf.media.recompress_max_bytes
+        )
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"[Recompress] Не удалось пережать {image_path}: {e}")
+        return image_path
+    recompress_stats.images += 1
+    recompress_stats.bytes_before += size_before
+    recompress_stats.bytes_after += size_after
+    if target != image_path:
+        # Оригинал больше не нужен (если только такое же изображение не прикреплено к другому посту)
+        await discard_image(image_path)
+    return target
@@ -0,0 +1,98 @@
+# media_store/writer.py
+import aiofiles
+import aiofiles.os
+import base64
+import hashlib
+import os
+import uuid
+from typing import Tuple
+
+# Папка для сгенерированных изображений
+MEDIA_DIR = "media"
+# Расширение файлов изображений Yandex.Art
+IMAGE_EXTENSION = ".jpg"
+# Суффикс временных файлов (недописанные изображения)
+TMP_SUFFIX = ".tmp"
+# Размер порции base64 при декодировании; кратен 4, чтобы каждая порция декодировалась отдельно
+B64_CHUNK_SIZE = 256 * 1024
+
+
+def content_path(digest: str, directory: str = MEDIA_DIR, extension: str = IMAGE_EXTENSION) -> str:
+    """
+    Путь к файлу по хэшу содержимого: media/<первые 2 символа>/<хэш>.jpg
+
+    Разбиение по подпапкам держит каждую папку небольшой, сколько бы изображений ни накопилось.
+    """
+    return os.path.join(directory, digest[:2], f"{digest}{extension}")
+
+
+async def _decode_to_file(data_b64: str, path: str) -> Tuple[int, str]:
+    """Декодирование base64 порциями с записью в файл; возвращает размер и SHA-256 содержимого"""
+    digest = hashlib.sha256()
+    written = 0
+    async with aiofiles.open(path, "wb") as f:
+        for offset in range(0, len(data_b64), B64_CHUNK_SIZE):
+            chunk = base64.b64decode(data_b64[offset:offset + B64_CHUNK_SIZE])
+            digest.update(chunk)
+            await f.write(chunk)
+            written += len(chunk)
+    return written, digest.hexdigest()
+
+
+async def write_base64_file(data_b64: str, path: str) -> int:
+    """
+    Потоковое декодирование base64 и атомарная запись в файл
+
+    Строка декодируется порциями по B64_CHUNK_SIZE символов, поэтому в памяти
+    одновременно находится не больше одной декодированной порции, а не всё изображение.
+    Запись идёт во временный файл, который затем переименовывается в path: читатели
+    никогда не видят недописанный файл.
+
+    Returns:
+        int: Количество записанных байт
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+    try:
+        written, _ = await _decode_to_file(data_b64, tmp_path)
+        await aiofiles.os.replace(tmp_path, path)
+    except BaseException:
+        await _remove_quietly(tmp_path)
+        raise
+    return written
+
+
+async def save_base64_image(data_b64: str, directory: str = MEDIA_DIR) -> str:
+    """
+    Сохранение изображения из base64 в хранилище с адресацией по содержимому
+
+    Файл называется по SHA-256 декодированных байт, поэтому одинаковые изображения
+    хранятся один раз, а одновременные генерации не перезаписывают чужие файлы.
+    Хэш считается по ходу записи во временный файл, без второго прохода.
+
+    Args:
+        data_b64 (str): Изображение в base64 (как его возвращает Yandex.Art)
+        directory (str): Корневая папка хранилища
+
+    Returns:
+        str: Путь к сохранённому изображению
+    """
+    await aiofiles.os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f"{uuid.uuid4().hex}{TMP_SUFFIX}")
+    try:
+        _, digest = await _decode_to_file(data_b64, tmp_path)
+        path = content_path(digest, directory)
+        await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Если такое изображение уже есть, файл заменяется идентичным: копия остаётся одна,
+        # а свежая дата изменения защищает его от сборщика мусора до привязки к посту
+        await aiofiles.os.replace(tmp_path, path)
+    except BaseException:
+        await _remove_quietly(tmp_path)
+        raise
+    return path
+
+
+async def _remove_quietly(path: str):
+    try:
+        await aiofiles.os.remove(path)
+    except OSError:
+        pass
@@ -1,26 +1,90 @@
 # openai_api/client.py
+import httpx
 import json
-from openai import OpenAI, APIError, AuthenticationError, RateLimitError, OpenAIError
+from openai import (AsyncOpenAI, DefaultAsyncHttpxClient, APIError, APIConnectionError, AuthenticationError,
+                    InternalServerError, RateLimitError, OpenAIError)
+from typing import AsyncIterator, List, Optional
+from ai_providers.errors import ProviderUnavailableError
+from ai_providers.rate_limiter import rate_limiter, retry_after
 from config.env import conf
 from config.logging_config import logger, async_log_exception
 
-client = OpenAI(api_key=conf.openai.api_key)
+# Температура генерации для разных задач
+THEMES_TEMPERATURE = 0.7
+TEXT_TEMPERATURE = 0.5
+IMAGE_PROMPT_TEMPERATURE = 0.3
+# Ошибки, при которых OpenAI считается временно недоступным (таймауты, сеть, 5xx, 429)
+UNAVAILABLE_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+# Глобальный асинхронный клиент OpenAI (создаётся лениво, пул соединений общий на процесс)
+_client: Optional[AsyncOpenAI] = None
+
+
+def get_client() -> AsyncOpenAI:
+    """
+    Возвращает общий асинхронный клиент OpenAI
+
+    Запросы не блокируют event loop, отмена корутины прерывает HTTP-запрос.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=conf.openai.api_key,
+            timeout=httpx.Timeout(conf.openai.timeout, connect=conf.openai.connect_timeout),
+            max_retries=conf.openai.max_retries,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=conf.http.pool_limit,
+                    max_keepalive_connections=conf.http.pool_limit_per_host,
+                    keepalive_expiry=conf.http.keepalive_timeout
+                )
+            )
+        )
+    return _client
+
+
+async def close_client():
+    """Закрытие клиента OpenAI и его пула соединений (вызывается при остановке бота)"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+        logger.debug("🌐 Клиент OpenAI закрыт")
+
+
+async def _create_completion(**kwargs):
+    """Запрос к chat.completions через общий ограничитель частоты запросов"""
+    async with rate_limiter.slot("openai_api", "chat"):
+        try:
+            return await get_client().chat.completions.create(**kwargs)
+        except RateLimitError as e:
+            rate_limiter.pause("openai_api", "chat", retry_after(e.response.headers))
+            raise
+
+
+def _themes_user_prompt(count: int, exclude: Optional[List[str]] = None) -> str:
+    """Запрос пользователя на генерацию тем с учётом уже имеющихся"""
+    prompt = f"Сгенерируй {count} уникальных тем для постов о путешествиях, избегая повторов и стандартных примеров"
+    if exclude:
+        prompt += "\nНе повторяй эти темы и их направления:\n" + "\n".join(f"- {theme}" for theme in exclude)
+    return prompt
 
 
 @async_log_exception
-async def generate_travel_themes(model: str = conf.openai.gpt_model, count: int = 4) -> dict:
+async def generate_travel_themes(model: str = conf.openai.gpt_model, count: int = 4, exclude: Optional[List[str]] = None) -> dict:
     """
     Генерация тем для постов о путешествиях
 
     Args:
         model (str): Модель OpenAI (по умолчанию из конфига)
         count (int): Количество тем для генерации (по умолчанию 4)
+        exclude (list): Уже имеющиеся темы, которые нельзя повторять
 
     Returns:
-        dict: {'themes': ["тема1", "тема2", ...]}
+        dict: {'themes': ["тема1", "тема2", ...]}; при ошибке — запасные темы и флаг 'fallback': True
     """
     try:
-        completion = client.chat.completions.create(
+        completion = await _create_completion(
             model=model,
             messages=[{"role": "system", "content": f"""
 Вы — эксперт по путешествиям. Сгенерируйте {count} уникальных тем для постов о путешествиях.
@@ -60,9 +124,9 @@ async def generate_travel_themes(model: str = conf.openai.gpt_model, count: int
     ]
 }}
 """},
-                {"role": "user", "content": f"Сгенерируй {count} уникальных тем для постов о путешествиях, избегая повторов и стандартных примеров"}
+                {"role": "user", "content": _themes_user_prompt(count, exclude)}
                       ],
-            temperature=0.7,
+            temperature=THEMES_TEMPERATURE,
             max_tokens=2000,
             response_format={"type": "json_object"}
         )
@@ -75,11 +139,16 @@ async def generate_travel_themes(model: str = conf.openai.gpt_model, count: int
             raise ValueError("Некорректная структура JSON: отсутствует ключ 'themes'")
         themes = parsed["themes"]
         # Проверка количества тем
-        if not isinstance(themes, list) or len(themes) != count:
-            logger.warning(f"Количество тем не равно {count}")
-            raise ValueError(f"Количество тем не равно {count}")
+        if not isinstance(themes, list) or not themes:
+            logger.warning("Список тем пуст")
+            raise ValueError("Список тем пуст")
+        if len(themes) != count:
+            logger.warning(f"Получено {len(themes)} тем вместо {count}")
+        themes = themes[:count]
         logger.info(f"[OpenAI] Сгенерированы уникальные темы: {themes}")
         return {"themes": themes}
+    except UNAVAILABLE_ERRORS as e:
+        raise ProviderUnavailableError(f"OpenAI недоступен: {e}") from e
     except (json.JSONDecodeError, KeyError, ValueError) as e:
         logger.error(f"[OpenAI] Ошибка парсинга тем: {e}")
         # Возвращаем fallback темы
@@ -93,10 +162,26 @@ async def generate_travel_themes(model: str = conf.openai.gpt_model, count: int
                 "🌿 Эко-путешествия по скрытым уголкам Амазонки",
                 "🏔️ Экстремальные треккинги в горах Патагонии",
                 "🎨 Арт-туры по скрытым галереям Парижа"
-            ]
+            ],
+            "fallback": True
         }
 
 
+def _build_text_messages(prompt: str, style: str) -> list:
+    """Формирование сообщений для генерации текста поста"""
+    # Определяем стиль текста
+    style_instructions = {
+        "casual": "Используйте дружелюбный и непринужденный стиль, как будто вы разговариваете с другом.",
+        "professional": "Используйте формальный и профессиональный стиль, подходящий для делового контента.",
+        "humorous": "Добавьте юмор и шутки в текст, сделайте его веселым и забавным.",
+        "poetic": "Используйте поэтический стиль с метафорами и образами."
+    }
+    # Выбираем инструкции в зависимости от стиля
+    selected_style = style_instructions.get(style.lower(), style_instructions["casual"])
+    return [{'role': 'system', 'content': f'Вы SMM-эксперт. Генерируй тексты для Телеграмм канала на заданную тему. Длинна текста не должна превышать 900 символов. Можно использовать смайлики. {selected_style} Вопросы пользователю не задавай.'},
+            {'role': 'user', 'content': prompt}]
+
+
 @async_log_exception
 async def generate_text(prompt: str, model: str = conf.openai.gpt_model, max_tokens: int = 500, style: str = "casual") -> str:
     """
@@ -111,45 +196,79 @@ async def generate_text(prompt: str, model: str = conf.openai.gpt_model, max_tok
         str: Сгенерированный текст
     """
     try:
-        # Определяем стиль текста
-        style_instructions = {
-            "casual": "Используйте дружелюбный и непринужденный стиль, как будто вы разговариваете с другом.",
-            "professional": "Используйте формальный и профессиональный стиль, подходящий для делового контента.",
-            "humorous": "Добавьте юмор и шутки в текст, сделайте его веселым и забавным.",
-            "poetic": "Используйте поэтический стиль с метафорами и образами."
-        }
-        # Выбираем инструкции в зависимости от стиля
-        selected_style = style_instructions.get(style.lower(), style_instructions["casual"])
         # Вызов OpenAI API
-        completion = client.chat.completions.create(
-            messages=[{'role': 'system', 'content': f'Вы SMM-эксперт. Генерируй тексты для Телеграмм канала на заданную тему. Длинна текста не должна превышать 900 символов. Можно использовать смайлики. {selected_style} Вопросы пользователю не задавай.'},
-                      {'role': 'user', 'content': prompt}
-            ],
+        completion = await _create_completion(
+            messages=_build_text_messages(prompt, style),
             model=model,
             max_tokens=max_tokens,
-            temperature=0.5
+            temperature=TEXT_TEMPERATURE
         )
         # Возврат сгенерированного текста
         return completion.choices[0].message.content.strip()
+    except UNAVAILABLE_ERRORS as e:
+        raise ProviderUnavailableError(f"OpenAI недоступен: {e}") from e
     except AuthenticationError as auth_error:
         raise Exception(f"Ошибка аутентификации OpenAI: {auth_error}")
     except APIError as api_error:
         raise Exception(f"Ошибка API OpenAI: {api_error}")
-    except RateLimitError as rate_limit_error:
-        raise Exception(f"Превышен лимит запросов к OpenAI: {rate_limit_error}")
     except OpenAIError as ex:
         raise Exception(f"Общая ошибка OpenAI: {ex}")
     except Exception as e:
         raise Exception(f"Ошибка генерации текста: {e}")
 
 
+async def generate_text_stream(prompt: str, model: str = conf.openai.gpt_model, max_tokens: int = 500,
+                               style: str = "casual") -> AsyncIterator[str]:
+    """
+    Потоковая генерация текста через OpenAI API
+
+    Args:
+        prompt (str): Текстовый запрос
+        model (str): Модель OpenAI (по умолчанию из конфига)
+        max_tokens (int): Максимальное количество токенов в ответе
+        style (str): Стиль текста (casual, professional, humorous, poetic)
+
+    Yields:
+        str: Текст, сгенерированный к текущему моменту (каждый раз целиком, а не приращение)
+    """
+    text = ""
+    try:
+        # Слот ограничителя занят, пока читается поток
+        async with rate_limiter.slot("openai_api", "chat"):
+            stream = await get_client().chat.completions.create(
+                messages=_build_text_messages(prompt, style),
+                model=model,
+                max_tokens=max_tokens,
+                temperature=TEXT_TEMPERATURE,
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    text += delta
+                    yield text
+    except RateLimitError as e:
+        rate_limiter.pause("openai_api", "chat", retry_after(e.response.headers))
+        raise ProviderUnavailableError(f"OpenAI недоступен: {e}") from e
+    except UNAVAILABLE_ERRORS as e:
+        raise ProviderUnavailableError(f"OpenAI недоступен: {e}") from e
+    except AuthenticationError as auth_error:
+        raise Exception(f"Ошибка аутентификации OpenAI: {auth_error}")
+    except APIError as api_error:
+        raise Exception(f"Ошибка API OpenAI: {api_error}")
+    except OpenAIError as ex:
+        raise Exception(f"Общая ошибка OpenAI: {ex}")
+    if not text:
+        raise Exception("Пустой ответ OpenAI")
+
+
 @async_log_exception
 async def generate_image_prompt(post_text: str) -> str:
     """
     Генерация промпта для изображения на основе сгенерированного текста
     """
     try:
-        completion = client.chat.completions.create(
+        completion = await _create_completion(
             model=conf.openai.gpt_model,
             messages=[
                 {'role': 'system', 'content': """Вы SMM-эксперт и визуальный дизайнер. 
@@ -163,11 +282,14 @@ async def generate_image_prompt(post_text: str) -> str:
                 {'role': 'user', 'content': f'Текст поста:\n{post_text}'}
             ],
             max_tokens=200,
-            temperature=0.3
+            temperature=IMAGE_PROMPT_TEMPERATURE
         )
         image_prompt = completion.choices[0].message.content.strip()
         logger.info(f"[OpenAI] Промпт для изображения: {image_prompt}")
         return image_prompt
+    except UNAVAILABLE_ERRORS as e:
+        logger.error(f"[OpenAI] Ошибка генерации промпта для изображения: {e}")
+        raise ProviderUnavailableError(f"OpenAI недоступен: {e}") from e
     except Exception as e:
         logger.error(f"[OpenAI] Ошибка генерации промпта для изображения: {e}")
         raise
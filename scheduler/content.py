@@ -0,0 +1,137 @@
+# scheduler/content.py
+"""
+Отложенная (just-in-time) генерация постов автопланирования
+
+При AUTO_SCHEDULE_DEFERRED=True подтверждение расписания сохраняет только план:
+строки Post со временем публикации, темой (text_prompt), стилем изображения и
+status_text=PENDING. Фоновая задача генерирует текст и изображение каждого поста
+за AUTO_SCHEDULE_LEAD_TIME до публикации, поэтому нагрузка на API нейросетей
+распределяется по времени так же, как сами публикации.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List
+from sqlalchemy import update
+from sqlalchemy.future import select
+from config.config import generate_image_prompt, generate_text, get_current_model
+from config.env import conf, datetime_local
+from config.logging_config import logger, async_log_exception
+from database.models import AsyncSessionLocal, GenerationType, Post
+from yandex_art.client import generate_image
+
+# Генерации, идущие прямо сейчас (фоновой задачей или перед публикацией), по ID поста
+_in_progress: Dict[int, asyncio.Task] = {}
+
+
+@async_log_exception
+async def save_schedule_plan(slots: List[tuple], image_style: str) -> List[int]:
+    """
+    Сохранение плана автопланирования без генерации
+
+    Args:
+        slots (List[tuple]): Пары (дата и время публикации, тема)
+        image_style (str): Стиль изображений
+
+    Returns:
+        List[int]: ID созданных постов в порядке слотов
+    """
+    async with AsyncSessionLocal() as session:
+        posts = [
+            Post(
+                text_prompt=theme,
+                image_style=image_style,
+                scheduled_at=scheduled_datetime,
+                is_scheduled=True,
+                status_text=GenerationType.PENDING,
+                status_image=GenerationType.PENDING
+            )
+            for scheduled_datetime, theme in slots
+        ]
+        session.add_all(posts)
+        await session.commit()
+        return [post.id for post in posts]
+
+
+async def generate_post_content(post_id: int) -> bool:
+    """
+    Генерация текста, промпта и изображения для запланированного поста из плана
+
+    Если пост уже генерируется, дожидается этой генерации, а не запускает вторую.
+
+    Returns:
+        bool: True, если текст поста готов (изображение могло не сгенерироваться)
+    """
+    task = _in_progress.get(post_id)
+    if task is None:
+        task = asyncio.create_task(_generate_post_content(post_id))
+        _in_progress[post_id] = task
+        task.add_done_callback(lambda _: _in_progress.pop(post_id, None))
+    return await asyncio.shield(task)
+
+
+async def cancel_content_generation():
+    """Отмена идущих генераций (реплика перестала быть лидером: посты сгенерирует новый лидер)"""
+    tasks = list(_in_progress.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _generate_post_content(post_id: int) -> bool:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Post).where(Post.id == post_id))
+        post = result.scalars().first()
+        if post is None or post.status_text != GenerationType.PENDING:
+            return post is not None
+        theme = post.text_prompt
+        image_style = post.image_style or conf.auto_schedule.image_style
+    try:
+        post_text = await generate_text(theme, use_cache=False)
+        # Модель фиксируем сразу: текст мог сгенерировать резервный провайдер
+        model_text = await get_current_model()
+        image_prompt = await generate_image_prompt(post_text, use_cache=False)
+    except Exception as e:
+        logger.error(f"[JIT] Пост {post_id}: ошибка генерации текста для темы {theme}: {e}")
+        return False
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(Post).where(Post.id == post_id).values(
+                text=post_text,
+                model_text=model_text,
+                generated_at_text=datetime_local(),
+                status_text=GenerationType.SUCCESS,
+                image_prompt=image_prompt,
+                model_image=conf.yandex.art_model
+            )
+        )
+        await session.commit()
+    # Изображение (или ошибка) записывается в пост, в том числе после перезапуска бота
+    image_path = await generate_image(image_prompt, style=image_style, post_id=post_id)
+    if not image_path:
+        logger.warning(f"[JIT] Пост {post_id} будет опубликован без изображения")
+    logger.info(f"[JIT] Пост {post_id} сгенерирован (тема: {theme})")
+    return True
+
+
+@async_log_exception
+async def generate_upcoming_posts():
+    """Генерация постов из плана, до публикации которых осталось меньше AUTO_SCHEDULE_LEAD_TIME"""
+    horizon = datetime.now() + timedelta(seconds=conf.auto_schedule.lead_time)
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Post.id)
+            .where(Post.published == False, Post.is_scheduled == True,
+                   Post.status_text == GenerationType.PENDING, Post.scheduled_at <= horizon)
+            .order_by(Post.scheduled_at)
+        )
+        post_ids = [post_id for post_id in result.scalars().all() if post_id not in _in_progress]
+    if not post_ids:
+        return
+    logger.debug(f"[JIT] Генерация постов перед публикацией: {post_ids}")
+    semaphore = asyncio.Semaphore(max(conf.auto_schedule.concurrency, 1))
+
+    async def generate(post_id: int):
+        async with semaphore:
+            await generate_post_content(post_id)
+
+    await asyncio.gather(*(generate(post_id) for post_id in post_ids))
@@ -1,60 +1,424 @@
 # scheduler/jobs.py
+import asyncio
+import os
+import time
+from functools import wraps
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.util import convert_to_datetime
 from datetime import datetime, timedelta
+from sqlalchemy import func, or_, select as sa_select, update
+from sqlalchemy.engine import make_url
 from sqlalchemy.future import select
-from telegram_api.client import publish_post_to_group
+from typing import Dict, List, Optional, Set
+from telegram_api.notifications import notifier
 from telegram_api.stats import fetch_post_stats
-from config.env import bot_global, conf
+from config.env import conf
 from config.logging_config import logger, async_log_exception
-from database.models import AsyncSessionLocal, Post
+from database.models import AsyncSessionLocal, GenerationType, Post
+from media_store.gc import collect_garbage
+from scheduler.content import cancel_content_generation, generate_post_content, generate_upcoming_posts
+from scheduler.publisher import PostClaimed, PublishFailed, publish_post
 
-scheduler = AsyncIOScheduler()
+# Хранилище задач публикации постов: хранится в БД и переживает перезапуск бота.
+# Служебные периодические задачи (статистика, очистка) создаются заново при запуске и живут в памяти
+POSTS_JOBSTORE = 'posts'
+# Префикс ID задачи публикации: publish_post_<ID поста>
+PUBLISH_JOB_PREFIX = 'publish_post_'
+
+
+# Ожидание блокировки файла хранилища задач SQLite (секунды)
+SQLITE_JOBSTORE_TIMEOUT = 5
+
+
+def _jobstore_url() -> str:
+    """
+    URL БД для хранилища задач: SCHEDULER_JOBSTORE_URL или DB_URI с синхронным драйвером
+
+    SQLAlchemyJobStore синхронный: каждое добавление, перенос и удаление задачи — блокирующий
+    запрос прямо в цикле событий. Для SQLite хранилище поэтому вынесено в отдельный файл рядом
+    с основной БД (<имя>.jobs<расширение>): запись задач не ждёт блокировку файла, занятого
+    асинхронными запросами бота, и не получает "database is locked". Источник истины — таблица
+    постов, задачи восстанавливаются из неё при запуске (reconcile_post_jobs).
+    """
+    if conf.scheduler.jobstore_url:
+        return conf.scheduler.jobstore_url
+    url = make_url(conf.db.DB_URI)
+    url = url.set(drivername=url.get_backend_name())
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        root, ext = os.path.splitext(url.database)
+        url = url.set(database=f"{root}.jobs{ext}")
+    return url.render_as_string(hide_password=False)
+
+
+def _jobstore_engine_options() -> dict:
+    if make_url(_jobstore_url()).get_backend_name() == 'sqlite':
+        return {'connect_args': {'timeout': SQLITE_JOBSTORE_TIMEOUT}}
+    return {}
+
+
+posts_jobstore = SQLAlchemyJobStore(url=_jobstore_url(), engine_options=_jobstore_engine_options())
+scheduler = AsyncIOScheduler(jobstores={'default': MemoryJobStore(), POSTS_JOBSTORE: posts_jobstore})
+# Задачи планировщика, которые выполняются прямо сейчас: при потере лидерства они отменяются
+_running_jobs: Set[asyncio.Task] = set()
+
+
+def leader_job(func):
+    """Декоратор задачи планировщика, которую нужно прервать, когда реплика перестаёт быть лидером"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        task = asyncio.current_task()
+        _running_jobs.add(task)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _running_jobs.discard(task)
+    return wrapper
+
+
+async def cancel_running_jobs():
+    """
+    Отмена публикаций и генерации постов, идущих на реплике, которая перестала быть лидером
+
+    Пост, отправка которого прервана, остаётся с отметкой о начале отправки (см. scheduler.publisher):
+    новый лидер не отправит его повторно без подтверждения администратора.
+    """
+    tasks = list(_running_jobs)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await cancel_content_generation()
+    if tasks:
+        logger.info(f"[Scheduler] Прервано задач планировщика: {len(tasks)}")
+
+
+def publish_job_id(post_id: int) -> str:
+    return f"{PUBLISH_JOB_PREFIX}{post_id}"
+
+
+def _scheduler_now() -> datetime:
+    """Текущее время в часовом поясе планировщика (в нём же трактуется Post.scheduled_at)"""
+    return datetime.now(scheduler.timezone).replace(tzinfo=None)
 
 
 @async_log_exception
-async def schedule_post_job(scheduled_time: datetime, post_id: int):
-    """Добавление задачи в планировщик"""
-    async def job():
+@leader_job
+async def publish_scheduled_post(post_id: int) -> bool:
+    """
+    Публикация запланированного поста (задача планировщика, хранится в БД по ссылке на функцию)
+
+    Returns:
+        bool: True, если пост опубликован (в том числе ранее), False — при ошибке
+    """
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Post).where(Post.id == post_id))  # Используем 'id' поста
+            post = result.scalars().first()
+            if not post:
+                logger.error(f"Пост с ID {post_id} не найден")
+                return False
+            if post.published:
+                logger.info(f"Пост {post_id} уже опубликован, задача пропущена")
+                return True
+            if post.status_text == GenerationType.PENDING:
+                # Пост из плана отложенной генерации не успел сгенерироваться заранее — генерируем сейчас
+                logger.warning(f"Пост {post_id} не сгенерирован заранее, генерация перед публикацией")
+                if not await generate_post_content(post_id):
+                    raise RuntimeError("не удалось сгенерировать текст поста")
+                await session.refresh(post)
+        # Публикация поста: пост захватывается в БД, поэтому повторная задача или ручная публикация его не задублируют
+        channel_id = conf.tg_bot.channel_id
         try:
-            async with AsyncSessionLocal() as session:
-                result = await session.execute(select(Post).where(Post.id == post_id))  # Используем 'id' поста
-                post = result.scalars().first()
-                if not post:
-                    logger.error(f"Пост с ID {post_id} не найден")
-                    return
-                # Публикация поста
-                channel_id = conf.tg_bot.channel_id
-                message_id = await publish_post_to_group(channel_id, post.text, post.image_path)
-                logger.info(f"Пост {post_id} успешно опубликован по расписанию")
-                # Обновление данных в БД
-                post.published = True
-                post.published_at = datetime.now()
-                post.message_id = message_id
-                await session.commit()
-                # Формирование ссылки
-                if channel_id.startswith("-100"):
-                    clean_chat_id = channel_id[4:]  # Убираем "-100"
-                elif channel_id.startswith("-"):
-                    clean_chat_id = channel_id[1:]  # Убираем "-"
-                else:
-                    clean_chat_id = channel_id
-                post_url = f"https://t.me/c/{clean_chat_id}/{message_id}"
-                # Отправка уведомления администраторам
-                for admin_id in conf.tg_bot.admin_ids:
-                    try:
-                        await bot_global.send_message(chat_id=admin_id, text=f"<b>⏰ Пост опубликован по расписанию! ✅</b>\n🔗 {post_url}")
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления администратору {admin_id}: {e}")
-        except Exception as ee:
-            logger.error(f"Ошибка публикации поста {post_id} по расписанию: {ee}")
-            # Уведомление администраторов об ошибке
-            for admin_id in conf.tg_bot.admin_ids:
-                try:
-                    await bot_global.send_message(chat_id=admin_id, text=f"❌ Ошибка публикации поста {post_id} по расписанию\n📝 Ошибка: {ee}")
-                except Exception as e:
-                    logger.exception(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
-    # Добавляем задачу в планировщик
-    scheduler.add_job(job, 'date', run_date=scheduled_time)
+            message_id = await publish_post(post_id, channel_id)
+        except PostClaimed:
+            logger.info(f"Пост {post_id} уже опубликован или публикуется другим обработчиком, задача пропущена")
+            return True
+        logger.info(f"Пост {post_id} успешно опубликован по расписанию")
+        # Формирование ссылки
+        if channel_id.startswith("-100"):
+            clean_chat_id = channel_id[4:]  # Убираем "-100"
+        elif channel_id.startswith("-"):
+            clean_chat_id = channel_id[1:]  # Убираем "-"
+        else:
+            clean_chat_id = channel_id
+        post_url = f"https://t.me/c/{clean_chat_id}/{message_id}"
+        # Отправка уведомления администраторам
+        await notifier.notify(f"<b>⏰ Пост опубликован по расписанию! ✅</b>\n🔗 {post_url}")
+        return True
+    except Exception as ee:
+        attempts = ee.attempts if isinstance(ee, PublishFailed) else 1
+        logger.error(f"Ошибка публикации поста {post_id} по расписанию (попыток: {attempts}): {ee}")
+        await move_to_dead_letter(post_id, attempts, str(ee))
+        # Уведомление администраторов об ошибке
+        await notifier.notify(f"❌ Ошибка публикации поста {post_id} по расписанию (попыток: {attempts})\n📝 Ошибка: {ee}\n"
+                            f"🔁 Пост можно отправить повторно из списка запланированных постов")
+        return False
+
+
+async def move_to_dead_letter(post_id: int, attempts: int, error: str):
+    """Снятие поста с расписания после неудавшейся публикации: он ждёт повторной отправки администратором"""
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                # Пост, который уже захватил другой обработчик, не трогаем
+                update(Post).where(Post.id == post_id, Post.published == False, Post.publish_token.is_(None)).values(
+                    dead_letter=True,
+                    is_scheduled=False,
+                    claimed_at=None,
+                    publish_attempts=func.coalesce(Post.publish_attempts, 0) + attempts,
+                    error_message=error
+                )
+            )
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Не удалось отметить пост {post_id} как неопубликованный: {e}")
+
+
+@async_log_exception
+async def requeue_post(post_id: int, confirmed: bool = False) -> Optional[datetime]:
+    """
+    Повторная постановка в очередь поста, публикация которого не удалась
+
+    Пост публикуется в исходное время, если оно ещё не прошло, иначе — сразу. Пост, отправка
+    которого завершилась с неизвестным исходом, ставится в очередь только с подтверждением
+    администратора, что в канале его нет.
+
+    Args:
+        post_id (int): ID поста
+        confirmed (bool): Администратор проверил канал, поста там нет
+
+    Returns:
+        Optional[datetime]: Новое время публикации или None, если пост не ждёт повторной отправки
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Post).where(Post.id == post_id, Post.dead_letter == True, Post.published == False)
+        )
+        post = result.scalars().first()
+        if post is None or (post.send_started_at is not None and not confirmed):
+            return None
+        now = _scheduler_now()
+        scheduled_time = post.scheduled_at if post.scheduled_at and post.scheduled_at > now else now
+        post.dead_letter = False
+        post.publish_attempts = 0
+        post.error_message = None
+        post.claimed_at = None
+        post.publish_token = None
+        post.send_started_at = None
+        post.is_scheduled = True
+        post.scheduled_at = scheduled_time
+        await session.commit()
+    await schedule_post_job(scheduled_time, post_id)
+    logger.info(f"Пост {post_id} снова поставлен в очередь публикации на {scheduled_time}")
+    return scheduled_time
+
+
+@async_log_exception
+async def schedule_post_job(scheduled_time: datetime, post_id: int):
+    """Добавление (или перенос) задачи публикации поста в планировщик"""
+    if conf.scheduler.engine == 'sweeper':
+        # Расписание — сама строка поста; снимаем прежний захват, чтобы перенесённый пост снова попал в выборку
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Post).where(Post.id == post_id).values(claimed_at=None))
+            await session.commit()
+        return
+    scheduler.add_job(
+        publish_scheduled_post,
+        'date',
+        run_date=scheduled_time,
+        args=[post_id],
+        id=publish_job_id(post_id),
+        jobstore=POSTS_JOBSTORE,
+        replace_existing=True,
+        misfire_grace_time=int(conf.scheduler.missed_max_age) or None
+    )
+
+
+@async_log_exception
+async def unschedule_post_job(post_id: int):
+    """Удаление задачи публикации поста (пост удалён или опубликован вручную)"""
+    try:
+        scheduler.remove_job(publish_job_id(post_id), jobstore=POSTS_JOBSTORE)
+    except JobLookupError:
+        pass
+
+
+def _stored_publish_jobs() -> Dict[int, Optional[float]]:
+    """ID постов и время запуска задач публикации в хранилище (без распаковки самих задач)"""
+    table = posts_jobstore.jobs_t
+    with posts_jobstore.engine.begin() as connection:
+        rows = connection.execute(
+            sa_select(table.c.id, table.c.next_run_time).where(table.c.id.like(f"{PUBLISH_JOB_PREFIX}%"))
+        ).all()
+    return {int(job_id[len(PUBLISH_JOB_PREFIX):]): next_run_time for job_id, next_run_time in rows}
+
+
+@async_log_exception
+async def reconcile_post_jobs():
+    """
+    Сверка задач публикации с таблицей постов при запуске
+
+    Источник истины — посты с is_scheduled=True и published=False. Задачи создаются
+    только для постов, у которых задачи нет или время в ней отличается; задачи
+    удалённых и опубликованных постов удаляются. Посты, время которых прошло, пока бот
+    был выключен, публикуются по очереди (SCHEDULER_MISSED_POLICY=publish) или
+    переносятся в неудавшиеся публикации (skip; а также при опоздании больше
+    SCHEDULER_MISSED_MAX_AGE) — их можно повторить из списка запланированных постов.
+    При PUBLISH_ENGINE=sweeper задачи публикации не нужны: оставшиеся удаляются,
+    а пропущенные посты публикует sweeper — время их публикации разносится на тот же интервал.
+    Вызывается при запущенном на паузе планировщике.
+    """
+    sweeper = conf.scheduler.engine == 'sweeper'
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Post.id, Post.scheduled_at)
+            .where(Post.is_scheduled == True, Post.published == False, Post.scheduled_at.isnot(None))
+            .order_by(Post.scheduled_at)
+        )
+        pending = result.all()
+    stored = _stored_publish_jobs()
+    now = time.time()
+    max_age = conf.scheduler.missed_max_age
+    rescheduled, catch_up, missed = 0, [], []
+    for post_id, scheduled_at in pending:
+        run_at = convert_to_datetime(scheduled_at, scheduler.timezone, 'run_date').timestamp()
+        if run_at <= now:
+            if conf.scheduler.missed_policy == 'publish' and (max_age <= 0 or now - run_at <= max_age):
+                catch_up.append(post_id)
+            else:
+                missed.append(post_id)
+        elif not sweeper and (stored.get(post_id) is None or abs(stored[post_id] - run_at) > 1):
+            await schedule_post_job(scheduled_at, post_id)
+            rescheduled += 1
+    # Задачи постов, которые удалены, опубликованы или сняты с расписания
+    pending_ids = {post_id for post_id, _ in pending}
+    stale = [post_id for post_id in stored if sweeper or post_id not in pending_ids or post_id in missed]
+    for post_id in stale:
+        await unschedule_post_job(post_id)
+    # Пропущенные посты публикуются с интервалом, чтобы не выложить их в канал разом
+    started = datetime.now()
+    if sweeper:
+        # Sweeper публикует всё, чьё время прошло: разносим время публикации в самих постах
+        await _space_catch_up(catch_up, _scheduler_now())
+    else:
+        for index, post_id in enumerate(catch_up):
+            await schedule_post_job(started + timedelta(seconds=index * conf.scheduler.catchup_interval), post_id)
+    # Пропущенные посты попадают в очередь неудавшихся публикаций: администратор может их повторить
+    for post_id in missed:
+        await move_to_dead_letter(post_id, 0, "Время публикации пропущено: бот был выключен")
+    if missed:
+        await notifier.notify(f"⚠️ Не опубликованы по расписанию (бот был выключен): "
+                            f"{len(missed)}\nID постов: {', '.join(map(str, missed))}")
+    logger.info(f"[Scheduler] Сверка задач публикации: запланировано постов {len(pending)}, "
+                f"задач создано/перенесено {rescheduled}, удалено {len(stale)}, "
+                f"пропущенных к публикации {len(catch_up)}, снято с расписания {len(missed)}")
+
+
+async def _space_catch_up(post_ids: List[int], started: datetime):
+    """Перенос времени публикации пропущенных постов: первый — сразу, следующие — через SCHEDULER_CATCHUP_INTERVAL"""
+    if len(post_ids) < 2:
+        return
+    async with AsyncSessionLocal() as session:
+        for index, post_id in enumerate(post_ids):
+            await session.execute(
+                update(Post).where(Post.id == post_id)
+                .values(scheduled_at=started + timedelta(seconds=index * conf.scheduler.catchup_interval))
+            )
+        await session.commit()
+
+
+async def claim_due_posts(limit: int) -> List[int]:
+    """
+    Атомарный захват постов, которым пора публиковаться
+
+    Пост считается захваченным, если условный UPDATE (claimed_at пуст или устарел) изменил
+    ровно одну строку, поэтому один пост не возьмут в работу дважды, даже если обработчиков несколько.
+    """
+    now = _scheduler_now()
+    stale_before = now - timedelta(seconds=conf.scheduler.claim_timeout)
+    not_claimed = or_(Post.claimed_at.is_(None), Post.claimed_at < stale_before)
+    claimed = []
+    async with AsyncSessionLocal() as session:
+        # Выборка идёт по индексу (published, scheduled_at)
+        result = await session.execute(
+            select(Post.id)
+            .where(Post.published == False, Post.scheduled_at <= now, Post.is_scheduled == True, not_claimed)
+            .order_by(Post.scheduled_at)
+            .limit(limit)
+        )
+        for post_id in result.scalars().all():
+            updated = await session.execute(
+                update(Post).where(Post.id == post_id, Post.published == False, not_claimed).values(claimed_at=now)
+            )
+            if updated.rowcount == 1:
+                claimed.append(post_id)
+        await session.commit()
+    return claimed
+
+
+async def _publish_claimed(post_id: int, semaphore: asyncio.Semaphore):
+    # Повторные попытки выполняет publish_scheduled_post; после неудачи пост снимается с расписания (dead_letter)
+    async with semaphore:
+        await publish_scheduled_post(post_id)
+
+
+@async_log_exception
+@leader_job
+async def sweep_due_posts():
+    """Публикация постов, которым пора публиковаться: порциями по PUBLISH_SWEEP_BATCH, не больше PUBLISH_CONCURRENCY одновременно"""
+    semaphore = asyncio.Semaphore(max(conf.scheduler.publish_concurrency, 1))
+    while True:
+        claimed = await claim_due_posts(conf.scheduler.sweep_batch)
+        if not claimed:
+            return
+        logger.debug(f"[Sweeper] Взяты в работу посты: {claimed}")
+        await asyncio.gather(*(_publish_claimed(post_id, semaphore) for post_id in claimed))
+        if len(claimed) < conf.scheduler.sweep_batch:
+            return
+
+
+@async_log_exception
+async def setup_publish_sweeper_job():
+    """Настройка периодической публикации постов, которым пора публиковаться (PUBLISH_ENGINE=sweeper)"""
+    if conf.scheduler.engine != 'sweeper':
+        return
+    try:
+        scheduler.add_job(
+            sweep_due_posts,
+            'interval',
+            seconds=conf.scheduler.sweep_interval,
+            id='publish_sweeper',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            next_run_time=datetime.now()
+        )
+        logger.info("Задача публикации запланированных постов (sweeper) добавлена")
+    except Exception as e:
+        logger.error(f"Ошибка при настройке задачи публикации запланированных постов: {e}")
+
+
+@async_log_exception
+async def setup_content_generation_job():
+    """Настройка фоновой генерации постов из плана автопланирования (AUTO_SCHEDULE_DEFERRED)"""
+    if not conf.auto_schedule.deferred:
+        return
+    try:
+        scheduler.add_job(
+            leader_job(generate_upcoming_posts),
+            'interval',
+            seconds=conf.auto_schedule.interval,
+            id='generate_upcoming_posts',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            next_run_time=datetime.now()
+        )
+        logger.info("Задача отложенной генерации постов добавлена")
+    except Exception as e:
+        logger.error(f"Ошибка при настройке задачи отложенной генерации постов: {e}")
 
 
 @async_log_exception
@@ -66,7 +430,7 @@ async def setup_stats_job():
                 await fetch_post_stats(session, conf.tg_bot.channel_u)
         # Добавляем задачу для регулярного обновления статистики (каждые 24 часа)
         scheduler.add_job(
-            update_stats,
+            leader_job(update_stats),
             'interval',
             hours=24,
             id='update_post_stats',
@@ -75,3 +439,23 @@ async def setup_stats_job():
         logger.info("Задача обновления статистики постов добавлена")
     except Exception as e:
         logger.error(f"Ошибка при настройке задачи обновления статистики: {e}")
+
+
+@async_log_exception
+async def setup_media_gc_job():
+    """Настройка задачи удаления изображений, на которые не ссылается ни один пост"""
+    if not conf.media.gc_enabled:
+        return
+    try:
+        async def media_gc():
+            await collect_garbage(dry_run=conf.media.gc_dry_run, min_age=conf.media.gc_min_age_hours * 3600)
+        scheduler.add_job(
+            leader_job(media_gc),
+            'interval',
+            hours=conf.media.gc_interval_hours,
+            id='media_gc',
+            replace_existing=True
+        )
+        logger.info("Задача очистки хранилища изображений добавлена")
+    except Exception as e:
+        logger.error(f"Ошибка при настройке задачи очистки хранилища изображений: {e}")
@@ -0,0 +1,229 @@
+# scheduler/leader.py
+"""
+Выбор лидера среди реплик бота, работающих с одной БД
+
+Планировщик (публикации, статистика, генерация тем) и приём обновлений Telegram
+работают только у лидера: Telegram отдаёт обновления (getUpdates) одному получателю,
+а состояние диалогов хранится в памяти реплики. Способы выбора (LEADER_BACKEND):
+
+- lease: строка в таблице leader_lease с идентификатором лидера и сроком аренды.
+  Лидер продлевает аренду каждые LEADER_RENEW_INTERVAL секунд; если он пропал,
+  другая реплика забирает аренду после LEADER_LEASE_TTL. Подходит для любой БД,
+  в том числе для общего файла SQLite.
+- advisory: pg_try_advisory_lock PostgreSQL на отдельном соединении. Блокировка
+  снимается вместе с соединением, поэтому резервная реплика перехватывает работу
+  при следующей попытке.
+
+Лидер, который не смог продлить аренду, сам слагает полномочия за половину интервала
+продления до её окончания — раньше, чем её сможет забрать другая реплика. При
+LEADER_LEASE_TTL не меньше трёх LEADER_RENEW_INTERVAL до этого успевают пройти
+хотя бы две попытки продления, и одна ошибка БД не приводит к смене лидера.
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import or_, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from config.env import conf
+from config.logging_config import logger
+from database.models import AsyncSessionLocal, LeaderLease, engine
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LeaderElection:
+    """Выбор лидера: фоновая задача получает и продлевает аренду, события сообщают о смене роли"""
+
+    def __init__(self, enabled: bool, backend: str, name: str, ttl: float, renew_interval: float):
+        self.enabled = enabled
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        # Идентификатор реплики: видно в таблице, какая реплика лидер
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._elected = asyncio.Event()
+        self._lost = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[AsyncConnection] = None
+        # Момент (monotonic), после которого неподтверждённое лидерство нельзя считать действующим
+        self._valid_until = 0.0
+        self.elections = 0
+        self.losses = 0
+
+    # --- Аренда в таблице leader_lease ---
+
+    async def _acquire_lease(self) -> bool:
+        now = _utcnow()
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(LeaderLease)
+                .where(LeaderLease.name == self.name,
+                       or_(LeaderLease.holder == self.holder, LeaderLease.expires_at < now))
+                .values(holder=self.holder, expires_at=now + timedelta(seconds=self.ttl),
+                        acquired_at=now if not self.is_leader else LeaderLease.acquired_at)
+            )
+            await session.commit()
+            if result.rowcount == 1:
+                return True
+        # Строки аренды ещё нет: её создаёт первая реплика, остальные получают ошибку уникальности
+        try:
+            async with AsyncSessionLocal() as session:
+                session.add(LeaderLease(name=self.name, holder=self.holder,
+                                        expires_at=now + timedelta(seconds=self.ttl), acquired_at=now))
+                await session.commit()
+            return True
+        except IntegrityError:
+            return False
+
+    async def _release_lease(self):
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(LeaderLease).where(LeaderLease.name == self.name, LeaderLease.holder == self.holder)
+                .values(expires_at=_utcnow())
+            )
+            await session.commit()
+
+    # --- Advisory lock PostgreSQL ---
+
+    def _lock_key(self) -> int:
+        return zlib.crc32(self.name.encode())
+
+    async def _acquire_advisory(self) -> bool:
+        if self._conn is not None:
+            # Блокировка держится, пока живо соединение: проверяем его
+            await self._conn.execute(text("SELECT 1"))
+            await self._conn.commit()
+            return True
+        conn = await engine.connect()
+        try:
+            locked = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self._lock_key()})).scalar()
+            await conn.commit()
+        except BaseException:
+            await conn.close()
+            raise
+        if not locked:
+            await conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    async def _release_advisory(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self._lock_key()})
+            await conn.commit()
+        finally:
+            await conn.close()
+
+    # --- Цикл выбора ---
+
+    async def _try_acquire(self) -> bool:
+        if self.backend == 'advisory':
+            return await self._acquire_advisory()
+        return await self._acquire_lease()
+
+    async def _release(self):
+        if self.backend == 'advisory':
+            await self._release_advisory()
+        else:
+            await self._release_lease()
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        if leader:
+            self.elections += 1
+            self._lost.clear()
+            self._elected.set()
+            logger.info(f"[Leader] Реплика {self.holder} стала лидером")
+        else:
+            self.losses += 1
+            self._elected.clear()
+            self._lost.set()
+            logger.warning(f"[Leader] Реплика {self.holder} больше не лидер")
+
+    async def _run(self):
+        while True:
+            if self.is_leader and time.monotonic() >= self._valid_until:
+                # Аренду не удалось продлить до безопасного срока: слагаем полномочия и пропускаем попытку,
+                # чтобы не вернуть себе лидерство тут же, пока аренда формально ещё наша
+                logger.warning("[Leader] Аренда не продлена вовремя")
+                self._set_leader(False)
+                await asyncio.sleep(self.renew_interval)
+                continue
+            started = time.monotonic()
+            try:
+                acquired = await self._try_acquire()
+            except Exception as e:
+                logger.warning(f"[Leader] Не удалось продлить или получить лидерство: {e}")
+                if self.backend == 'advisory' and self._conn is not None:
+                    # Соединение с блокировкой потеряно — вместе с ним потеряна и блокировка
+                    conn, self._conn = self._conn, None
+                    await asyncio.shield(conn.close())
+                    self._set_leader(False)
+            else:
+                if acquired:
+                    # Запас в половину интервала: полномочия слагаются до момента, когда аренду сможет забрать другая реплика
+                    self._valid_until = started + self.ttl - self.renew_interval / 2
+                self._set_leader(acquired)
+            delay = self.renew_interval
+            if self.is_leader and self.backend == 'lease':
+                # Просыпаемся к безопасному сроку, даже если он наступит раньше следующей попытки
+                delay = min(delay, max(self._valid_until - time.monotonic(), 0))
+            await asyncio.sleep(delay)
+
+    async def start(self):
+        """Запуск выбора лидера (без LEADER_ELECTION_ENABLED реплика сразу считается лидером)"""
+        if not self.enabled:
+            self._set_leader(True)
+            return
+        if self.backend == 'advisory' and engine.dialect.name != 'postgresql':
+            logger.warning("[Leader] Advisory lock доступен только в PostgreSQL, используется аренда в таблице")
+            self.backend = 'lease'
+        if self.backend == 'lease' and self.ttl < 3 * self.renew_interval:
+            logger.warning("[Leader] LEADER_LEASE_TTL меньше трёх LEADER_RENEW_INTERVAL: "
+                           "одна неудачная попытка продления может сменить лидера")
+        logger.info(f"[Leader] Выбор лидера ({self.backend}), реплика {self.holder}; "
+                    f"публикация по расписанию: {conf.scheduler.engine}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка выбора и освобождение лидерства, чтобы резервная реплика сразу его забрала"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.enabled and self.is_leader:
+            try:
+                await self._release()
+            except Exception as e:
+                logger.warning(f"[Leader] Не удалось освободить лидерство: {e}")
+        self.is_leader = False
+
+    async def wait_elected(self):
+        await self._elected.wait()
+
+    async def wait_lost(self):
+        await self._lost.wait()
+
+    def stats(self) -> dict:
+        return {"holder": self.holder, "backend": self.backend, "is_leader": self.is_leader,
+                "elections": self.elections, "losses": self.losses}
+
+
+# Глобальный экземпляр
+leader = LeaderElection(enabled=conf.leader.enabled, backend=conf.leader.backend, name=conf.leader.name,
+                        ttl=conf.leader.ttl, renew_interval=conf.leader.renew_interval)
@@ -0,0 +1,304 @@
+# scheduler/publisher.py
+"""
+Публикация запланированных постов с повторными попытками
+
+Временные ошибки (сеть, 5xx Telegram, таймауты) повторяются с экспоненциальной паузой
+со случайным разбросом, не больше PUBLISH_MAX_ATTEMPTS раз. Ответ Telegram retry_after
+(flood control) не считается попыткой: публикации всего бота приостанавливаются общим
+шлюзом на указанное время, а потом выходят по одной, чтобы не получить новое ограничение.
+Остальные ошибки (неверный запрос, нет прав в канале) не повторяются. Пост, который так
+и не удалось опубликовать, помечается как неудавшийся (dead_letter) и ждёт администратора.
+
+Пост публикует только обработчик, атомарно занявший строку Post своим токеном
+(publish_token): повторная задача планировщика или ручная публикация того же поста
+получают отказ. Перед каждой отправкой под тем же токеном записывается её начало
+(send_started_at); отметка снимается, только когда исход известен: пост опубликован
+или Telegram его точно не принял. Если исход неизвестен (таймаут, обрыв соединения
+после отправки запроса, падение бота во время отправки), отметка остаётся, и пост
+не отправляется повторно — ни после перехвата захвата, ни из очереди неудавшихся
+публикаций, — пока администратор не подтвердит, что поста в канале нет.
+"""
+import asyncio
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+import aiohttp
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from sqlalchemy import or_, update
+from sqlalchemy.future import select
+from config.env import conf
+from config.logging_config import logger
+from database.models import AsyncSessionLocal, Post
+from telegram_api.client import publish_post_to_group
+
+# Ошибки, после которых публикацию имеет смысл повторить
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, aiohttp.ClientError)
+# Интервал между публикациями, которые ждали окончания flood control (секунды)
+FLOOD_RESUME_SPACING = 1.0
+
+
+class PublishFailed(Exception):
+    """Пост не опубликован: попытки исчерпаны, ошибка не временная или результат отправки неизвестен"""
+
+    def __init__(self, attempts: int, error: Exception, permanent: bool = False, unknown: bool = False):
+        if unknown:
+            super().__init__(f"результат отправки неизвестен ({error}), проверьте канал перед повторной публикацией")
+        else:
+            super().__init__(str(error))
+        self.attempts = attempts
+        self.error = error
+        self.permanent = permanent
+        self.unknown = unknown
+
+
+class PostClaimed(Exception):
+    """Пост уже опубликован или его публикует другой обработчик"""
+
+
+@dataclass
+class PublishStats:
+    published: int = 0
+    retries: int = 0
+    flood_waits: int = 0
+    flood_seconds: float = 0.0
+    failed: int = 0
+    unknown: int = 0
+    duplicates_prevented: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "published": self.published,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "flood_seconds": round(self.flood_seconds, 1),
+            "failed": self.failed,
+            "unknown": self.unknown,
+            "duplicates_prevented": self.duplicates_prevented,
+        }
+
+
+# Статистика публикаций за время работы бота
+publish_stats = PublishStats()
+
+
+class FloodGate:
+    """Общая пауза публикаций после ответа Telegram retry_after"""
+
+    def __init__(self, resume_spacing: float = FLOOD_RESUME_SPACING):
+        self.resume_spacing = resume_spacing
+        self._until = 0.0
+        self._lock = asyncio.Lock()
+
+    def hold(self, seconds: float):
+        """Приостановка публикаций на seconds секунд"""
+        self._until = max(self._until, time.monotonic() + seconds)
+
+    async def wait(self) -> float:
+        """Ожидание окончания паузы; возвращает, сколько секунд пришлось ждать"""
+        async with self._lock:
+            delay = self._until - time.monotonic()
+            if delay <= 0:
+                return 0.0
+            await asyncio.sleep(delay)
+            # Ожидавшие публикации выходят по одной, а не все сразу
+            self._until = time.monotonic() + self.resume_spacing
+            return delay
+
+
+# Глобальный шлюз: ограничение Telegram действует на бота целиком
+flood_gate = FloodGate()
+
+
+def backoff_delay(attempt: int) -> float:
+    """Пауза перед повторной попыткой: экспонента от PUBLISH_BACKOFF_BASE со случайным разбросом в её верхней половине"""
+    delay = min(conf.scheduler.backoff_max, conf.scheduler.backoff_base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_undelivered(error: Exception) -> bool:
+    """Запрос точно не принят Telegram (ответ 5xx или соединение не установлено) — повтор не создаст дубль"""
+    if isinstance(error, TelegramServerError):
+        return True
+    if isinstance(error, TelegramNetworkError):
+        # aiogram оборачивает ошибку aiohttp, исходная остаётся в __context__
+        error = error.__context__
+    return isinstance(error, aiohttp.ClientConnectorError)
+
+
+async def claim_post(post_id: int) -> Optional[str]:
+    """
+    Атомарный захват поста для публикации
+
+    Захват, не продлевавшийся дольше PUBLISH_CLAIM_TIMEOUT (обработчик упал), можно перехватить.
+
+    Returns:
+        Optional[str]: Токен захвата или None, если пост уже опубликован или его публикует другой обработчик
+    """
+    token = uuid.uuid4().hex
+    now = datetime.now()
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(Post)
+            .where(Post.id == post_id, Post.published == False,
+                   or_(Post.publish_token.is_(None), Post.claimed_at.is_(None),
+                       Post.claimed_at < now - timedelta(seconds=conf.scheduler.claim_timeout)))
+            .values(publish_token=token, claimed_at=now)
+        )
+        await session.commit()
+    if result.rowcount != 1:
+        publish_stats.duplicates_prevented += 1
+        return None
+    return token
+
+
+async def _mark_sending(post_id: int, token: str) -> bool:
+    """Продление захвата и отметка о начале отправки; False — захват перехвачен другим обработчиком"""
+    now = datetime.now()
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(Post).where(Post.id == post_id, Post.publish_token == token, Post.published == False)
+            .values(claimed_at=now, send_started_at=now)
+        )
+        await session.commit()
+    return result.rowcount == 1
+
+
+async def _clear_sending(post_id: int, token: str):
+    """Снятие отметки об отправке: Telegram точно не принял пост"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(Post).where(Post.id == post_id, Post.publish_token == token).values(send_started_at=None)
+        )
+        await session.commit()
+
+
+async def release_claim(post_id: int, token: str):
+    """Освобождение захвата после неудачной публикации"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(Post).where(Post.id == post_id, Post.publish_token == token)
+            .values(publish_token=None, claimed_at=None)
+        )
+        await session.commit()
+
+
+async def _record_published(post_id: int, token: str, message_id: int):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(Post).where(Post.id == post_id, Post.publish_token == token).values(
+                published=True,
+                published_at=datetime.now(),
+                message_id=message_id,
+                publish_token=None,
+                claimed_at=None,
+                send_started_at=None
+            )
+        )
+        await session.commit()
+
+
+async def publish_with_retries(post_id: int, chat_id: str, text: str, image_path: str, token: str,
+                               retry: bool = True) -> int:
+    """
+    Отправка поста в канал с повторными попытками
+
+    Args:
+        post_id (int): ID поста
+        chat_id (str): ID канала
+        text (str): Текст поста
+        image_path (str): Путь к изображению
+        token (str): Токен захвата поста (см. claim_post)
+        retry (bool): Повторять ли отправку после временных ошибок и flood control
+
+    Returns:
+        int: message_id опубликованного сообщения
+
+    Raises:
+        PublishFailed: Пост не удалось опубликовать
+        PostClaimed: Захват поста перехвачен другим обработчиком
+    """
+    attempts = 0
+    flood_waited = 0.0
+    while True:
+        await flood_gate.wait()
+        if not await _mark_sending(post_id, token):
+            publish_stats.duplicates_prevented += 1
+            raise PostClaimed(post_id)
+        try:
+            message_id = await publish_post_to_group(chat_id, text, image_path)
+            publish_stats.published += 1
+            return message_id
+        except TelegramRetryAfter as e:
+            await _clear_sending(post_id, token)
+            publish_stats.flood_waits += 1
+            publish_stats.flood_seconds += e.retry_after
+            flood_waited += e.retry_after
+            flood_gate.hold(e.retry_after)
+            if not retry or flood_waited > conf.scheduler.max_flood_wait:
+                publish_stats.failed += 1
+                raise PublishFailed(attempts + 1, e) from e
+            logger.warning(f"[Publisher] Пост {post_id}: flood control, публикации приостановлены на {e.retry_after} с")
+        except TRANSIENT_ERRORS as e:
+            attempts += 1
+            if not is_undelivered(e):
+                # Запрос мог дойти до Telegram: повторная отправка может опубликовать пост дважды
+                publish_stats.unknown += 1
+                raise PublishFailed(attempts, e, unknown=True) from e
+            await _clear_sending(post_id, token)
+            if not retry or attempts >= conf.scheduler.max_attempts:
+                publish_stats.failed += 1
+                raise PublishFailed(attempts, e) from e
+            delay = backoff_delay(attempts)
+            publish_stats.retries += 1
+            logger.warning(f"[Publisher] Пост {post_id}: попытка {attempts} не удалась ({e}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+        except TelegramAPIError as e:
+            # Telegram отклонил запрос (неверный запрос, нет прав в канале): поста в канале нет
+            await _clear_sending(post_id, token)
+            publish_stats.failed += 1
+            raise PublishFailed(attempts + 1, e, permanent=True) from e
+        except Exception as e:
+            # Ошибка не от Telegram (например, после успешной отправки): исход неизвестен
+            publish_stats.unknown += 1
+            raise PublishFailed(attempts + 1, e, unknown=True) from e
+
+
+async def publish_post(post_id: int, chat_id: str, retry: bool = True, confirmed: bool = False) -> int:
+    """
+    Идемпотентная публикация поста из БД: захват, проверка прерванной отправки, отправка, запись результата
+
+    Args:
+        post_id (int): ID поста
+        chat_id (str): ID канала
+        retry (bool): Повторять ли отправку после временных ошибок (False — для ручной публикации)
+        confirmed (bool): Администратор проверил канал после отправки с неизвестным исходом и поста там нет
+
+    Returns:
+        int: message_id опубликованного сообщения
+
+    Raises:
+        PostClaimed: Пост уже опубликован или его публикует другой обработчик
+        PublishFailed: Пост не удалось опубликовать
+    """
+    token = await claim_post(post_id)
+    if token is None:
+        raise PostClaimed(post_id)
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Post).where(Post.id == post_id))
+            post = result.scalars().first()
+        if post.send_started_at is not None and not confirmed:
+            # Прошлая отправка прервалась с неизвестным исходом: пост мог уже выйти в канал
+            publish_stats.duplicates_prevented += 1
+            raise PublishFailed(1, RuntimeError(
+                f"отправка {post.send_started_at:%Y-%m-%d %H:%M:%S} завершилась с неизвестным исходом"), unknown=True)
+        message_id = await publish_with_retries(post_id, chat_id, post.text, post.image_path, token, retry=retry)
+    except BaseException:
+        # Отметка об отправке при этом остаётся, если исход неизвестен
+        await asyncio.shield(release_claim(post_id, token))
+        raise
+    await _record_published(post_id, token, message_id)
+    return message_id
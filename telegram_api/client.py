@@ -1,8 +1,9 @@
 # telegram_api/client.py
 from typing import Optional
-from aiogram.types import ContentType, FSInputFile, Message, User, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import ContentType, Message, User, InlineKeyboardMarkup, InlineKeyboardButton
 from config.env import bot_global, conf
 from config.logging_config import logger, async_log_exception
+from telegram_api.file_ids import send_photo
 
 
 @async_log_exception
@@ -19,9 +20,9 @@ async def publish_post_to_group(chat_id: str, text: Optional[str] = None, image_
         keyboard = InlineKeyboardMarkup(inline_keyboard=[[author_button]])
         # Отправляем пост с кнопкой
         if image_url:
-            photo = FSInputFile(image_url)
-            result = await bot_global.send_photo(chat_id=chat_id, photo=photo, caption=text)
-            # result = await bot_global.send_photo(chat_id=chat_id, photo=photo, caption=text, reply_markup=keyboard)
+            # Повторная публикация того же изображения идёт по file_id, без загрузки файла
+            result = await send_photo(bot_global, chat_id, image_url, caption=text)
+            # result = await send_photo(bot_global, chat_id, image_url, caption=text, reply_markup=keyboard)
         else:
             result = await bot_global.send_message(chat_id=chat_id, text=text)
             # result = await bot_global.send_message(chat_id=chat_id, text=text, reply_markup=keyboard)
@@ -0,0 +1,203 @@
+# telegram_api/file_ids.py
+"""
+Повторное использование file_id загруженных в Telegram изображений
+
+После первой отправки файла Telegram возвращает его file_id; дальше то же изображение
+отправляется по этому id без повторной загрузки байт. Id хранятся в БД (таблица
+telegram_files) по ключу содержимого, поэтому переживают перезапуск бота. Если Telegram
+отклоняет сохранённый id, запись удаляется и файл загружается заново.
+"""
+import os
+from typing import Dict, List, Optional
+from aiogram import Bot
+from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto, Message
+from aiogram_dialog.api.entities import MediaId, NewMessage, OldMessage
+from aiogram_dialog.api.protocols import MediaIdStorageProtocol
+from aiogram_dialog.manager.message_manager import MessageManager
+from config.logging_config import logger
+from database.db import delete_telegram_file, get_telegram_file, save_telegram_file
+from media_store.previews import PREVIEW_DIR, preview_key
+
+# Префикс ключа превью: имя превью совпадает с хэшем оригинала
+PREVIEW_KEY_PREFIX = "preview:"
+
+
+def media_key(path: str) -> Optional[str]:
+    """Ключ изображения для таблицы telegram_files (None, если файла нет)"""
+    try:
+        key = preview_key(path)
+    except OSError:
+        return None
+    if os.path.abspath(path).startswith(os.path.abspath(PREVIEW_DIR) + os.sep):
+        return f"{PREVIEW_KEY_PREFIX}{key}"
+    return key
+
+
+# Ошибки Telegram, после которых сохранённый file_id больше не годится
+# (другие ошибки про файлы, например "file is too big", к file_id не относятся)
+FILE_ID_REJECTED_ERRORS = ("wrong file identifier", "file reference expired", "file id invalid", "wrong remote file id")
+
+
+def is_file_rejected(error: TelegramBadRequest) -> bool:
+    """Telegram не принял file_id (например, "wrong file identifier/HTTP URL specified")"""
+    # Коды ошибок приходят и как FILE_ID_INVALID, и текстом
+    message = str(error.message).lower().replace("_", " ")
+    return any(marker in message for marker in FILE_ID_REJECTED_ERRORS)
+
+
+def photo_media_id(message: Message) -> Optional[MediaId]:
+    """file_id самого большого размера отправленной фотографии"""
+    if not message.photo:
+        return None
+    photo = message.photo[-1]
+    return MediaId(photo.file_id, photo.file_unique_id)
+
+
+class FileIdCache:
+    """Кэш file_id в памяти поверх таблицы telegram_files"""
+
+    def __init__(self):
+        self._ids: Dict[str, MediaId] = {}
+        self.hits = 0
+        self.uploads = 0
+
+    async def get(self, path: str) -> Optional[MediaId]:
+        key = media_key(path)
+        if key is None:
+            return None
+        media_id = self._ids.get(key)
+        if media_id is None:
+            record = await get_telegram_file(key)
+            if record is None:
+                return None
+            media_id = self._ids[key] = MediaId(record.file_id, record.file_unique_id)
+        self.hits += 1
+        return media_id
+
+    async def save(self, path: str, media_id: MediaId):
+        key = media_key(path)
+        if key is None or not media_id.file_id:
+            return
+        cached = self._ids.get(key)
+        if cached is not None and cached.file_id == media_id.file_id:
+            return
+        self._ids[key] = media_id
+        self.uploads += 1
+        await save_telegram_file(key, media_id.file_id, media_id.file_unique_id)
+
+    async def forget(self, path: str):
+        key = media_key(path)
+        if key is None:
+            return
+        self._ids.pop(key, None)
+        await delete_telegram_file(key)
+
+    def stats(self) -> dict:
+        return {"cached": len(self._ids), "hits": self.hits, "uploads": self.uploads}
+
+
+# Глобальный кэш file_id
+file_ids = FileIdCache()
+
+
+async def send_photo(bot: Bot, chat_id: str, path: str, **kwargs) -> Message:
+    """
+    Отправка фотографии: по сохранённому file_id, а при его отсутствии или отказе — загрузкой файла
+
+    Args:
+        bot (Bot): Экземпляр бота
+        chat_id (str): ID чата
+        path (str): Путь к изображению
+        **kwargs: Остальные параметры send_photo (caption, reply_markup, ...)
+    """
+    media_id = await file_ids.get(path)
+    if media_id is not None:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=media_id.file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if not is_file_rejected(e):
+                raise
+            logger.warning(f"[FileIds] Telegram не принял file_id для {path}, загружаем файл заново: {e.message}")
+            await file_ids.forget(path)
+    message = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(path), **kwargs)
+    media_id = photo_media_id(message)
+    if media_id is not None:
+        await file_ids.save(path, media_id)
+    return message
+
+
+async def send_photo_album(bot: Bot, chat_id: int, paths: List[str], captions: Optional[List[str]] = None) -> List[Message]:
+    """
+    Отправка альбома фотографий: уже загруженные файлы — по file_id, остальные — загрузкой
+
+    Если Telegram отклонил какой-либо из сохранённых id, альбом отправляется заново загрузкой всех файлов.
+    """
+    async def build(use_cache: bool) -> List[InputMediaPhoto]:
+        media = []
+        for index, path in enumerate(paths):
+            media_id = await file_ids.get(path) if use_cache else None
+            media.append(InputMediaPhoto(
+                media=media_id.file_id if media_id is not None else FSInputFile(path),
+                caption=captions[index] if captions else None
+            ))
+        return media
+
+    try:
+        messages = await bot.send_media_group(chat_id=chat_id, media=await build(use_cache=True))
+    except TelegramBadRequest as e:
+        if not is_file_rejected(e):
+            raise
+        logger.warning(f"[FileIds] Telegram не принял file_id в альбоме, загружаем файлы заново: {e.message}")
+        for path in paths:
+            await file_ids.forget(path)
+        messages = await bot.send_media_group(chat_id=chat_id, media=await build(use_cache=False))
+    for path, message in zip(paths, messages):
+        media_id = photo_media_id(message)
+        if media_id is not None:
+            await file_ids.save(path, media_id)
+    return messages
+
+
+class PersistentMediaIdStorage(MediaIdStorageProtocol):
+    """Хранилище file_id для aiogram_dialog: фотографии диалогов берутся из общего кэша"""
+
+    async def get_media_id(self, path: Optional[str], url: Optional[str], type: ContentType) -> Optional[MediaId]:
+        if not path or type != ContentType.PHOTO:
+            return None
+        return await file_ids.get(path)
+
+    async def save_media_id(self, path: Optional[str], url: Optional[str], type: ContentType, media_id: MediaId):
+        if not path or type != ContentType.PHOTO:
+            return
+        await file_ids.save(path, media_id)
+
+
+class FileIdMessageManager(MessageManager):
+    """Менеджер сообщений диалогов, который загружает файл заново, если Telegram отклонил file_id"""
+
+    async def _reset_rejected(self, new_message: NewMessage, error: TelegramBadRequest) -> bool:
+        media = new_message.media
+        if not media or not media.file_id or not media.path or not is_file_rejected(error):
+            return False
+        logger.warning(f"[FileIds] Telegram не принял file_id для {media.path}, загружаем файл заново: {error.message}")
+        await file_ids.forget(media.path)
+        media.file_id = None
+        return True
+
+    async def send_media(self, bot: Bot, new_message: NewMessage) -> Message:
+        try:
+            return await super().send_media(bot, new_message)
+        except TelegramBadRequest as e:
+            if not await self._reset_rejected(new_message, e):
+                raise
+            return await super().send_media(bot, new_message)
+
+    async def edit_media(self, bot: Bot, new_message: NewMessage, old_message: OldMessage) -> Message:
+        try:
+            return await super().edit_media(bot, new_message, old_message)
+        except TelegramBadRequest as e:
+            if not await self._reset_rejected(new_message, e):
+                raise
+            return await super().edit_media(bot, new_message, old_message)
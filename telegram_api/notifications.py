@@ -0,0 +1,134 @@
+# telegram_api/notifications.py
+"""
+Уведомления администраторов
+
+Сообщение рассылается всем администраторам одновременно, в пределах ограничения
+частоты отправки (NOTIFY_RPS, NOTIFY_CONCURRENCY); ответ Telegram retry_after
+приостанавливает всю рассылку. Отправка идёт в фоне и не задерживает задачу,
+которая создала событие.
+
+При NOTIFY_DIGEST_WINDOW > 0 события копятся в течение окна, начиная с первого,
+и уходят одной сводкой каждому администратору.
+"""
+import asyncio
+from typing import List, Optional, Set
+from aiogram.exceptions import TelegramRetryAfter
+from ai_providers.rate_limiter import Limiter
+from config.env import bot_global, conf
+from config.logging_config import logger
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Сколько раз повторять отправку после retry_after
+SEND_RETRIES = 3
+# Разделитель событий в сводке
+DIGEST_SEPARATOR = "\n\n"
+
+
+def digest_messages(events: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Сводка событий: одно или несколько сообщений не длиннее limit
+
+    События не разрезаются (чтобы не разорвать HTML-разметку), кроме события длиннее limit.
+    """
+    if len(events) == 1:
+        return [events[0][:limit]]
+    header = f"<b>📬 Сводка уведомлений ({len(events)})</b>"
+    messages = []
+    current = header
+    for event in events:
+        event = event[:limit - len(header) - len(DIGEST_SEPARATOR)]
+        if len(current) + len(DIGEST_SEPARATOR) + len(event) > limit:
+            messages.append(current)
+            current = header
+        current += DIGEST_SEPARATOR + event
+    messages.append(current)
+    return messages
+
+
+class AdminNotifier:
+    """Рассылка уведомлений администраторам"""
+
+    def __init__(self, digest_window: float, limiter: Limiter):
+        self.digest_window = digest_window
+        self._limiter = limiter
+        self._pending: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Ссылки на фоновые рассылки, чтобы их не собрал сборщик мусора до завершения
+        self._tasks: Set[asyncio.Task] = set()
+        self.events = 0
+        self.digests = 0
+        self.sent = 0
+        self.failed = 0
+
+    async def notify(self, text: str):
+        """Уведомление всех администраторов (в режиме сводки — в составе ближайшей сводки)"""
+        self.events += 1
+        if self.digest_window <= 0:
+            self._spawn(self._broadcast(text))
+            return
+        self._pending.append(text)
+        if self._flush_task is None:
+            self._flush_task = self._spawn(self._flush_later())
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.digest_window)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Немедленная отправка накопленной сводки"""
+        events, self._pending = self._pending, []
+        if not events:
+            return
+        if len(events) > 1:
+            self.digests += 1
+        for message in digest_messages(events):
+            await self._broadcast(message)
+
+    async def _broadcast(self, text: str):
+        await asyncio.gather(*(self._send(admin_id, text) for admin_id in conf.tg_bot.admin_ids))
+
+    async def _send(self, admin_id: int, text: str):
+        for _ in range(SEND_RETRIES):
+            try:
+                async with self._limiter.slot():
+                    await bot_global.send_message(chat_id=admin_id, text=text)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"[Notify] Flood control, рассылка приостановлена на {e.retry_after} с")
+                self._limiter.pause(e.retry_after)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления администратору {admin_id}: {e}")
+                break
+        self.failed += 1
+
+    async def close(self):
+        """Отправка накопленной сводки и ожидание фоновых рассылок (при остановке бота)"""
+        if self._flush_task is not None:
+            # Окно сводки ещё не закончилось: отправляем её сразу
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"events": self.events, "digests": self.digests, "sent": self.sent, "failed": self.failed,
+                "pending": len(self._pending), "limiter": self._limiter.stats()}
+
+
+# Глобальный экземпляр
+notifier = AdminNotifier(
+    digest_window=conf.notifications.digest_window,
+    limiter=Limiter("telegram:notifications", conf.notifications.limit.rps, conf.notifications.limit.burst,
+                    conf.notifications.limit.concurrency)
+)
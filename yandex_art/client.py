@@ -1,16 +1,87 @@
 # yandex_art/client.py
-import base64
-import os
-import requests
-import time
-from datetime import datetime
-from typing import Optional
-from config.env import conf
+import aiohttp
+import asyncio
+import binascii
+import random
+from datetime import timedelta
+from typing import List, Optional
+from ai_providers.http_session import get_http_session
+from ai_providers.rate_limiter import rate_limiter, retry_after
+from config.env import conf, datetime_local
 from config.logging_config import logger, async_log_exception
+from database.db import attach_image_to_post, create_image_job, finish_image_job, get_pending_image_jobs
+from database.models import ImageJobState
+from media_store.recompress import recompress_image
+from media_store.writer import save_base64_image
+from yandex_art.poller import OperationError, poller
+
+
+async def complete_image_job(operation_id: str, post_id: Optional[int] = None, resumable: bool = True) -> Optional[str]:
+    """
+    Ожидание операции Yandex.Art, сохранение изображения и фиксация результата задания
+
+    Если задано post_id, изображение (или ошибка) сразу записывается в пост.
+    При отмене задание остаётся незавершённым и будет возобновлено после перезапуска;
+    если resumable=False, отменённое задание помечается как FAILED.
+
+    Returns:
+        Optional[str]: Путь к сохранённому изображению или None в случае ошибки
+    """
+    try:
+        result = await poller.wait(operation_id)
+        # Декодирование и запись порциями, без блокировки event loop
+        image_path = await save_base64_image(result["image"])
+        # Пережатие под загрузку в Telegram (в отдельном потоке)
+        image_path = await recompress_image(image_path)
+    except asyncio.CancelledError:
+        if not resumable:
+            await asyncio.shield(finish_image_job(operation_id, ImageJobState.FAILED, error_message="Операция отменена"))
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError, OperationError, KeyError, binascii.Error, OSError) as e:
+        logger.error(f"[Ошибка Yandex.Art] Операция {operation_id}: {e!r}")
+        await finish_image_job(operation_id, ImageJobState.FAILED, error_message=str(e))
+        if post_id is not None:
+            await attach_image_to_post(post_id, None, error_message=f"Ошибка генерации изображения: {e}")
+        return None
+    logger.debug(f"[Yandex.Art] Изображение сохранено: {image_path}")
+    await finish_image_job(operation_id, ImageJobState.DONE, image_path=image_path)
+    if post_id is not None:
+        await attach_image_to_post(post_id, image_path)
+    return image_path
+
+
+@async_log_exception
+async def resume_image_jobs():
+    """
+    Возобновление заданий генерации, прерванных перезапуском бота
+
+    Вызывается при старте: незавершённые операции снова ставятся на опрос, готовые
+    изображения прикрепляются к своим постам. Задания старше YANDEX_ART_JOB_MAX_AGE
+    считаются потерянными.
+    """
+    jobs = await get_pending_image_jobs()
+    if not jobs:
+        return
+    logger.info(f"[Yandex.Art] Возобновление незавершённых заданий генерации изображений: {len(jobs)}")
+    max_age = timedelta(seconds=conf.yandex.art_job_max_age)
+    now = datetime_local()
+
+    async def resume(job):
+        if job.created_at is not None and now - job.created_at > max_age:
+            await finish_image_job(job.operation_id, ImageJobState.FAILED, error_message="Операция устарела")
+            if job.post_id is not None:
+                await attach_image_to_post(job.post_id, None, error_message="Генерация изображения прервана перезапуском")
+            return None
+        return await complete_image_job(job.operation_id, job.post_id)
+
+    results = await asyncio.gather(*(resume(job) for job in jobs), return_exceptions=True)
+    restored = sum(1 for result in results if isinstance(result, str))
+    logger.info(f"[Yandex.Art] Восстановлено изображений после перезапуска: {restored} из {len(jobs)}")
 
 
 @async_log_exception
-async def generate_image(prompt: str, seed: int = 42, aspect_ratio: str = "1:1", style: str = "photorealistic") -> Optional[str]:
+async def generate_image(prompt: str, seed: int = 42, aspect_ratio: str = "1:1", style: str = "photorealistic",
+                         post_id: Optional[int] = None, resumable: bool = True) -> Optional[str]:
     """
     Генерация изображения через Yandex.Art API с дополнительными параметрами
 
@@ -24,6 +95,8 @@ async def generate_image(prompt: str, seed: int = 42, aspect_ratio: str = "1:1",
                      - "natural": реалистичный стиль с естественными цветами
                      - "artistic": художественный стиль
                      - "minimalistic": минималистичный стиль
+        post_id (int): ID поста, к которому нужно прикрепить изображение (в том числе после перезапуска)
+        resumable (bool): Дожидаться операции после перезапуска, если ожидание было прервано
     Returns:
         Optional[str]: Путь к сохраненному изображению или None в случае ошибки
     """
@@ -65,40 +138,64 @@ async def generate_image(prompt: str, seed: int = 42, aspect_ratio: str = "1:1",
     }
     try:
         # Шаг 1: Отправка асинхронного запроса
-        response = requests.post(conf.yandex.art_api_url, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-
-        # Шаг 2: Получение ID операции
-        operation_id = response.json()["id"]
+        async with rate_limiter.slot("yandex_art", "generate"), get_http_session().post(
+                conf.yandex.art_api_url,
+                headers=headers,
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=60)
+        ) as response:
+            if response.status == 429:
+                rate_limiter.pause("yandex_art", "generate", retry_after(response.headers))
+            response.raise_for_status()
+            # Шаг 2: Получение ID операции
+            operation_id = (await response.json())["id"]
         logger.debug(f"[Yandex.Art] Операция создана: {operation_id}")
 
-        # Шаг 3: Ожидание завершения генерации
-        while True:
-            status_response = requests.get(
-                f"https://llm.api.cloud.yandex.net/operations/{operation_id}",
-                headers=headers
-            )
-            status_response.raise_for_status()
-            result = status_response.json()
-            if result.get("done"):
-                # Шаг 4: Декодирование и сохранение изображения
-                image_data = base64.b64decode(result["response"]["image"])
-                # Создаем папку media, если её нет
-                os.makedirs("media", exist_ok=True)
-                # Генерируем уникальное имя файла с датой и временем
-                timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                image_path = f"media/generated_image_{timestamp}.jpg"
-                with open(image_path, "wb") as f:
-                    f.write(image_data)
-                logger.debug(f"[Yandex.Art] Изображение сохранено: {image_path}")
-                return image_path
-            logger.debug("[Yandex.Art] Ожидание завершения генерации...")
-            time.sleep(1)
-    except requests.exceptions.RequestException as e:
+        # Шаг 3: Сохранение задания, чтобы дождаться операции и после перезапуска
+        await create_image_job(operation_id, full_prompt, seed, post_id)
+
+        # Шаг 4: Ожидание завершения генерации и сохранение изображения
+        return await complete_image_job(operation_id, post_id, resumable)
+    except aiohttp.ClientResponseError as e:
         error_msg = str(e)
-        if "response" in locals() and response.status_code == 401:
+        if e.status == 401:
             error_msg += " | Проверьте IAM-токен и роль сервисного аккаунта (ai.imageGeneration.user)"
-        elif "response" in locals() and response.status_code == 400:
+        elif e.status == 400:
             error_msg += " | Некорректные параметры запроса (проверьте пропорции и зерно)"
         logger.exception(f"[Ошибка Yandex.Art] {error_msg}")
+        if post_id is not None:
+            await attach_image_to_post(post_id, None, error_message=f"Ошибка генерации изображения: {error_msg}")
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError, OperationError) as e:
+        logger.exception(f"[Ошибка Yandex.Art] {e}")
+        if post_id is not None:
+            await attach_image_to_post(post_id, None, error_message=f"Ошибка генерации изображения: {e}")
         return None
+
+
+# Верхняя граница зерна генерации Yandex.Art
+MAX_SEED = 2 ** 31 - 1
+# Альбом Telegram вмещает не больше 10 изображений
+MAX_VARIANTS = 10
+
+
+async def generate_image_variants(prompt: str, count: int, **kwargs) -> List[str]:
+    """
+    Генерация нескольких вариантов изображения с разными зёрнами
+
+    Все операции отправляются одновременно (очередь и лимиты — в rate_limiter), поэтому
+    N вариантов готовы примерно за то же время, что и один. Варианты не прикрепляются к посту:
+    выбранный вариант сохраняется вызывающим кодом. Задания не возобновляются после перезапуска.
+
+    Args:
+        prompt (str): Описание изображения
+        count (int): Количество вариантов (не больше MAX_VARIANTS)
+        **kwargs: Остальные параметры generate_image (aspect_ratio, style)
+
+    Returns:
+        List[str]: Пути к успешно сгенерированным вариантам (в порядке зёрен)
+    """
+    seeds = random.sample(range(1, MAX_SEED), min(max(count, 1), MAX_VARIANTS))
+    logger.debug(f"[Yandex.Art] Генерация {len(seeds)} вариантов изображения, зёрна: {seeds}")
+    paths = await asyncio.gather(*(generate_image(prompt, seed=seed, resumable=False, **kwargs) for seed in seeds))
+    return [path for path in paths if path]
@@ -0,0 +1,230 @@
+# yandex_art/poller.py
+import asyncio
+import aiohttp
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from ai_providers.http_session import get_http_session
+from ai_providers.rate_limiter import rate_limiter, retry_after
+from config.env import conf
+from config.logging_config import logger
+
+# Минимальный интервал между опросами одной операции (секунды)
+MIN_POLL_INTERVAL = 0.5
+# Множитель экспоненциальной задержки между опросами
+BACKOFF_FACTOR = 1.5
+# Доля от среднего времени генерации, через которую выполняется первый опрос
+FIRST_POLL_RATIO = 0.8
+# Коэффициент сглаживания среднего времени генерации (EMA)
+RENDER_TIME_SMOOTHING = 0.2
+
+
+class OperationError(Exception):
+    """Операция Yandex.Art завершилась ошибкой"""
+
+
+@dataclass
+class PendingOperation:
+    operation_id: str
+    future: asyncio.Future
+    submitted_at: float
+    deadline: float
+    next_poll_at: float
+    interval: float
+    polls: int = field(default=0)
+    # Сколько корутин ждут операцию (одну операцию могут ждать, например, диалог и возобновление генерации)
+    waiters: int = field(default=0)
+
+
+class OperationPoller:
+    """
+    Опрос асинхронных операций Yandex.Art
+
+    Один фоновый цикл обслуживает все ожидающие операции: на каждом шаге опрашиваются
+    только те операции, у которых подошло время следующей проверки, после чего цикл
+    засыпает до ближайшего срока. Интервалы опроса растут экспоненциально и
+    подстраиваются под наблюдаемое среднее время генерации изображения.
+    """
+
+    def __init__(self, operations_url: str, timeout: float, max_interval: float, expected_render_time: float):
+        self.operations_url = operations_url.rstrip("/")
+        self.timeout = timeout
+        self.max_interval = max_interval
+        self.avg_render_time = expected_render_time
+        self._pending: Dict[str, PendingOperation] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        """Количество операций, ожидающих завершения"""
+        return len(self._pending)
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {conf.yandex.art_api_key}"}
+
+    def _ensure_running(self):
+        """Запуск фонового цикла опроса, если он ещё не работает"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="yandex-art-poller")
+            self._task.add_done_callback(self._on_run_done)
+
+    def _on_run_done(self, task: asyncio.Task):
+        """Цикл опроса упал: ожидающие операции не должны зависнуть до дедлайна"""
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error(f"[Yandex.Art] Цикл опроса остановлен ошибкой: {task.exception()}")
+        for op in list(self._pending.values()):
+            self._finish(op, exception=OperationError(f"Цикл опроса операций остановлен ошибкой: {task.exception()}"))
+
+    async def wait(self, operation_id: str, timeout: Optional[float] = None) -> dict:
+        """
+        Ожидание завершения операции
+
+        Args:
+            operation_id (str): ID операции Yandex.Art
+            timeout (float): Максимальное время ожидания (по умолчанию из конфига)
+
+        Returns:
+            dict: Поле "response" завершённой операции
+
+        Raises:
+            asyncio.TimeoutError: Операция не завершилась за отведённое время
+            OperationError: Операция завершилась ошибкой
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        operation = self._pending.get(operation_id)
+        if operation is None or operation.future.done():
+            first_delay = min(max(self.avg_render_time * FIRST_POLL_RATIO, MIN_POLL_INTERVAL), self.max_interval)
+            operation = PendingOperation(
+                operation_id=operation_id,
+                future=loop.create_future(),
+                submitted_at=now,
+                deadline=now + (timeout or self.timeout),
+                next_poll_at=now + first_delay,
+                interval=max(MIN_POLL_INTERVAL, self.avg_render_time * 0.1)
+            )
+            self._pending[operation_id] = operation
+        self._ensure_running()
+        self._wakeup.set()
+        operation.waiters += 1
+        try:
+            # Отмена одного ожидающего не должна отменять операцию для остальных
+            return await asyncio.shield(operation.future)
+        finally:
+            operation.waiters -= 1
+            if operation.waiters == 0 and not operation.future.done():
+                # Операцию больше никто не ждёт: цикл перестаёт её опрашивать
+                operation.future.cancel()
+
+    async def _run(self):
+        """Фоновый цикл опроса всех ожидающих операций"""
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            # Убираем операции, ожидание которых отменено
+            for operation_id in [op_id for op_id, op in self._pending.items() if op.future.done()]:
+                self._pending.pop(operation_id, None)
+            if not self._pending:
+                break
+            now = loop.time()
+            due = [op for op in self._pending.values() if op.next_poll_at <= now or op.deadline <= now]
+            if not due:
+                next_at = min(min(op.next_poll_at, op.deadline) for op in self._pending.values())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(next_at - now, 0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await asyncio.gather(*(self._poll_safe(op) for op in due))
+        logger.debug("[Yandex.Art] Нет ожидающих операций, цикл опроса остановлен")
+
+    async def _poll_safe(self, op: PendingOperation):
+        """Проверка статуса операции: непредвиденная ошибка завершает только эту операцию, а не весь цикл"""
+        try:
+            await self._poll(op)
+        except Exception as e:
+            logger.error(f"[Yandex.Art] Непредвиденная ошибка опроса операции {op.operation_id}: {e}")
+            self._finish(op, exception=e)
+
+    async def _poll(self, op: PendingOperation):
+        """Одна проверка статуса операции"""
+        loop = asyncio.get_running_loop()
+        if op.future.done():
+            self._pending.pop(op.operation_id, None)
+            return
+        if loop.time() >= op.deadline:
+            self._finish(op, exception=asyncio.TimeoutError(
+                f"Операция {op.operation_id} не завершилась за {op.deadline - op.submitted_at:.0f} с"))
+            return
+        op.polls += 1
+        try:
+            async with rate_limiter.slot("yandex_art", "operations"), get_http_session().get(
+                    f"{self.operations_url}/{op.operation_id}",
+                    headers=self._headers(),
+                    timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                if response.status == 429:
+                    rate_limiter.pause("yandex_art", "operations", retry_after(response.headers))
+                if 400 <= response.status < 500 and response.status != 429:
+                    error_text = await response.text()
+                    self._finish(op, exception=OperationError(f"Yandex.Art operations API error: {response.status} - {error_text}"))
+                    return
+                response.raise_for_status()
+                result = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Временные ошибки сети и 5xx не прерывают ожидание — повторим позже
+            logger.warning(f"[Yandex.Art] Ошибка опроса операции {op.operation_id}: {e}")
+            self._schedule_next(op)
+            return
+        if not result.get("done"):
+            logger.debug(f"[Yandex.Art] Операция {op.operation_id} ещё выполняется (опрос №{op.polls})")
+            self._schedule_next(op)
+            return
+        if "error" in result:
+            self._finish(op, exception=OperationError(f"Операция {op.operation_id} завершилась ошибкой: {result['error']}"))
+            return
+        render_time = loop.time() - op.submitted_at
+        self.avg_render_time += RENDER_TIME_SMOOTHING * (render_time - self.avg_render_time)
+        logger.debug(f"[Yandex.Art] Операция {op.operation_id} завершена за {render_time:.1f} с "
+                     f"({op.polls} опросов, среднее время генерации {self.avg_render_time:.1f} с)")
+        self._finish(op, result=result.get("response", {}))
+
+    def _schedule_next(self, op: PendingOperation):
+        loop = asyncio.get_running_loop()
+        op.next_poll_at = min(loop.time() + op.interval, op.deadline)
+        op.interval = min(op.interval * BACKOFF_FACTOR, self.max_interval)
+
+    def _finish(self, op: PendingOperation, result: Optional[dict] = None, exception: Optional[BaseException] = None):
+        self._pending.pop(op.operation_id, None)
+        if op.future.done():
+            return
+        if exception is not None:
+            op.future.set_exception(exception)
+        else:
+            op.future.set_result(result)
+
+    async def close(self):
+        """Остановка цикла опроса (вызывается при остановке бота)"""
+        for op in list(self._pending.values()):
+            if not op.future.done():
+                op.future.cancel()
+        self._pending.clear()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+
+# Глобальный экземпляр поллера
+poller = OperationPoller(
+    operations_url=conf.yandex.art_operations_url,
+    timeout=conf.yandex.art_poll_timeout,
+    max_interval=conf.yandex.art_poll_max_interval,
+    expected_render_time=conf.yandex.art_expected_render_time
+)
@@ -1,11 +1,28 @@
 # yandex_gpt/client.py
+import asyncio
 import json
 import aiohttp
+from typing import AsyncIterator, List, Optional
+from ai_providers.errors import ProviderUnavailableError
+from ai_providers.http_session import get_http_session
+from ai_providers.rate_limiter import rate_limiter, retry_after
 from config.env import conf
 from config.logging_config import logger, async_log_exception
 
 # Глобальный экземпляр клиента
 _client = None
+# Таймаут одного запроса к YandexGPT (секунды)
+REQUEST_TIMEOUT = 30
+# Температура генерации для разных задач
+THEMES_TEMPERATURE = 0.7
+TEXT_TEMPERATURE = 0.5
+IMAGE_PROMPT_TEMPERATURE = 0.3
+
+
+def _is_unavailable_status(status: int) -> bool:
+    """Статусы, при которых YandexGPT считается временно недоступным (5xx и 429)"""
+    return status >= 500 or status == 429
+
 
 class YandexGPTClient:
     def __init__(self):
@@ -24,6 +41,16 @@ class YandexGPTClient:
         """
         return self.gpt_model
 
+    @staticmethod
+    async def _handle_error_status(response: aiohttp.ClientResponse):
+        """Логирование ошибки API; при 5xx и 429 — ProviderUnavailableError"""
+        error_text = await response.text()
+        logger.error(f"YandexGPT API error: {response.status} - {error_text}")
+        if response.status == 429:
+            rate_limiter.pause("yandex_gpt", "completion", retry_after(response.headers))
+        if _is_unavailable_status(response.status):
+            raise ProviderUnavailableError(f"YandexGPT API error: {response.status}")
+
     async def _make_request(self, prompt_data: dict):
         """Базовый метод для выполнения запросов к YandexGPT"""
         headers = {
@@ -31,36 +58,81 @@ class YandexGPTClient:
             "Content-Type": "application/json"
         }
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                        self.api_url,
-                        headers=headers,
-                        json=prompt_data,
-                        timeout=30
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"YandexGPT API error: {response.status} - {error_text}")
-                        return None
-                    return await response.json()
+            # Используем общую сессию процесса, чтобы переиспользовать TCP/TLS-соединения
+            session = get_http_session()
+            async with rate_limiter.slot("yandex_gpt", "completion"), session.post(
+                    self.api_url,
+                    headers=headers,
+                    json=prompt_data,
+                    timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            ) as response:
+                if response.status != 200:
+                    await self._handle_error_status(response)
+                    return None
+                return await response.json()
+        except ProviderUnavailableError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Сетевые ошибки и таймауты — повод отправить запрос другому провайдеру
+            logger.error(f"Ошибка при запросе к YandexGPT: {e!r}")
+            raise ProviderUnavailableError(f"YandexGPT недоступен: {e!r}") from e
         except Exception as e:
             logger.error(f"Ошибка при запросе к YandexGPT: {e}", exc_info=True)
             return None
 
+    async def _stream_request(self, prompt_data: dict) -> AsyncIterator[dict]:
+        """Потоковый запрос к YandexGPT: ответ приходит по одному JSON-объекту на строку"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        session = get_http_session()
+        # Слот ограничителя занят, пока читается поток
+        async with rate_limiter.slot("yandex_gpt", "completion"), session.post(
+                self.api_url,
+                headers=headers,
+                json=prompt_data,
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=REQUEST_TIMEOUT)
+        ) as response:
+            if response.status != 200:
+                await self._handle_error_status(response)
+                raise Exception(f"Не удалось получить ответ от YandexGPT: {response.status}")
+            async for line in response.content:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def _get_client() -> YandexGPTClient:
+    """Возвращает глобальный экземпляр клиента YandexGPT"""
+    global _client
+    if _client is None:
+        _client = YandexGPTClient()
+    return _client
+
+
+def _themes_user_prompt(count: int, exclude: Optional[List[str]] = None) -> str:
+    """Запрос пользователя на генерацию тем с учётом уже имеющихся"""
+    prompt = f"Сгенерируй {count} уникальных тем для постов о путешествиях, избегая повторов и стандартных примеров"
+    if exclude:
+        prompt += "\nНе повторяй эти темы и их направления:\n" + "\n".join(f"- {theme}" for theme in exclude)
+    return prompt
+
 
 @async_log_exception
-async def generate_travel_themes(model: str = "yandexgpt/latest", count: int = 4) -> dict:
+async def generate_travel_themes(model: str = "yandexgpt/latest", count: int = 4, exclude: Optional[List[str]] = None) -> dict:
     """
     Генерация уникальных тем для постов о путешествиях
 
     Args:
         model (str): Модель YandexGPT
         count (int): Количество тем для генерации
+        exclude (list): Уже имеющиеся темы, которые нельзя повторять
 
     Returns:
-        dict: {'themes': ["тема1", "тема2", ...]}
+        dict: {'themes': ["тема1", "тема2", ...]}; при ошибке — запасные темы и флаг 'fallback': True
     """
-    client = YandexGPTClient()
+    client = _get_client()
     system_prompt = f"""Ты эксперт по путешествиям. Строго следуй инструкциям.
 
     ЗАДАЧА:
@@ -92,12 +164,12 @@ async def generate_travel_themes(model: str = "yandexgpt/latest", count: int = 4
         "modelUri": client.model_uri,
         "completionOptions": {
             "stream": False,
-            "temperature": 0.7,
+            "temperature": THEMES_TEMPERATURE,
             "maxTokens": 2000
         },
         "messages": [
             {"role": "system", "text": system_prompt},
-            {"role": "user", "text": f"Сгенерируй {count} уникальных тем для постов о путешествиях, избегая повторов и стандартных примеров"}
+            {"role": "user", "text": _themes_user_prompt(count, exclude)}
         ]
     }
     response = await client._make_request(request_data)
@@ -110,7 +182,8 @@ async def generate_travel_themes(model: str = "yandexgpt/latest", count: int = 4
                 "🏰 Исторические сокровища Италии",
                 "🌌 Ночные приключения под звёздным небом Сахары",
                 "🍜 Гастрономическое путешествие по уличным рынкам Бангкока"
-            ]
+            ],
+            "fallback": True
         }
     # Парсим ответ
     try:
@@ -121,8 +194,11 @@ async def generate_travel_themes(model: str = "yandexgpt/latest", count: int = 4
         if not isinstance(parsed, dict) or "themes" not in parsed:
             raise ValueError("Некорректная структура JSON: отсутствует ключ 'themes'")
         themes = parsed["themes"]
-        if not isinstance(themes, list) or len(themes) != count:
-            raise ValueError(f"Количество тем не равно {count}")
+        if not isinstance(themes, list) or not themes:
+            raise ValueError("Список тем пуст")
+        if len(themes) != count:
+            logger.warning(f"822.97 [YandexGPT] Получено {len(themes)} тем вместо {count}")
+        themes = themes[:count]
         logger.info(f"822.80 [YandexGPT] Сгенерированы темы: {themes}")
         return {"themes": themes}
     except (json.JSONDecodeError, KeyError, ValueError) as e:
@@ -138,25 +214,13 @@ async def generate_travel_themes(model: str = "yandexgpt/latest", count: int = 4
                 "🌿 Эко-путешествия по скрытым уголкам Амазонки",
                 "🏔️ Экстремальные треккинги в горах Патагонии",
                 "🎨 Арт-туры по скрытым галереям Парижа"
-            ]
+            ],
+            "fallback": True
         }
 
 
-@async_log_exception
-async def generate_text(prompt: str, model: str = "yandexgpt/latest", max_tokens: int = 500, style: str = "casual") -> str:
-    """
-    Генерация текста через YandexGPT API с возможностью выбора стиля
-
-    Args:
-        prompt (str): Текстовый запрос
-        model (str): Модель YandexGPT
-        max_tokens (int): Максимальное количество токенов в ответе
-        style (str): Стиль текста (casual, professional, humorous, poetic)
-
-    Returns:
-        str: Сгенерированный текст
-    """
-    client = YandexGPTClient()
+def _build_text_request(client: YandexGPTClient, prompt: str, max_tokens: int, style: str, stream: bool) -> dict:
+    """Формирование тела запроса на генерацию текста поста"""
     # Определяем стиль текста
     style_instructions = {
         "casual": "Используйте дружелюбный и непринужденный стиль, как будто вы разговариваете с другом.",
@@ -171,11 +235,11 @@ async def generate_text(prompt: str, model: str = "yandexgpt/latest", max_tokens
 
     {selected_style}
     Вопросы пользователю не задавайте."""
-    request_data = {
+    return {
         "modelUri": client.model_uri,
         "completionOptions": {
-            "stream": False,
-            "temperature": 0.5,
+            "stream": stream,
+            "temperature": TEXT_TEMPERATURE,
             "maxTokens": max_tokens
         },
         "messages": [
@@ -183,6 +247,24 @@ async def generate_text(prompt: str, model: str = "yandexgpt/latest", max_tokens
             {"role": "user", "text": prompt}
         ]
     }
+
+
+@async_log_exception
+async def generate_text(prompt: str, model: str = "yandexgpt/latest", max_tokens: int = 500, style: str = "casual") -> str:
+    """
+    Генерация текста через YandexGPT API с возможностью выбора стиля
+
+    Args:
+        prompt (str): Текстовый запрос
+        model (str): Модель YandexGPT
+        max_tokens (int): Максимальное количество токенов в ответе
+        style (str): Стиль текста (casual, professional, humorous, poetic)
+
+    Returns:
+        str: Сгенерированный текст
+    """
+    client = _get_client()
+    request_data = _build_text_request(client, prompt, max_tokens, style, stream=False)
     response = await client._make_request(request_data)
     if not response or "result" not in response:
         logger.error("[YandexGPT] Не удалось получить ответ от API")
@@ -195,6 +277,40 @@ async def generate_text(prompt: str, model: str = "yandexgpt/latest", max_tokens
         raise Exception(f"Ошибка извлечения текста из ответа YandexGPT: {e}")
 
 
+async def generate_text_stream(prompt: str, model: str = "yandexgpt/latest", max_tokens: int = 500,
+                               style: str = "casual") -> AsyncIterator[str]:
+    """
+    Потоковая генерация текста через YandexGPT API (completionOptions.stream=true)
+
+    Args:
+        prompt (str): Текстовый запрос
+        model (str): Модель YandexGPT
+        max_tokens (int): Максимальное количество токенов в ответе
+        style (str): Стиль текста (casual, professional, humorous, poetic)
+
+    Yields:
+        str: Текст, сгенерированный к текущему моменту (каждый раз целиком, а не приращение)
+    """
+    client = _get_client()
+    request_data = _build_text_request(client, prompt, max_tokens, style, stream=True)
+    text = ""
+    try:
+        async for chunk in client._stream_request(request_data):
+            # YandexGPT в каждом фрагменте возвращает весь накопленный текст
+            partial = chunk["result"]["alternatives"][0]["message"]["text"]
+            if partial != text:
+                text = partial
+                yield text
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"[YandexGPT] Ошибка соединения при потоковой генерации текста: {e!r}")
+        raise ProviderUnavailableError(f"YandexGPT недоступен: {e!r}") from e
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        logger.error(f"[YandexGPT] Ошибка потоковой генерации текста: {e}")
+        raise Exception(f"Ошибка потоковой генерации текста YandexGPT: {e}")
+    if not text:
+        raise Exception("Не удалось получить ответ от YandexGPT")
+
+
 @async_log_exception
 async def generate_image_prompt(post_text: str) -> str:
     """
@@ -206,7 +322,7 @@ async def generate_image_prompt(post_text: str) -> str:
     Returns:
         str: Промпт для генерации изображения
     """
-    client = YandexGPTClient()
+    client = _get_client()
     system_prompt = """Вы SMM-эксперт и визуальный дизайнер. 
     На основе текста поста сгенерируйте подробное описание изображения (20-25 слов), подходящее к тексту. 
     Включите в описание основные элементы, которые должны быть на изображении:
@@ -219,7 +335,7 @@ async def generate_image_prompt(post_text: str) -> str:
         "modelUri": client.model_uri,
         "completionOptions": {
             "stream": False,
-            "temperature": 0.3,
+            "temperature": IMAGE_PROMPT_TEMPERATURE,
             "maxTokens": 300
         },
         "messages": [
@@ -244,7 +360,4 @@ async def generate_image_prompt(post_text: str) -> str:
 @async_log_exception
 async def get_current_model() -> str:
     """Возвращает текущую модель YandexGPT из глобального клиента"""
-    global _client
-    if _client is None:
-        _client = YandexGPTClient()
-    return _client.get_model()
+    return _get_client().get_model()